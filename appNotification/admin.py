@@ -1,11 +1,21 @@
 from django.contrib import admin
-from .models import Post, Response, News, Category, Subscription
+from .models import Post, Response, News, Category, Subscription, OutboxMessage, DeadLetter, DigestRun, DigestShard
+from .audience import NEWS, category_audience
+from .outbox import replay_dead_letters
+from .planning import plan_digest, plan_news, plan_post
+from .segments import segment_index
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'category', 'created_at', 'notify_subscribers']
     list_filter = ['category', 'created_at', 'notify_subscribers']
     list_editable = ['notify_subscribers']
+    actions = ['plan_notification']
+
+    @admin.action(description='Dry-run subscriber notification')
+    def plan_notification(self, request, queryset):
+        for post in queryset:
+            self.message_user(request, str(plan_post(post)))
 
 @admin.register(Response)
 class ResponseAdmin(admin.ModelAdmin):
@@ -18,13 +28,99 @@ class NewsAdmin(admin.ModelAdmin):
     list_display = ['title', 'created_at', 'views_count', 'notify_subscribers']
     list_filter = ['created_at', 'notify_subscribers']
     list_editable = ['notify_subscribers']
+    actions = ['plan_notification']
+
+    @admin.action(description='Dry-run subscriber notification')
+    def plan_notification(self, request, queryset):
+        for news in queryset:
+            self.message_user(request, str(plan_news(news)))
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'value']
+    list_display = ['name', 'value', 'subscribers', 'news_subscribers']
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # Одна матрица на страницу списка вместо двух обращений к индексу на каждую строку
+        matrix = segment_index.get()
+        for category in changelist.result_list:
+            category.segments = matrix
+        return changelist
+
+    @admin.display(description='Subscribers')
+    def subscribers(self, obj):
+        return obj.segments.count(any_of=[category_audience(obj.value)])
+
+    @admin.display(description='Also subscribed to news')
+    def news_subscribers(self, obj):
+        return obj.segments.count(all_of=[category_audience(obj.value), NEWS])
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ['user', 'category', 'news', 'created_at']
     list_filter = ['news', 'created_at']
 
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['template_key', 'context_id', 'recipient', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'template_key', 'created_at']
+    search_fields = ['recipient', 'last_error']
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ['message', 'reason', 'error_code', 'created_at', 'replayed_at']
+    list_filter = ['reason', 'error_code', 'created_at', 'replayed_at']
+    search_fields = ['message__recipient', 'error']
+    list_select_related = ['message']
+    actions = ['replay']
+
+    @admin.action(description='Replay selected messages')
+    def replay(self, request, queryset):
+        count = replay_dead_letters(queryset)
+        self.message_user(request, f'{count} messages returned to the outbox')
+
+class DigestShardInline(admin.TabularInline):
+    model = DigestShard
+    fields = ['first_user_id', 'last_user_id', 'checkpoint_user_id', 'status', 'total', 'sent', 'failed',
+              'skipped', 'updated_at']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+@admin.register(DigestRun)
+class DigestRunAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'period', 'bucket', 'status', 'total', 'sent', 'failed', 'remaining', 'rate',
+                    'started_at', 'finished_at']
+    list_filter = ['kind', 'status', 'bucket']
+    readonly_fields = ['kind', 'period', 'bucket', 'timezones', 'start_date', 'end_date', 'status', 'total',
+                       'started_at', 'finished_at']
+    inlines = [DigestShardInline]
+    actions = ['plan_next_runs']
+
+    @admin.action(description='Dry-run this week\'s digests')
+    def plan_next_runs(self, request, queryset):
+        # Оценка не зависит от выбранных строк: планируются запуски текущей недели
+        for kind in ('newsletter', 'posts'):
+            self.message_user(request, str(plan_digest(kind)))
+
+    def _progress(self, obj):
+        # Одна агрегация на строку списка вместо отдельной на каждую колонку
+        if not hasattr(obj, '_progress'):
+            obj._progress = obj.progress()
+        return obj._progress
+
+    @admin.display(description='Sent')
+    def sent(self, obj):
+        return self._progress(obj)['sent']
+
+    @admin.display(description='Failed')
+    def failed(self, obj):
+        return self._progress(obj)['failed']
+
+    @admin.display(description='Remaining')
+    def remaining(self, obj):
+        return self._progress(obj)['remaining']
+
+    @admin.display(description='Messages/s')
+    def rate(self, obj):
+        return self._progress(obj)['rate']
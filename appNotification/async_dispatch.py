@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .mail import DispatchResult, PooledConnection, admit, recipient_domain, send_one
+from .metrics import increment
+
+logger = logging.getLogger(__name__)
+
+# Сигнал сессии, что писем больше не будет
+STOP = object()
+
+
+class Session:
+    """
+    Одна SMTP-сессия диспетчера. smtplib блокирующий и не потокобезопасный,
+    поэтому у каждой сессии свой поток, в котором живет её соединение.
+    """
+
+    def __init__(self, number, connection_factory=None, rate_limited=True):
+        self.number = number
+        self.pool = PooledConnection(connection_factory)
+        self.rate_limited = rate_limited
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'smtp-session-{number}')
+
+    def _send(self, message):
+        # Выполняется в потоке сессии: ожидание токена блокирует только эту сессию
+        wait, reason = admit(recipient_domain(message), self.rate_limited)
+        if wait:
+            return 'deferred', (wait, reason)
+        try:
+            send_one(message, self.pool)
+            return 'sent', None
+        except Exception as e:
+            return 'failed', e
+
+    async def run(self, queue, result):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message = await queue.get()
+                try:
+                    if message is STOP:
+                        return
+                    outcome, detail = await loop.run_in_executor(self.executor, self._send, message)
+                    if outcome == 'sent':
+                        result.sent.append(message)
+                    elif outcome == 'deferred':
+                        wait, reason = detail
+                        result.defer([message], wait)
+                        increment(f'smtp_{reason}')
+                    else:
+                        logger.error(f"Error sending email to {', '.join(message.to)} "
+                                     f"(session {self.number}): {detail}")
+                        result.failed.append((message, detail))
+                except Exception as e:
+                    # Ошибка одной сессии не должна останавливать остальные
+                    logger.error(f"SMTP session {self.number} error: {e}")
+                    if message is not STOP:
+                        result.failed.append((message, e))
+                finally:
+                    queue.task_done()
+        finally:
+            await loop.run_in_executor(self.executor, self.pool.reset)
+            self.executor.shutdown(wait=False)
+
+
+async def dispatch(messages, sessions=None, queue_size=None, connection_factory=None, rate_limited=True):
+    """
+    Раздает письма из messages (список или ленивый итератор, например по аудитории)
+    нескольким параллельным SMTP-сессиям через ограниченную очередь: когда сессии
+    не успевают, источник ждет, и в памяти держится не больше queue_size писем.
+    """
+    sessions = sessions or settings.NOTIFICATION_ASYNC_SESSIONS
+    queue = asyncio.Queue(maxsize=queue_size or settings.NOTIFICATION_ASYNC_QUEUE_SIZE)
+    result = DispatchResult()
+    loop = asyncio.get_running_loop()
+
+    workers = [Session(number, connection_factory, rate_limited) for number in range(1, sessions + 1)]
+    tasks = [asyncio.create_task(worker.run(queue, result)) for worker in workers]
+
+    # Итератор может читать из БД, а соединение Django привязано к потоку, поэтому все его шаги идут в одном потоке
+    producer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smtp-producer')
+    iterator = iter(messages)
+    try:
+        while True:
+            message = await loop.run_in_executor(producer, next, iterator, STOP)
+            if message is STOP:
+                break
+            await queue.put(message)
+    finally:
+        for _ in workers:
+            await queue.put(STOP)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await loop.run_in_executor(producer, connections.close_all)
+        producer.shutdown(wait=False)
+
+    return result
+
+
+def send_messages_concurrently(messages, sessions=None, connection_factory=None, rate_limited=True):
+    """Синхронная обертка для задач Celery и management-команд"""
+    return asyncio.run(dispatch(messages, sessions=sessions, connection_factory=connection_factory,
+                                rate_limited=rate_limited))
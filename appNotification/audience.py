@@ -0,0 +1,227 @@
+import logging
+
+from django.conf import settings
+from redis.exceptions import WatchError
+
+logger = logging.getLogger(__name__)
+
+INDEX_PREFIX = 'audience:'
+BUILT_PREFIX = 'audience_built:'
+VERSION_PREFIX = 'audience_version:'
+REBUILD_ATTEMPTS = 3
+
+# Аудитория новостей; аудитории категорий называются category:<value>
+NEWS = 'news'
+
+
+def category_audience(value):
+    return f'category:{value}'
+
+
+def audiences_of(subscription):
+    """Аудитории, в которые входит подписчик по этой подписке"""
+    names = []
+    if subscription.category_id:
+        names.append(category_audience(subscription.category.value))
+    if subscription.news:
+        names.append(NEWS)
+    return names
+
+
+def previous_audiences_of(subscription):
+    """Аудитории подписки до сохранения (по снимку TrackedFieldsMixin)"""
+    from .models import Category
+
+    names = []
+    category_id = subscription.previous('category_id')
+    if category_id == subscription.category_id:
+        names.extend(name for name in audiences_of(subscription) if name != NEWS)
+    elif category_id:
+        value = Category.objects.filter(id=category_id).values_list('value', flat=True).first()
+        if value is not None:
+            names.append(category_audience(value))
+    if subscription.previous('news'):
+        names.append(NEWS)
+    return names
+
+
+def held_audiences(user_id):
+    """Аудитории, которые пользователю дают его текущие подписки"""
+    from .models import Subscription
+
+    names = set()
+    for value, news in Subscription.objects.filter(user_id=user_id).values_list('category__value', 'news'):
+        if value is not None:
+            names.add(category_audience(value))
+        if news:
+            names.add(NEWS)
+    return names
+
+
+def _subscriptions(name):
+    from .models import Subscription
+
+    if name == NEWS:
+        return Subscription.objects.filter(news=True)
+    return Subscription.objects.filter(category__value=name.partition(':')[2])
+
+
+def _query_user_ids(name):
+    return _subscriptions(name).order_by('user_id').values_list('user_id', flat=True).distinct()
+
+
+class DatabaseBackend:
+    """Без общего Redis индекс не кешируется: кеш в памяти процесса разошелся бы между веб-процессом и воркерами"""
+
+    def add(self, name, user_id):
+        pass
+
+    def remove(self, name, user_id):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def size(self, name):
+        return _query_user_ids(name).count()
+
+    def contains(self, name, user_id):
+        return _subscriptions(name).filter(user_id=user_id).exists()
+
+    def user_ids(self, name, first_user_id=None, last_user_id=None):
+        user_ids = _query_user_ids(name)
+        if first_user_id is not None:
+            user_ids = user_ids.filter(user_id__gte=first_user_id)
+        if last_user_id is not None:
+            user_ids = user_ids.filter(user_id__lte=last_user_id)
+        return list(user_ids)
+
+
+class RedisBackend:
+    """
+    Аудитория — sorted set в Redis с id пользователя в качестве score: размер и
+    членство за O(1), диапазон id для чанка рассылки — одним ZRANGEBYSCORE.
+    Отметка построения живет NOTIFICATION_AUDIENCE_TTL, после чего индекс
+    пересобирается из БД и расхождения (правки в админке, каскадные удаления) исчезают.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def _built_key(self, name):
+        generation = self._client.get(f'{BUILT_PREFIX}generation') or b'0'
+        return f'{BUILT_PREFIX}{generation.decode()}:{name}'
+
+    def _ensure(self, name):
+        built_key = self._built_key(name)
+        if self._client.exists(built_key):
+            return
+        key = INDEX_PREFIX + name
+        staging = f'{key}:rebuild'
+        version_key = VERSION_PREFIX + name
+        # add/remove увеличивают версию аудитории: если подписка изменилась, пока шла выборка,
+        # снимок из БД устарел, и EXEC не опубликует его поверх правки, а выборка повторится
+        for attempt in range(REBUILD_ATTEMPTS):
+            with self._client.pipeline() as pipe:
+                pipe.watch(version_key)
+                user_ids = list(_query_user_ids(name))
+                pipe.multi()
+                pipe.delete(staging)
+                for start in range(0, len(user_ids), 10000):
+                    pipe.zadd(staging, {user_id: user_id for user_id in user_ids[start:start + 10000]})
+                if user_ids:
+                    pipe.rename(staging, key)
+                else:
+                    pipe.delete(key)
+                pipe.set(built_key, 1, ex=int(settings.NOTIFICATION_AUDIENCE_TTL.total_seconds()))
+                try:
+                    pipe.execute()
+                except WatchError:
+                    continue
+            logger.info(f"Rebuilt audience index {name}: {len(user_ids)} subscribers")
+            return
+        raise WatchError(f"Audience {name} kept changing during {REBUILD_ATTEMPTS} rebuild attempts")
+
+    def add(self, name, user_id):
+        self._client.incr(VERSION_PREFIX + name)
+        # Пока индекс не построен, правку учтет пересборка из БД
+        if self._client.exists(self._built_key(name)):
+            self._client.zadd(INDEX_PREFIX + name, {user_id: user_id})
+
+    def remove(self, name, user_id):
+        self._client.incr(VERSION_PREFIX + name)
+        self._client.zrem(INDEX_PREFIX + name, user_id)
+
+    def invalidate(self):
+        self._client.incr(f'{BUILT_PREFIX}generation')
+
+    def size(self, name):
+        self._ensure(name)
+        return self._client.zcard(INDEX_PREFIX + name)
+
+    def contains(self, name, user_id):
+        self._ensure(name)
+        return self._client.zscore(INDEX_PREFIX + name, user_id) is not None
+
+    def user_ids(self, name, first_user_id=None, last_user_id=None):
+        self._ensure(name)
+        return [int(user_id) for user_id in self._client.zrangebyscore(
+            INDEX_PREFIX + name,
+            '-inf' if first_user_id is None else first_user_id,
+            '+inf' if last_user_id is None else last_user_id,
+        )]
+
+
+class AudienceIndex:
+    """
+    Индекс подписчиков по аудиториям (новости и каждая категория). Поддерживается
+    подписками и отписками, при отсутствии или устаревании собирается из БД заново.
+    """
+
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = DatabaseBackend()
+            if 'django_redis' in settings.CACHES['default']['BACKEND']:
+                try:
+                    from django_redis import get_redis_connection
+                    self._backend = RedisBackend(get_redis_connection('default'))
+                except Exception as e:
+                    logger.warning(f"Redis audience index unavailable, querying subscriptions directly: {e}")
+        return self._backend
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            # Индекс — ускорение, а не источник истины: при сбое Redis читаем подписки
+            logger.warning(f"Audience index {method} failed, falling back to the database: {e}")
+            return getattr(DatabaseBackend(), method)(*args)
+
+    def add(self, user_id, names):
+        for name in names:
+            self._call('add', name, user_id)
+
+    def remove(self, user_id, names):
+        for name in names:
+            self._call('remove', name, user_id)
+
+    def invalidate(self):
+        """Все аудитории будут собраны из БД заново при следующем обращении"""
+        self._call('invalidate')
+
+    def size(self, name):
+        return self._call('size', name)
+
+    def contains(self, name, user_id):
+        return self._call('contains', name, user_id)
+
+    def user_ids(self, name, first_user_id=None, last_user_id=None):
+        """Упорядоченные id подписчиков, при необходимости в диапазоне [first_user_id, last_user_id]"""
+        return self._call('user_ids', name, first_user_id, last_user_id)
+
+
+audience_index = AudienceIndex()
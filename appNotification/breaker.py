@@ -0,0 +1,113 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import increment
+
+logger = logging.getLogger(__name__)
+
+STATE_PREFIX = 'circuit:'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Предохранитель SMTP-релея, общий для всех воркеров через кеш. Считает долю
+    ошибок и медленных отправок в текущем окне; когда она превышает порог,
+    размыкается, и письма сразу откладываются без обращения к серверу.
+    После паузы одна отправка проходит пробой (half-open): успех замыкает
+    предохранитель, ошибка размыкает его снова.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state_key = f'{STATE_PREFIX}{name}:state'
+
+    @property
+    def config(self):
+        return settings.NOTIFICATION_CIRCUIT_BREAKER
+
+    def _window_key(self, counter, now):
+        return f'{STATE_PREFIX}{self.name}:{int(now // self.config["window"])}:{counter}'
+
+    def _state(self):
+        return cache.get(self.state_key) or (CLOSED, 0)
+
+    def _set_state(self, state, now):
+        cache.set(self.state_key, (state, now), timeout=None)
+
+    def allow(self):
+        """0, если отправлять можно, иначе через сколько секунд повторить"""
+        state, since = self._state()
+        if state == CLOSED:
+            return 0
+
+        now = time.time()
+        pause = self.config['open_seconds']
+        if state == HALF_OPEN:
+            # Проба потерялась вместе с воркером — через probe_timeout разрешаем следующую
+            pause = self.config['probe_timeout']
+        wait = since + pause - now
+        if wait > 0:
+            return wait
+
+        # Пробу получает только один процесс; остальные ждут её результата
+        if cache.add(f'{self.state_key}:probe:{since}', 1, self.config['probe_timeout']):
+            logger.info(f"Circuit {self.name} half-open, probing the server")
+            self._set_state(HALF_OPEN, now)
+            return 0
+        return self.config['probe_timeout']
+
+    def record(self, ok, duration):
+        """Учитывает результат одной отправки"""
+        now = time.time()
+        ok = ok and duration < self.config['slow_call']
+        state, _since = self._state()
+
+        if state == HALF_OPEN:
+            if ok:
+                logger.info(f"Circuit {self.name} closed: probe succeeded")
+                # Ошибки, накопленные до размыкания, не должны сразу разомкнуть его снова
+                cache.delete_many([self._window_key(counter, now) for counter in ('calls', 'failures')])
+                self._set_state(CLOSED, now)
+            else:
+                self._open(now, 'probe failed')
+            return
+        if state == OPEN:
+            return
+
+        calls = self._incr(self._window_key('calls', now))
+        failures_key = self._window_key('failures', now)
+        failures = cache.get(failures_key, 0) if ok else self._incr(failures_key)
+        if calls >= self.config['min_calls'] and failures / calls >= self.config['failure_rate']:
+            self._open(now, f'{failures}/{calls} failed or slow calls')
+
+    def _incr(self, key):
+        cache.add(key, 0, self.config['window'] * 2)
+        return cache.incr(key)
+
+    def _open(self, now, reason):
+        logger.error(f"Circuit {self.name} opened for {self.config['open_seconds']}s: {reason}")
+        self._set_state(OPEN, now)
+        increment('smtp_circuit_opened')
+
+    def snapshot(self):
+        """Состояние для мониторинга"""
+        state, since = self._state()
+        now = time.time()
+        keys = [self._window_key(counter, now) for counter in ('calls', 'failures')]
+        values = cache.get_many(keys)
+        return {
+            'state': state,
+            'since': since or None,
+            'window_calls': values.get(keys[0], 0),
+            'window_failures': values.get(keys[1], 0),
+        }
+
+
+smtp_breaker = CircuitBreaker('smtp')
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone, translation
+from django.utils.translation import gettext_lazy as _
+
+from .mail import build_message
+from .rendering import recipient_language, render_email
+
+WINDOW_PREFIX = 'coalesce_window:'
+FLUSH_PREFIX = 'coalesce_flush:'
+DAILY_PREFIX = 'notification_daily:'
+
+
+def enabled():
+    return settings.NOTIFICATION_COALESCE_WINDOW > timedelta(0)
+
+
+def flush_times(user_ids):
+    """
+    Время отправки буфера каждого пользователя. Первое событие открывает окно,
+    следующие до его конца попадают в то же письмо.
+    """
+    user_ids = list(user_ids)
+    window = settings.NOTIFICATION_COALESCE_WINDOW
+    keys = {user_id: f'{WINDOW_PREFIX}{user_id}' for user_id in user_ids}
+
+    opened = cache.get_many(list(keys.values()))
+    flush_at = timezone.now() + window
+    new = {keys[user_id]: flush_at for user_id in user_ids if keys[user_id] not in opened}
+    if new:
+        cache.set_many(new, window.total_seconds())
+
+    return {user_id: opened.get(keys[user_id], flush_at) for user_id in user_ids}
+
+
+def schedule_flush(task, flush_at):
+    """Ставит дренер на конец окна; на одну минуту окна — один отложенный запуск"""
+    marker = f'{FLUSH_PREFIX}{task.name}:{flush_at:%Y%m%d%H%M}'
+    if cache.add(marker, 1, settings.NOTIFICATION_COALESCE_WINDOW.total_seconds() + 60):
+        task.apply_async(eta=flush_at.replace(second=0, microsecond=0) + timedelta(minutes=1))
+
+
+def _take_daily(user_id):
+    """Учитывает письмо в дневном лимите пользователя; False, если лимит исчерпан"""
+    key = f'{DAILY_PREFIX}{user_id}:{timezone.localdate():%Y%m%d}'
+    cache.add(key, 0, 60 * 60 * 24)
+    return cache.incr(key) <= settings.NOTIFICATION_DAILY_CAP
+
+
+def combine(messages):
+    """
+    Склеивает буферизованные события одного получателя в одно письмо.
+    Сверх дневного лимита события с overflow_to_digest не отправляются: их
+    покажет следующий еженедельный дайджест. Возвращает (письма, id outbox ушедших в дайджест).
+    """
+    result = []
+    buffered = defaultdict(list)
+    for message in messages:
+        if message.coalesce_item:
+            buffered[message.to[0]].append(message)
+        else:
+            result.append(message)
+
+    overflow = []
+    for email, group in buffered.items():
+        user_id = group[0].user_id
+        capped = [message for message in group if message.overflow_to_digest]
+        if capped and user_id and not _take_daily(user_id):
+            overflow.extend(outbox_id for message in capped for outbox_id in message.outbox_ids)
+            group = [message for message in group if not message.overflow_to_digest]
+
+        if len(group) == 1:
+            result.append(group[0])
+        elif group:
+            language = recipient_language(getattr(group[0], 'language', None))
+            with translation.override(language):
+                body, html = render_email('appNotification/emails/combined_notifications.txt', {
+                    'name': group[0].recipient_name,
+                    'items': [message.coalesce_item for message in group],
+                    'SITE_URL': settings.SITE_URL,
+                })
+                combined = build_message(_('{} new notifications on MMORPG Portal').format(len(group)), body, email,
+                                         html=html)
+            combined.language = language
+            combined.outbox_ids = [outbox_id for message in group for outbox_id in message.outbox_ids]
+            result.append(combined)
+
+    return result, overflow
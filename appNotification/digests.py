@@ -0,0 +1,313 @@
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import groupby
+
+from django.conf import settings
+from django.utils import translation
+from django.utils.translation import gettext_lazy as _
+
+from . import watermarks
+from .mail import build_message
+from .rendering import SharedBody, group_by_language, render_email, render_shared_body
+
+# Место в общем шаблоне, куда подставляются секции категорий конкретного пользователя
+SECTIONS_PLACEHOLDER = '%%digest_sections%%'
+
+
+class DigestBundle:
+    """Все категории, по которым пользователь получит объявления в одном письме"""
+
+    def __init__(self, user_id, email, first_name, categories, watermark=None, language=None):
+        self.user_id = user_id
+        self.email = email
+        self.first_name = first_name
+        self.categories = categories
+        self.language = language
+        # (created_at, id) последнего материала, который пользователь уже получил
+        self.watermark = watermark
+
+
+class Timeline:
+    """
+    Материалы, упорядоченные по (created_at, id). Срез «новее отметки» находится
+    бисекцией, поэтому пользователи с одинаковой отметкой получают один и тот же срез.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self._keys = [(item.created_at, item.id) for item in items]
+
+    def start(self, watermark, default_since):
+        if watermark is None:
+            # Без отметки — материалы за стандартное окно рассылки
+            watermark = (default_since, sys.maxsize)
+        return bisect_right(self._keys, watermark)
+
+    def newest_first(self, start):
+        return self.items[start:][::-1]
+
+    def high_water(self):
+        return self._keys[-1] if self._keys else None
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class WeeklyNewsletter:
+    """Еженедельная рассылка новостей: одно общее тело письма на подписчиков с одинаковой отметкой"""
+
+    kind = 'newsletter'
+    event = 'newsletter'
+    subject = _('Weekly news digest from our portal')
+
+    def __init__(self, start_date, end_date, since=None, timezones=None):
+        from .models import News
+
+        self.start_date = start_date
+        self.end_date = end_date
+        self.timezones = timezones
+        self.timeline = Timeline(list(News.objects.filter(
+            created_at__gt=since or start_date, created_at__lte=end_date
+        ).order_by('created_at', 'id')))
+        self._bodies = {}
+
+    def __bool__(self):
+        return bool(self.timeline)
+
+    def high_water(self):
+        return self.timeline.high_water()
+
+    def _subscriptions(self):
+        from .models import Subscription
+
+        subscriptions = Subscription.objects.filter(news=True)
+        if self.timezones:
+            # Рассылка одной корзины часовых поясов
+            subscriptions = subscriptions.filter(user__timezone__in=self.timezones)
+        return subscriptions
+
+    def audience_user_ids(self):
+        return self._subscriptions().order_by('user_id').values_list('user_id', flat=True).distinct()
+
+    def bundles(self, first_user_id, last_user_id, user_ids=None):
+        rows = self._subscriptions().filter(user_id__gte=first_user_id, user_id__lte=last_user_id)
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows = rows.order_by('user_id').values_list(
+            'user_id', 'user__email', 'user__first_name', 'user__language'
+        ).distinct()
+
+        for user_id, email, first_name, language in rows.iterator():
+            yield DigestBundle(user_id, email, first_name, [], language=language)
+
+    def has_content(self, bundle):
+        return self.timeline.start(bundle.watermark, self.start_date) < len(self.timeline.items)
+
+    def render(self, bundle):
+        """Текст и HTML письма на активном языке; вызывающий включает язык получателя"""
+        start = self.timeline.start(bundle.watermark, self.start_date)
+        key = (translation.get_language(), start)
+        if key not in self._bodies:
+            self._bodies[key] = render_shared_body('appNotification/emails/weekly_news.txt', {
+                'news': self.timeline.newest_first(start),
+                'start_date': self.start_date,
+                'end_date': self.end_date,
+                'SITE_URL': settings.SITE_URL,
+            })
+        body = self._bodies[key]
+        return body.personalize(bundle.email, bundle.first_name), body.personalize_html(bundle.email, bundle.first_name)
+
+    def log_action(self, bundle):
+        return "Received weekly news digest"
+
+
+class WeeklyPostsDigest:
+    """
+    Сводный дайджест объявлений: один запрос за постами недели, один упорядоченный
+    проход по подпискам и одно письмо на пользователя со всеми его категориями
+    """
+
+    kind = 'posts'
+    event = 'digest'
+    subject = _('Weekly posts digest in your subscribed categories')
+
+    def __init__(self, start_date, end_date, since=None, timezones=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.since = since or start_date
+        self.timezones = timezones
+        self.posts_by_category = self._collect_posts()
+        self._sections = {}
+        self._frames = {}
+
+    def _collect_posts(self):
+        from .models import Post
+
+        posts_by_category = defaultdict(list)
+        posts = Post.objects.filter(
+            created_at__gt=self.since, created_at__lte=self.end_date
+        ).select_related('author').order_by('created_at', 'id')
+
+        for post in posts:
+            posts_by_category[post.category].append(post)
+
+        return {category: Timeline(posts) for category, posts in posts_by_category.items()}
+
+    def __bool__(self):
+        return bool(self.posts_by_category)
+
+    @property
+    def posts_count(self):
+        return sum(len(timeline.items) for timeline in self.posts_by_category.values())
+
+    def high_water(self):
+        return max((timeline.high_water() for timeline in self.posts_by_category.values()), default=None)
+
+    def _subscriptions(self):
+        from .models import Subscription
+
+        subscriptions = Subscription.objects.filter(category__value__in=list(self.posts_by_category))
+        if self.timezones:
+            # Рассылка одной корзины часовых поясов
+            subscriptions = subscriptions.filter(user__timezone__in=self.timezones)
+        return subscriptions
+
+    def audience_user_ids(self):
+        return self._subscriptions().order_by('user_id').values_list('user_id', flat=True).distinct()
+
+    def bundles(self, first_user_id, last_user_id, user_ids=None):
+        """Поток пакетов по пользователям диапазона в порядке user_id; в памяти только текущий пользователь"""
+        rows = self._subscriptions().filter(user_id__gte=first_user_id, user_id__lte=last_user_id)
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows = rows.order_by('user_id', 'category__name').values_list(
+            'user_id', 'user__email', 'user__first_name', 'user__language', 'category__value'
+        )
+
+        for user_id, user_rows in groupby(rows.iterator(), key=lambda row: row[0]):
+            user_rows = list(user_rows)
+            _, email, first_name, language, _ = user_rows[0]
+            yield DigestBundle(user_id, email, first_name, [row[4] for row in user_rows], language=language)
+
+    def _starts(self, bundle):
+        """Начало непрочитанной части каждой категории пользователя; категории без новых постов пропускаются"""
+        starts = []
+        for value in bundle.categories:
+            timeline = self.posts_by_category[value]
+            start = timeline.start(bundle.watermark, self.start_date)
+            if start < len(timeline.items):
+                starts.append((value, start))
+        return starts
+
+    def has_content(self, bundle):
+        return bool(self._starts(bundle))
+
+    def _section(self, category_value, start):
+        # Секция категории рендерится один раз на отметку и язык и переиспользуется всеми подписчиками
+        key = (translation.get_language(), category_value, start)
+        if key not in self._sections:
+            from .models import Post
+
+            self._sections[key] = render_email(
+                'appNotification/emails/weekly_posts_category.txt', {
+                    'category_name': dict(Post.CATEGORY_CHOICES).get(category_value, category_value),
+                    'posts': self.posts_by_category[category_value].newest_first(start),
+                    'SITE_URL': settings.SITE_URL,
+                }
+            )
+        return self._sections[key]
+
+    def _frame(self):
+        language = translation.get_language()
+        if language not in self._frames:
+            frame = render_shared_body('appNotification/emails/weekly_posts.txt', {
+                'sections': SECTIONS_PLACEHOLDER,
+                'start_date': self.start_date,
+                'end_date': self.end_date,
+                'SITE_URL': settings.SITE_URL,
+            })
+            head, _, tail = frame.text.partition(SECTIONS_PLACEHOLDER)
+            html_head, _, html_tail = frame.html.partition(SECTIONS_PLACEHOLDER)
+            self._frames[language] = SharedBody(head, html_head), SharedBody(tail, html_tail)
+        return self._frames[language]
+
+    def size_estimate(self):
+        """Размер общей рамки и секции каждой категории (текст и HTML) в байтах для планирования рассылки"""
+        head, tail = self._frame()
+        sections = {}
+        for value, timeline in self.posts_by_category.items():
+            text, html = self._section(value, timeline.start(None, self.start_date))
+            sections[value] = len(text.encode()) + len(html.encode())
+        frame = sum(len(part.encode()) for part in (head.text, tail.text, head.html, tail.html))
+        return frame, sections
+
+    def render(self, bundle):
+        """Текст и HTML письма на активном языке; вызывающий включает язык получателя"""
+        head, tail = self._frame()
+        sections = [self._section(value, start) for value, start in self._starts(bundle)]
+        text = (
+            head.personalize(bundle.email, bundle.first_name)
+            + '\n'.join(text for text, _html in sections)
+            + tail.personalize(bundle.email, bundle.first_name)
+        )
+        html = (
+            head.personalize_html(bundle.email, bundle.first_name)
+            + ''.join(html for _text, html in sections)
+            + tail.personalize_html(bundle.email, bundle.first_name)
+        )
+        return text, html
+
+    def log_action(self, bundle):
+        return f"Received weekly posts digest for categories {', '.join(bundle.categories)}"
+
+
+DIGESTS = {digest.kind: digest for digest in (WeeklyNewsletter, WeeklyPostsDigest)}
+
+
+def build_messages(digest, bundles):
+    """
+    Письма дайджеста по пакетам пользователей: тема рендерится один раз на язык.
+    Каждое письмо несет действие для журнала и отметку, до которой сдвинется отметка получателя после доставки.
+    """
+    messages = []
+    mark = (digest.kind, digest.high_water())
+    for language, group in group_by_language(bundles, lambda bundle: bundle.language).items():
+        with translation.override(language):
+            subject = str(digest.subject)
+            for bundle in group:
+                text, html = digest.render(bundle)
+                message = build_message(subject, text, bundle.email, html=html)
+                message.user_id = bundle.user_id
+                message.recipient_name = bundle.first_name or bundle.email
+                message.language = language
+                message.coalesce_item = None
+                message.overflow_to_digest = False
+                message.action = digest.log_action(bundle)
+                message.watermark = mark
+                messages.append(message)
+    return messages
+
+
+def outbox_messages(run, rows):
+    """
+    Письма дайджеста для строк outbox, вернувшихся на повтор: пакеты и отметки получателей
+    перечитываются, чтобы повтор не прислал то, что пользователь уже получил.
+    Получатели, которым больше нечего отправлять, писем не получают.
+    """
+    outbox_ids = {row[4]: row[0] for row in rows if row[4] is not None}
+    if not outbox_ids:
+        return []
+
+    user_ids = sorted(outbox_ids)
+    since = watermarks.floor(run.kind, user_ids[0], user_ids[-1], run.start_date, run.end_date)
+    digest = DIGESTS[run.kind](run.start_date, run.end_date, since=since, timezones=run.timezones)
+    bundles = list(digest.bundles(user_ids[0], user_ids[-1], user_ids=user_ids))
+    marks = watermarks.load(run.kind, user_ids)
+    for bundle in bundles:
+        bundle.watermark = marks.get(bundle.user_id)
+
+    messages = build_messages(digest, [bundle for bundle in bundles if digest.has_content(bundle)])
+    for message in messages:
+        message.outbox_ids = [outbox_ids[message.user_id]]
+    return messages
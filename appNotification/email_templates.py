@@ -0,0 +1,102 @@
+import re
+
+from django.template import TemplateDoesNotExist
+from django.template.loaders.app_directories import Loader as AppDirectoriesLoader
+
+# HTML-шаблоны писем, в которые встраивается общая таблица стилей
+EMAIL_TEMPLATES_PREFIX = 'appNotification/emails/'
+STYLESHEET = 'appNotification/emails/email.css'
+
+SELECTOR_RE = re.compile(r'^([a-z][a-z0-9]*)?(?:\.([\w-]+))?$')
+START_TAG_RE = re.compile(r'''<([a-zA-Z][a-zA-Z0-9]*)((?:[^<>"']|"[^"]*"|'[^']*')*?)(/?)>''')
+CLASS_RE = re.compile(r'''\sclass=(["'])(.*?)\1''')
+STYLE_RE = re.compile(r'''\sstyle=(["'])(.*?)\1''')
+
+
+def is_email_html(template_name):
+    return template_name.startswith(EMAIL_TEMPLATES_PREFIX) and template_name.endswith('.html')
+
+
+def parse_stylesheet(css):
+    """
+    Правила таблицы стилей: [(специфичность, порядок, тег, класс, объявления)].
+    Почтовые клиенты не поддерживают каскад, поэтому разрешены только селекторы
+    вида tag, .class и tag.class; остальное — ошибка при компиляции шаблона, а не при отправке.
+    """
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    rules = []
+    for selectors, body in re.findall(r'([^{}]+)\{([^{}]*)\}', css):
+        declarations = []
+        for declaration in body.split(';'):
+            name, _, value = declaration.partition(':')
+            if name.strip() and value.strip():
+                declarations.append((name.strip().lower(), ' '.join(value.split())))
+
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            match = SELECTOR_RE.match(selector)
+            if not selector or not match:
+                raise ValueError(f'Unsupported selector in email stylesheet: {selector!r}')
+            tag, css_class = match.groups()
+            rules.append((bool(tag) + 2 * bool(css_class), len(rules), tag, css_class, declarations))
+    return sorted(rules, key=lambda rule: rule[:2])
+
+
+def inline_css(html, rules):
+    """Переносит объявления подходящих правил в атрибут style; собственный style элемента важнее правил"""
+
+    def replace(match):
+        tag, attributes, self_closing = match.groups()
+        class_match = CLASS_RE.search(attributes)
+        classes = set(class_match.group(2).split()) if class_match else set()
+
+        declarations = {}
+        for _specificity, _order, rule_tag, rule_class, rule_declarations in rules:
+            if (rule_tag is None or rule_tag == tag.lower()) and (rule_class is None or rule_class in classes):
+                declarations.update(rule_declarations)
+        if not declarations:
+            return match.group(0)
+
+        style = ';'.join(f'{name}:{value}' for name, value in declarations.items())
+        style_match = STYLE_RE.search(attributes)
+        if style_match:
+            style = f'{style};{style_match.group(2)}'
+            attributes = attributes[:style_match.start()] + attributes[style_match.end():]
+        return f'<{tag}{attributes} style="{style}"{self_closing}>'
+
+    return START_TAG_RE.sub(replace, html)
+
+
+def minify_html(html):
+    """Убирает HTML-комментарии и пробелы между тегами; теги шаблонизатора остаются нетронутыми"""
+    html = re.sub(r'<!--.*?-->', '', html, flags=re.S)
+    html = re.sub(r'\s+', ' ', html)
+    return re.sub(r'(>|%\})\s+(<|\{%)', r'\1\2', html).strip()
+
+
+def compile_email_html(source, css):
+    return minify_html(inline_css(source, parse_stylesheet(css)))
+
+
+class Loader(AppDirectoriesLoader):
+    """
+    Загрузчик HTML-шаблонов писем из каталогов приложений со встроенным CSS; прочие
+    шаблоны остаются штатным загрузчикам. Встраивание и минификация выполняются один раз
+    при компиляции шаблона, дальше cached.Loader отдает готовый шаблон, и при отправке
+    остается только рендеринг.
+    """
+
+    def get_template_sources(self, template_name):
+        if is_email_html(template_name):
+            yield from super().get_template_sources(template_name)
+
+    def get_contents(self, origin):
+        return compile_email_html(super().get_contents(origin), self._stylesheet())
+
+    def _stylesheet(self):
+        for origin in super().get_template_sources(STYLESHEET):
+            try:
+                return super().get_contents(origin)
+            except TemplateDoesNotExist:
+                continue
+        raise TemplateDoesNotExist(STYLESHEET)
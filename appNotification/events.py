@@ -0,0 +1,61 @@
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+
+# Доменные события: отправляются один раз на переход состояния, а не на каждое сохранение.
+# Обработчики получают аргумент response.
+response_created = Signal()
+response_accepted = Signal()
+
+
+class TrackedFieldsMixin:
+    """
+    Запоминает значения tracked_fields при загрузке из БД, чтобы после сохранения
+    сравнить их с новыми без дополнительного SELECT
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot()
+        return instance
+
+    def snapshot(self, update_fields=None):
+        """Запоминает значения полей; после сохранения с update_fields — только записанных"""
+        deferred = self.get_deferred_fields()
+        values = getattr(self, '_loaded_values', {}).copy()
+        for name in self.tracked_fields:
+            # update_fields перечисляет имена полей, а отслеживаться может и attname (category_id)
+            if update_fields is not None and self._meta.get_field(name).name not in update_fields:
+                continue
+            if name not in deferred:
+                values[name] = getattr(self, name)
+        self._loaded_values = values
+
+    def previous(self, name, created=False):
+        """Значение поля до сохранения; для нового объекта — значение по умолчанию"""
+        if created:
+            return self._meta.get_field(name).get_default()
+        # Поле не загружалось (defer/only): изменение не определить, считаем его прежним
+        return getattr(self, '_loaded_values', {}).get(name, getattr(self, name))
+
+    def transitioned(self, name, value, created=False, update_fields=None):
+        """Поле только что перешло в value"""
+        if update_fields is not None and name not in update_fields:
+            return False
+        return getattr(self, name) == value and self.previous(name, created) != value
+
+
+@receiver(post_save, sender='appNotification.Response')
+def emit_response_events(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Загрузка фикстур не является событием предметной области
+    if raw:
+        return
+
+    if created:
+        response_created.send(sender=sender, response=instance)
+    if instance.transitioned('is_accepted', True, created, update_fields):
+        response_accepted.send(sender=sender, response=instance)
+
+    # Следующее сохранение того же объекта сравнивается уже с этим состоянием
+    instance.snapshot(update_fields)
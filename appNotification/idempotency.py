@@ -0,0 +1,61 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_PREFIX = 'delivery_key:'
+
+
+def delivery_key(event, user_id):
+    """Детерминированный ключ пары (событие, получатель), например news:5:user:7"""
+    return f'{event}:user:{user_id}'
+
+
+def iso_week(date):
+    year, week, _ = date.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def acquire(keys):
+    """
+    Резервирует ключи и возвращает множество тех, что еще не отправлялись.
+    Кеш отсекает повторы без обращения к БД, уникальный индекс DeliveryKey
+    разрешает гонку между параллельными воркерами.
+    """
+    from .models import DeliveryKey
+
+    keys = list(keys)
+    if not keys:
+        return set()
+
+    cached = cache.get_many([CACHE_PREFIX + key for key in keys])
+    fresh = [key for key in keys if CACHE_PREFIX + key not in cached]
+    if not fresh:
+        return set()
+
+    token = uuid.uuid4().hex
+    DeliveryKey.objects.bulk_create(
+        [DeliveryKey(key=key, token=token) for key in fresh],
+        ignore_conflicts=True,
+    )
+    # Вставка с ignore_conflicts не сообщает, какие строки прошли, поэтому ищем свои по токену
+    acquired = set(DeliveryKey.objects.filter(key__in=fresh, token=token).values_list('key', flat=True))
+
+    # В кеш попадают только закоммиченные ключи, иначе откат транзакции оставил бы ложные записи
+    timeout = settings.NOTIFICATION_IDEMPOTENCY_TTL.total_seconds()
+    transaction.on_commit(lambda: cache.set_many({CACHE_PREFIX + key: 1 for key in fresh}, timeout))
+
+    return acquired
+
+
+def release(keys):
+    """Освобождает ключи неотправленных писем, чтобы следующий запуск смог повторить отправку"""
+    from .models import DeliveryKey
+
+    keys = list(keys)
+    if not keys:
+        return
+
+    DeliveryKey.objects.filter(key__in=keys).delete()
+    cache.delete_many([CACHE_PREFIX + key for key in keys])
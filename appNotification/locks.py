@@ -0,0 +1,133 @@
+import functools
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import increment
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = 'task_lock:'
+PENDING_PREFIX = 'task_lock_pending:'
+
+# Имена задач под singleton: по ним metrics.collect() показывает пропуски и занятые блокировки
+SINGLETONS = set()
+
+# Проверка токена и удаление/продление одной командой: между GET и DEL аренда могла
+# истечь и достаться другому воркеру, и тогда удалилась бы уже его блокировка
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Кеш без Redis живет в памяти процесса: атомарность проверки дает обычная блокировка
+_local_lock = threading.Lock()
+
+
+class Lease:
+    """
+    Аренда в общем кеше: держит её только владелец токена, а после падения
+    воркера она истекает сама через ttl
+    """
+
+    def __init__(self, name, ttl):
+        self.key = LOCK_PREFIX + name
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _redis(self):
+        """Клиент Redis, ключ и токен в том виде, в каком их хранит django_redis; None для других кешей"""
+        if 'django_redis' not in settings.CACHES['default']['BACKEND']:
+            return None
+        client = cache.client
+        return client.get_client(write=True), client.make_key(self.key), client.encode(self.token)
+
+    def acquire(self):
+        with _local_lock:
+            acquired = cache.add(self.key, self.token, self.ttl)
+        if not acquired:
+            return False
+        self._heartbeat = threading.Thread(target=self._renew_loop, name=f'lease-{self.key}', daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _renew_loop(self):
+        # Продлеваем аренду, пока задача жива; долгий запуск не теряет блокировку по ttl
+        while not self._stop.wait(self.ttl / 3):
+            if not self._renew():
+                logger.warning(f"Lease {self.key} was lost before the task finished")
+                return
+
+    def _renew(self):
+        redis = self._redis()
+        if redis is not None:
+            client, key, token = redis
+            return bool(client.eval(RENEW_SCRIPT, 1, key, token, int(self.ttl * 1000)))
+        with _local_lock:
+            return cache.get(self.key) == self.token and cache.touch(self.key, self.ttl)
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=1)
+        redis = self._redis()
+        if redis is not None:
+            client, key, token = redis
+            client.eval(RELEASE_SCRIPT, 1, key, token)
+            return
+        with _local_lock:
+            if cache.get(self.key) == self.token:
+                cache.delete(self.key)
+
+
+def singleton(name=None, ttl=None, coalesce=False):
+    """
+    Не дает периодической задаче запуститься, пока идет предыдущий запуск.
+    Пропуск учитывается в метрике task_skipped:<имя>. С coalesce=True пропущенные
+    вызовы схлопываются в один повторный запуск после завершения текущего.
+    """
+    def decorator(func):
+        task_name = f'{func.__module__}.{func.__name__}'
+        lock_name = name or task_name
+        SINGLETONS.add(lock_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lease = Lease(lock_name, ttl or settings.NOTIFICATION_TASK_LOCK_TTL)
+            if not lease.acquire():
+                increment('task_skipped')
+                increment(f'task_skipped:{lock_name}')
+                if coalesce:
+                    cache.set(PENDING_PREFIX + lock_name, 1, lease.ttl)
+                logger.info(f"Skipping {lock_name}: previous run is still active")
+                return f'Skipped: {lock_name} is already running'
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                lease.release()
+                if coalesce and cache.delete(PENDING_PREFIX + lock_name):
+                    from celery import current_app
+                    current_app.tasks[task_name].apply_async(args, kwargs)
+
+        return wrapper
+    return decorator
+
+
+def held():
+    """Какие singleton-задачи сейчас выполняются"""
+    keys = cache.get_many([LOCK_PREFIX + lock_name for lock_name in SINGLETONS])
+    return {lock_name: LOCK_PREFIX + lock_name in keys for lock_name in sorted(SINGLETONS)}
@@ -0,0 +1,215 @@
+import logging
+import os
+import smtplib
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+
+from .breaker import smtp_breaker
+from .metrics import increment
+from .ratelimit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых сессию нужно открыть заново, а не считать письмо неотправленным
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+# Классы ошибок доставки: временную имеет смысл повторить позже, постоянную — нет
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+
+class PooledConnection:
+    """
+    Одно SMTP-соединение на процесс воркера, переиспользуемое между задачами
+    """
+
+    def __init__(self, connection_factory=None):
+        self._connection_factory = connection_factory or (lambda: get_connection(fail_silently=False))
+        self._connection = None
+        self._pid = None
+        self._sent_in_session = 0
+
+    def get(self):
+        # После fork у дочернего процесса Celery должно быть своё соединение
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = self._connection_factory()
+            self._connection.open()
+            self._pid = os.getpid()
+            self._sent_in_session = 0
+        return self._connection
+
+    def reset(self):
+        if self._connection is not None and self._pid == os.getpid():
+            try:
+                self._connection.close()
+            except Exception as e:
+                logger.debug(f"Error closing SMTP connection: {e}")
+        self._connection = None
+        self._sent_in_session = 0
+
+    def mark_sent(self):
+        self._sent_in_session += 1
+        # Релеи ограничивают число писем за сессию, поэтому периодически переоткрываем её
+        if self._sent_in_session >= settings.NOTIFICATION_MAIL_BATCH_SIZE:
+            self.reset()
+
+
+connection_pool = PooledConnection()
+
+
+class DispatchResult:
+    def __init__(self):
+        self.sent = []
+        self.failed = []
+        # Письма, отложенные из-за исчерпанного бюджета отправки, и через сколько секунд повторить
+        self.deferred = []
+        self.retry_after = 0
+
+    def defer(self, messages, retry_after):
+        self.deferred.extend(messages)
+        self.retry_after = max(self.retry_after, retry_after)
+
+    def __repr__(self):
+        return (f'<DispatchResult sent={len(self.sent)} failed={len(self.failed)} '
+                f'deferred={len(self.deferred)}>')
+
+
+def build_message(subject, body, recipient, html=None):
+    """Создает письмо одному получателю с отправителем по умолчанию; с html — multipart/alternative"""
+    if html is None:
+        return EmailMessage(str(subject), body, settings.DEFAULT_FROM_EMAIL, [recipient])
+    message = EmailMultiAlternatives(str(subject), body, settings.DEFAULT_FROM_EMAIL, [recipient])
+    message.attach_alternative(html, 'text/html')
+    return message
+
+
+def recipient_domain(message):
+    recipient = message.to[0] if message.to else ''
+    return recipient.rpartition('@')[2].lower()
+
+
+def group_by_domain(messages):
+    groups = defaultdict(list)
+    for message in messages:
+        groups[recipient_domain(message)].append(message)
+    return groups
+
+
+def send_one(message, pool=connection_pool):
+    """
+    Отправка одного письма через соединение пула с переподключением при обрыве сессии.
+    Исход и длительность попадают в предохранитель SMTP.
+    """
+    attempts = settings.NOTIFICATION_MAIL_RECONNECT_ATTEMPTS
+    started = time.monotonic()
+
+    for attempt in range(1, attempts + 1):
+        try:
+            pool.get().send_messages([message])
+            pool.mark_sent()
+            smtp_breaker.record(True, time.monotonic() - started)
+            return
+        except RECONNECT_ERRORS as e:
+            logger.warning(f"SMTP session dropped (attempt {attempt}/{attempts}): {e}")
+            pool.reset()
+            if attempt == attempts:
+                smtp_breaker.record(False, time.monotonic() - started)
+                raise
+        except Exception as e:
+            # Постоянный отказ (5xx, плохой адрес) значит, что сервер отвечает: это не сбой релея
+            smtp_breaker.record(classify_error(e)[0] == PERMANENT, time.monotonic() - started)
+            raise
+
+
+def classify_error(error):
+    """
+    Возвращает (класс ошибки, SMTP-код): ответы 5xx постоянные, 4xx и сетевые сбои временные.
+    Отказ в авторизации или отправителе — проблема релея, а не адреса, поэтому тоже временная.
+    """
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused)):
+        return TRANSIENT, error.smtp_code
+
+    code = None
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _message in error.recipients.values()]
+        code = codes[0] if codes else None
+    elif isinstance(error, smtplib.SMTPResponseException):
+        code = error.smtp_code
+
+    if code is not None:
+        return (PERMANENT if 500 <= code < 600 else TRANSIENT), code
+    if isinstance(error, (ValueError, UnicodeError)):
+        # Некорректный адрес или заголовок: повтор ничего не изменит
+        return PERMANENT, None
+    return TRANSIENT, None
+
+
+def take_token(domain):
+    """
+    Токен rate limiter на одно письмо. Короткое ожидание выполняется на месте,
+    иначе возвращается число секунд, через которое стоит повторить.
+    """
+    wait = rate_limiter.acquire(domain)
+    if 0 < wait <= settings.NOTIFICATION_RATE_LIMIT_MAX_WAIT:
+        time.sleep(wait)
+        wait = rate_limiter.acquire(domain)
+    return wait
+
+
+def admit(domain, rate_limited=True):
+    """
+    Можно ли отправлять письмо сейчас: (0, None) или (через сколько секунд повторить, причина).
+    При разомкнутом предохранителе письма откладываются, не занимая воркер ожиданием SMTP.
+    """
+    wait = smtp_breaker.allow()
+    if wait:
+        return wait, 'circuit_open'
+    wait = take_token(domain) if rate_limited else 0
+    return wait, 'rate_limited' if wait else None
+
+
+def send_messages(messages, rate_limited=True):
+    """
+    Отправляет письма через общее соединение процесса, группируя их по домену получателя,
+    чтобы письма одному почтовому провайдеру шли подряд в одной SMTP-сессии.
+    Ошибка одного письма не прерывает отправку остальных; письма сверх бюджета
+    rate limiter и при разомкнутом предохранителе попадают в result.deferred. Большие пачки уходят через
+    асинхронный диспетчер с несколькими параллельными сессиями.
+    """
+    groups = group_by_domain(messages)
+
+    total = sum(len(group) for group in groups.values())
+    if settings.NOTIFICATION_ASYNC_SESSIONS > 1 and total >= settings.NOTIFICATION_ASYNC_MIN_MESSAGES:
+        from .async_dispatch import send_messages_concurrently
+
+        ordered = [message for group in groups.values() for message in group]
+        return send_messages_concurrently(ordered, rate_limited=rate_limited)
+
+    result = DispatchResult()
+
+    for domain, group in groups.items():
+        for index, message in enumerate(group):
+            wait, reason = admit(domain, rate_limited)
+            if wait:
+                # Бюджет домена исчерпан или релей недоступен: остаток группы откладываем, задача перепланирует его
+                logger.info(f"SMTP {reason} for {domain}, deferring {len(group) - index} messages")
+                result.defer(group[index:], wait)
+                increment(f'smtp_{reason}', len(group) - index)
+                break
+
+            try:
+                send_one(message)
+                result.sent.append(message)
+            except Exception as e:
+                logger.error(f"Error sending email to {', '.join(message.to)}: {e}")
+                result.failed.append((message, e))
+
+    return result
+
+
+def send_message(subject, body, recipient):
+    """Отправка одного транзакционного письма через общее соединение"""
+    return send_messages([build_message(subject, body, recipient)])
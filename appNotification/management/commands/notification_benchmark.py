@@ -0,0 +1,263 @@
+import json
+import random
+import subprocess
+import time
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Доставленные письма текущего прогона: (id строк outbox, момент доставки)
+DELIVERIES = []
+
+
+class TimingEmailBackend(EmailBackend):
+    """locmem-бэкенд, запоминающий момент доставки каждого письма"""
+
+    def send_messages(self, messages):
+        count = super().send_messages(messages)
+        # Часы стенные: задержка считается от created_at строк outbox
+        now = time.time()
+        DELIVERIES.extend((getattr(message, 'outbox_ids', ()), now) for message in messages)
+        return count
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, round(percent / 100 * (len(values) - 1)))]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss в Linux — килобайты
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark notification fan-out paths on synthetic subscribers in a scratch database '
+            'and write messages/sec, queries/message, peak RSS and p50/p99 latency to JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=2000,
+            help='Synthetic users to create (default: 2000)'
+        )
+        parser.add_argument(
+            '--subscribers-per-category',
+            type=int,
+            default=500,
+            help='Subscribers of each category (default: 500)'
+        )
+        parser.add_argument(
+            '--news-subscribers',
+            type=int,
+            default=1000,
+            help='Subscribers of news (default: 1000)'
+        )
+        parser.add_argument(
+            '--categories',
+            type=int,
+            default=4,
+            help='Categories to seed and post into (default: 4)'
+        )
+        parser.add_argument(
+            '--paths',
+            nargs='+',
+            default=['post', 'news', 'newsletter', 'posts_digest', 'signal'],
+            choices=['post', 'news', 'newsletter', 'posts_digest', 'signal'],
+            help='Notification paths to run'
+        )
+        parser.add_argument(
+            '--output',
+            default='notification_benchmark.json',
+            help='Where to write the JSON report'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for subscriber selection'
+        )
+
+    def handle(self, *args, **options):
+        from django.core.cache import caches
+
+        # Все пути работают синхронно в этом процессе, без брокера, Redis и реального SMTP
+        overrides = override_settings(
+            EMAIL_BACKEND=f'{__name__}.TimingEmailBackend',
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'notification-benchmark'}},
+            NOTIFICATION_COALESCE_WINDOW=timedelta(0),
+            NOTIFICATION_RATE_LIMITS={'relay': {'per_second': 10 ** 9, 'per_hour': 10 ** 12}},
+        )
+        old_eager = current_app.conf.task_always_eager, current_app.conf.task_eager_propagates
+        old_name = connection.settings_dict['NAME']
+
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        overrides.enable()
+        self._reset_backends()
+        current_app.conf.task_always_eager = True
+        current_app.conf.task_eager_propagates = True
+        try:
+            caches['default'].clear()
+            seeded = self._seed(options)
+            report = {
+                'commit': _git_commit(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'database': connection.vendor,
+                'parameters': {key: options[key] for key in (
+                    'users', 'subscribers_per_category', 'news_subscribers', 'categories', 'seed')},
+                'seed_seconds': seeded,
+                'paths': {},
+            }
+            for path in options['paths']:
+                report['paths'][path] = self._measure(path)
+                self.stdout.write(f'{path}: {json.dumps(report["paths"][path])}')
+        finally:
+            current_app.conf.task_always_eager, current_app.conf.task_eager_propagates = old_eager
+            overrides.disable()
+            self._reset_backends()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+
+    def _reset_backends(self):
+        # Бэкенды выбираются по CACHES при первом обращении; после подмены настроек выбираем заново
+        from appNotification.audience import audience_index
+        from appNotification.ratelimit import rate_limiter
+
+        rate_limiter._backend = None
+        audience_index._backend = None
+
+    def _seed(self, options):
+        from appNotification.models import Category, Subscription
+
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+        User = get_user_model()
+
+        User.objects.bulk_create(
+            User(email=f'bench{number}@example{number % 5}.com', first_name=f'Bench{number}' if number % 2 else '',
+                 password='!', is_active=True, email_verified=True)
+            for number in range(options['users'])
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+
+        self.categories = [Category.objects.create(name=f'Bench {number}', value=f'bench{number}')
+                           for number in range(options['categories'])]
+        subscriptions = [
+            Subscription(user_id=user_id, category=category)
+            for category in self.categories
+            for user_id in rng.sample(user_ids, min(options['subscribers_per_category'], len(user_ids)))
+        ]
+        subscriptions.extend(
+            Subscription(user_id=user_id, category=None, news=True)
+            for user_id in rng.sample(user_ids, min(options['news_subscribers'], len(user_ids)))
+        )
+        Subscription.objects.bulk_create(subscriptions, batch_size=5000)
+        self.author = User.objects.get(id=user_ids[0])
+        return round(time.perf_counter() - started, 3)
+
+    def _content(self):
+        from appNotification.models import News, Post
+
+        news = News.objects.create(title='Benchmark news', content='<p>Benchmark</p>' * 20,
+                                   notify_subscribers=False)
+        posts = [
+            Post.objects.create(author=self.author, category=category.value, title=f'Benchmark post {category.value}',
+                                content='<p>Benchmark</p>' * 20, notify_subscribers=False)
+            for category in self.categories
+        ]
+        return news, posts
+
+    def _prepare(self, path):
+        """Готовит данные пути рассылки вне замера; возвращает функцию, запускающую саму рассылку"""
+        from appNotification import tasks
+        from appNotification.models import DigestRun, Post
+
+        if path == 'signal':
+            def run():
+                # Путь из представления: объявление и запись outbox в одной транзакции, дальше on_commit
+                with transaction.atomic():
+                    Post.objects.create(author=self.author, category=self.categories[0].value,
+                                        title='Benchmark signal post', content='<p>Benchmark</p>' * 20,
+                                        notify_subscribers=True)
+            return run
+
+        news, posts = self._content()
+        # Прошлый прогон этой недели не должен отменить еженедельную рассылку
+        DigestRun.objects.all().delete()
+        return {
+            'post': lambda: tasks.send_post_notification(posts[0].id),
+            'news': lambda: tasks.send_news_notification(news.id),
+            'newsletter': tasks.send_weekly_newsletter,
+            'posts_digest': tasks.send_weekly_posts_digest,
+        }[path]
+
+    def _latencies(self, since):
+        """Задержка каждого письма от записи в outbox самого раннего из его событий до доставки, мс"""
+        from appNotification.models import OutboxMessage
+
+        enqueued = dict(OutboxMessage.objects.filter(created_at__gte=since).values_list('id', 'created_at'))
+        latencies = []
+        for outbox_ids, delivered in DELIVERIES:
+            created = [enqueued[outbox_id] for outbox_id in outbox_ids if outbox_id in enqueued]
+            if created:
+                latencies.append((delivered - min(created).timestamp()) * 1000)
+        return latencies
+
+    def _measure(self, path):
+        from django.core.cache import cache
+        from django.utils import timezone
+
+        run = self._prepare(path)
+        cache.clear()
+        mail.outbox = []
+        DELIVERIES.clear()
+        rss_before = _peak_rss_mb()
+
+        since = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+
+        sent = len(mail.outbox)
+        latencies = self._latencies(since)
+        return {
+            'messages': sent,
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(sent / elapsed, 1) if elapsed and sent else None,
+            'queries': len(queries),
+            'queries_per_message': round(len(queries) / sent, 3) if sent else None,
+            'peak_rss_mb': _peak_rss_mb(),
+            'peak_rss_growth_mb': round(_peak_rss_mb() - rss_before, 1) if rss_before is not None else None,
+            'latency_ms_p50': round(_percentile(latencies, 50), 2) if latencies else None,
+            'latency_ms_p99': round(_percentile(latencies, 99), 2) if latencies else None,
+        }
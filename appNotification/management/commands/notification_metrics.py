@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from appNotification.metrics import collect
+
+
+class Command(BaseCommand):
+    help = 'Print notification delivery metrics (SMTP budget, counters) as JSON'
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(collect(), indent=2, ensure_ascii=False, default=str))
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appNotification.models import News, Post
+from appNotification.planning import plan_digest, plan_news, plan_post
+
+
+class Command(BaseCommand):
+    help = ('Dry-run a notification fan-out: audience size, bytes and expected send time '
+            'estimated from past send rates, plus a rendered sample. Nothing is sent')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'target',
+            choices=['news', 'post', 'newsletter', 'posts-digest'],
+            help='Fan-out to plan'
+        )
+        parser.add_argument(
+            'id',
+            nargs='?',
+            type=int,
+            help='News or post id (for the news and post targets)'
+        )
+        parser.add_argument(
+            '--no-samples',
+            action='store_true',
+            help='Omit rendered sample messages from the report'
+        )
+
+    def handle(self, *args, **options):
+        target = options['target']
+
+        if target in ('news', 'post'):
+            model = News if target == 'news' else Post
+            if options['id'] is None:
+                raise CommandError(f'{target} requires an id')
+            try:
+                obj = model.objects.get(pk=options['id'])
+            except model.DoesNotExist:
+                raise CommandError(f'{model._meta.verbose_name} {options["id"]} does not exist')
+            plan = plan_news(obj) if target == 'news' else plan_post(obj)
+        else:
+            plan = plan_digest('newsletter' if target == 'newsletter' else 'posts')
+
+        self.stdout.write(json.dumps(plan.as_dict(samples=not options['no_samples']), indent=2,
+                                     ensure_ascii=False, default=str))
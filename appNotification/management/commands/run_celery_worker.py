@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from proNotification.celery import app
+
+
+class Command(BaseCommand):
+    help = 'Start a Celery worker with one of the profiles from CELERY_WORKER_PROFILES'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'profile',
+            choices=sorted(settings.CELERY_WORKER_PROFILES),
+            help='Worker profile: queue set, concurrency and prefetch'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='Override the profile concurrency'
+        )
+        parser.add_argument(
+            '--loglevel',
+            default='INFO',
+            help='Worker log level (default: INFO)'
+        )
+
+    def handle(self, *args, **options):
+        profile_name = options['profile']
+        profile = settings.CELERY_WORKER_PROFILES[profile_name]
+
+        concurrency = options['concurrency'] or profile['concurrency']
+        argv = [
+            'worker',
+            f'--queues={",".join(profile["queues"])}',
+            f'--concurrency={concurrency}',
+            f'--prefetch-multiplier={profile["prefetch_multiplier"]}',
+            f'--hostname={profile_name}@%h',
+            f'--loglevel={options["loglevel"]}',
+        ]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Starting "{profile_name}" worker: celery {" ".join(argv)}')
+        )
+        app.worker_main(argv)
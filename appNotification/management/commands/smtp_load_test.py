@@ -0,0 +1,82 @@
+import json
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from appNotification.async_dispatch import send_messages_concurrently
+from appNotification.mail import build_message
+from appNotification.smtp_sink import SinkServer
+
+
+class Command(BaseCommand):
+    help = ('Measure mail throughput of the pooled connection and the concurrent dispatcher '
+            'against a local stand-in SMTP server')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=1000,
+            help='Number of synthetic messages (default: 1000)'
+        )
+        parser.add_argument(
+            '--sessions',
+            type=int,
+            default=settings.NOTIFICATION_ASYNC_SESSIONS,
+            help='Concurrent SMTP sessions for the dispatcher'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=5.0,
+            help='Simulated server latency per message, ms (default: 5)'
+        )
+        parser.add_argument(
+            '--skip-sequential',
+            action='store_true',
+            help='Only measure the concurrent dispatcher'
+        )
+
+    def _messages(self, count):
+        for number in range(count):
+            yield build_message('Load test', f'Message {number}', f'user{number}@example.com')
+
+    def _run(self, label, send, count):
+        started = time.perf_counter()
+        result = send(self._messages(count))
+        elapsed = time.perf_counter() - started
+        return label, {
+            'sent': len(result.sent),
+            'failed': len(result.failed),
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(len(result.sent) / elapsed, 1) if elapsed else None,
+        }
+
+    def handle(self, *args, **options):
+        count = options['messages']
+
+        with SinkServer(latency=options['latency'] / 1000) as server:
+            # Сервер-заглушка без TLS и авторизации, поэтому соединение собирается явно
+            connection_factory = partial(
+                get_connection, 'django.core.mail.backends.smtp.EmailBackend',
+                host=server.host, port=server.port, username='', password='',
+                use_tls=False, use_ssl=False, fail_silently=False,
+            )
+
+            report = {}
+            # Одна сессия — базовая линия, эквивалентная общему соединению процесса
+            session_counts = [options['sessions']] if options['skip_sequential'] else [1, options['sessions']]
+            for sessions in session_counts:
+                report.update([self._run(
+                    f'{sessions}_sessions',
+                    partial(send_messages_concurrently, sessions=sessions,
+                            connection_factory=connection_factory, rate_limited=False),
+                    count,
+                )])
+            report['server'] = {'messages': server.messages, 'sessions': server.sessions}
+
+        self.stdout.write(json.dumps(report, indent=2))
+
@@ -0,0 +1,54 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from appNotification.segments import column, segment_index
+
+
+class Command(BaseCommand):
+    help = ('Count users in a subscription segment, e.g. --all tanks heals --none news. '
+            'Without filters prints the pairwise overlap of all audiences')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--any',
+            nargs='+',
+            default=[],
+            help='Category values (or "news"); users subscribed to at least one'
+        )
+        parser.add_argument(
+            '--all',
+            nargs='+',
+            default=[],
+            help='Category values (or "news"); users subscribed to every one'
+        )
+        parser.add_argument(
+            '--none',
+            nargs='+',
+            default=[],
+            help='Category values (or "news"); users subscribed to none of them'
+        )
+        parser.add_argument(
+            '--ids',
+            action='store_true',
+            help='Also print the matching user ids'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = segment_index.get()
+        build_ms = (time.perf_counter() - started) * 1000
+
+        any_of, all_of, none_of = ([column(token) for token in options[key]] for key in ('any', 'all', 'none'))
+        started = time.perf_counter()
+        if any_of or all_of or none_of:
+            report = {'count': matrix.count(any_of, all_of, none_of)}
+            if options['ids']:
+                report['user_ids'] = matrix.user_ids(any_of, all_of, none_of)
+        else:
+            report = {'users': matrix.users.bit_count(), 'overlap': matrix.overlap()}
+        report['query_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        report['load_ms'] = round(build_ms, 3)
+
+        self.stdout.write(json.dumps(report, indent=2, ensure_ascii=False))
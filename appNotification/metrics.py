@@ -0,0 +1,45 @@
+from django.core.cache import cache
+
+COUNTER_PREFIX = 'notification_metric:'
+
+# Счетчики, попадающие в снимок collect()
+COUNTERS = ['smtp_rate_limited', 'smtp_circuit_open', 'smtp_circuit_opened', 'outbox_retried',
+            'outbox_dead_lettered', 'notifications_capped', 'task_skipped']
+
+
+def increment(name, value=1):
+    """Счетчик в общем кеше, видимый всем воркерам"""
+    key = COUNTER_PREFIX + name
+    if not cache.add(key, value, timeout=None):
+        cache.incr(key, value)
+
+
+def counters(names):
+    values = cache.get_many([COUNTER_PREFIX + name for name in names])
+    return {name: values.get(COUNTER_PREFIX + name, 0) for name in names}
+
+
+def digest_runs():
+    """Прогресс незавершенных еженедельных рассылок"""
+    from .models import DigestRun
+
+    return {
+        str(run): run.progress()
+        for run in DigestRun.objects.filter(status=DigestRun.STATUS_RUNNING)
+    }
+
+
+def collect():
+    """Снимок метрик рассылки для админки, команд и мониторинга"""
+    from . import tasks  # noqa: F401 — регистрирует singleton-задачи
+    from .breaker import smtp_breaker
+    from .locks import SINGLETONS, held
+    from .ratelimit import rate_limiter
+
+    return {
+        'smtp_budget': rate_limiter.budget(),
+        'smtp_circuit': smtp_breaker.snapshot(),
+        'counters': counters(COUNTERS + [f'task_skipped:{name}' for name in sorted(SINGLETONS)]),
+        'task_locks': held(),
+        'digest_runs': digest_runs(),
+    }
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appNotification', '0008_deliverykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('permanent', 'Permanent error'), ('exhausted', 'Retries exhausted')], max_length=20)),
+                ('error_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='appNotification.outboxmessage')),
+            ],
+            options={
+                'verbose_name': 'Dead letter',
+                'verbose_name_plural': 'Dead letters',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
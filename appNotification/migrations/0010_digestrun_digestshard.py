@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appNotification', '0009_outboxmessage_next_attempt_at_deadletter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('newsletter', 'Weekly newsletter'), ('posts', 'Weekly posts digest')], max_length=20)),
+                ('period', models.CharField(max_length=10)),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed')], default='running', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Digest run',
+                'verbose_name_plural': 'Digest runs',
+                'ordering': ['-started_at'],
+                'unique_together': {('kind', 'period')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DigestShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_user_id', models.PositiveBigIntegerField()),
+                ('last_user_id', models.PositiveBigIntegerField()),
+                ('checkpoint_user_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed')], default='pending', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='appNotification.digestrun')),
+            ],
+            options={
+                'verbose_name': 'Digest shard',
+                'verbose_name_plural': 'Digest shards',
+                'ordering': ['first_user_id'],
+            },
+        ),
+    ]
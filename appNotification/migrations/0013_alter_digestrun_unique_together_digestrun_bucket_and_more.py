@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appNotification', '0012_alter_outboxmessage_status'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='digestrun',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='digestrun',
+            name='bucket',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='digestrun',
+            name='timezones',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterUniqueTogether(
+            name='digestrun',
+            unique_together={('kind', 'period', 'bucket')},
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 from django.core.validators import MinLengthValidator
@@ -7,6 +8,8 @@ from ckeditor.fields import RichTextField
 from ckeditor_uploader.fields import RichTextUploadingField
 from bs4 import BeautifulSoup
 
+from .events import TrackedFieldsMixin
+
 User = get_user_model()
 
 
@@ -68,6 +71,9 @@ class Post(models.Model):
         ordering = ['-created_at']
         verbose_name = _('Post')
         verbose_name_plural = _('Posts')
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author.email}"
@@ -118,7 +124,10 @@ class Post(models.Model):
         return embedded_content
 
 
-class Response(models.Model):
+class Response(TrackedFieldsMixin, models.Model):
+    # Изменения этих полей превращаются в доменные события (см. events.py)
+    tracked_fields = ('is_accepted',)
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='responses')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='responses')
     text = models.TextField(validators=[MinLengthValidator(10)])
@@ -153,6 +162,9 @@ class News(models.Model):
         ordering = ['-created_at']
         verbose_name = _('News')
         verbose_name_plural = _('News')
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -166,7 +178,10 @@ class News(models.Model):
         self.save(update_fields=['views_count'])
 
 
-class Subscription(models.Model):
+class Subscription(TrackedFieldsMixin, models.Model):
+    # Прежние аудитории нужны индексу подписчиков, чтобы обновить его без пересборки (см. signals.py)
+    tracked_fields = ('category_id', 'news')
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
     news = models.BooleanField(default=False)
@@ -195,3 +210,206 @@ class Subscription(models.Model):
     @classmethod
     def is_user_subscribed_to_category(cls, user, category):
         return cls.objects.filter(user=user, category=category).exists()
+
+
+class OutboxMessage(models.Model):
+    """
+    Исходящее уведомление, записанное в той же транзакции, что и событие.
+    Пустой recipient означает рассылку всей аудитории объекта (разворачивается координатором).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_FAILED = 'failed'
+    STATUS_DIGEST = 'digest'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_SENDING, _('Sending')),
+        (STATUS_DELIVERED, _('Delivered')),
+        (STATUS_FAILED, _('Failed')),
+        (STATUS_DIGEST, _('Left for digest')),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='outbox_messages')
+    recipient = models.EmailField(blank=True)
+    template_key = models.CharField(max_length=50)
+    context_id = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    claim_token = models.CharField(max_length=32, blank=True, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('Outbox message')
+        verbose_name_plural = _('Outbox messages')
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.template_key}:{self.context_id} -> {self.recipient or 'audience'} ({self.status})"
+
+
+class DeadLetter(models.Model):
+    """
+    Письмо outbox, которое не удалось доставить: постоянная ошибка (SMTP 5xx)
+    или исчерпанные попытки. Сотрудники могут повторить отправку из админки.
+    """
+    REASON_PERMANENT = 'permanent'
+    REASON_EXHAUSTED = 'exhausted'
+    REASON_CHOICES = [
+        (REASON_PERMANENT, _('Permanent error')),
+        (REASON_EXHAUSTED, _('Retries exhausted')),
+    ]
+
+    message = models.ForeignKey(OutboxMessage, on_delete=models.CASCADE, related_name='dead_letters')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    error_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    replayed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _('Dead letter')
+        verbose_name_plural = _('Dead letters')
+
+    def __str__(self):
+        return f"{self.message.recipient}: {self.error_code or self.reason}"
+
+
+class DigestRun(models.Model):
+    """
+    Запуск еженедельной рассылки за период: окно дат, шарды по диапазонам id
+    пользователей и сводный прогресс. Повторный запуск за тот же период возобновляет его.
+    """
+    KIND_NEWSLETTER = 'newsletter'
+    KIND_POSTS = 'posts'
+    KIND_CHOICES = [
+        (KIND_NEWSLETTER, _('Weekly newsletter')),
+        (KIND_POSTS, _('Weekly posts digest')),
+    ]
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_COMPLETED, _('Completed')),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    period = models.CharField(max_length=10)
+    # Корзина часовых поясов вида UTC+03:00 и её пояса; пустая корзина — все пользователи сразу
+    bucket = models.CharField(max_length=10, blank=True, default='')
+    timezones = models.JSONField(default=list, blank=True)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    total = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['kind', 'period', 'bucket']
+        ordering = ['-started_at']
+        verbose_name = _('Digest run')
+        verbose_name_plural = _('Digest runs')
+
+    def __str__(self):
+        if self.bucket:
+            return f"{self.get_kind_display()} {self.period} {self.bucket}"
+        return f"{self.get_kind_display()} {self.period}"
+
+    def progress(self):
+        """Отправлено, с ошибкой, осталось и скорость отправки в письмах в секунду"""
+        totals = self.shards.aggregate(
+            sent=models.Sum('sent'), failed=models.Sum('failed'), skipped=models.Sum('skipped'),
+            completed=models.Count('id', filter=models.Q(status=DigestShard.STATUS_COMPLETED)),
+            shards=models.Count('id'),
+        )
+        sent, failed, skipped = totals['sent'] or 0, totals['failed'] or 0, totals['skipped'] or 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return {
+            'sent': sent,
+            'failed': failed,
+            'remaining': 0 if self.status == self.STATUS_COMPLETED else max(0, self.total - sent - failed - skipped),
+            'rate': round(sent / elapsed, 2) if elapsed > 0 else 0,
+            'shards': totals['shards'],
+            'shards_completed': totals['completed'],
+        }
+
+
+class DigestShard(models.Model):
+    """
+    Диапазон id пользователей одного запуска. checkpoint_user_id — последний
+    обработанный пользователь: упавший шард продолжает со следующего.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_COMPLETED, _('Completed')),
+    ]
+
+    run = models.ForeignKey(DigestRun, on_delete=models.CASCADE, related_name='shards')
+    first_user_id = models.PositiveBigIntegerField()
+    last_user_id = models.PositiveBigIntegerField()
+    checkpoint_user_id = models.PositiveBigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['first_user_id']
+        verbose_name = _('Digest shard')
+        verbose_name_plural = _('Digest shards')
+
+    def __str__(self):
+        return f"{self.run} users {self.first_user_id}-{self.last_user_id} ({self.status})"
+
+
+class DeliveryWatermark(models.Model):
+    """
+    Последний материал (created_at, id), вошедший в рассылку канала для пользователя.
+    Следующий дайджест берет только материалы новее этой отметки.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='delivery_watermarks')
+    channel = models.CharField(max_length=20)
+    last_created_at = models.DateTimeField()
+    last_id = models.PositiveBigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'channel']
+        verbose_name = _('Delivery watermark')
+        verbose_name_plural = _('Delivery watermarks')
+
+    def __str__(self):
+        return f"{self.user_id}:{self.channel} @ {self.last_created_at:%Y-%m-%d %H:%M} #{self.last_id}"
+
+
+class DeliveryKey(models.Model):
+    """
+    Ключ идемпотентности отправки (например news:5:user:7). Уникальность в БД
+    гарантирует, что одно событие не уйдет получателю дважды.
+    """
+    key = models.CharField(max_length=150, unique=True)
+    token = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _('Delivery key')
+        verbose_name_plural = _('Delivery keys')
+
+    def __str__(self):
+        return self.key
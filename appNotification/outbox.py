@@ -0,0 +1,478 @@
+import logging
+import random
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone, translation
+from django.utils.translation import gettext_lazy as _
+
+from . import coalescing, watermarks
+from .digests import outbox_messages
+from .idempotency import acquire, delivery_key
+from .mail import PERMANENT, build_message, classify_error, send_messages
+from .metrics import increment
+from .rendering import content_cache_key, group_by_language, render_shared_body
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxTemplate:
+    """Описание письма из outbox: шаблон, модель контекста, тема и запись в журнал действий"""
+
+    def __init__(self, template_name, model, build, select_related=(), log_action=None, bulk=False,
+                 url=None, coalesce=False, overflow_to_digest=False, render=None):
+        self.template_name = template_name
+        self.model = model
+        self.build = build
+        self.select_related = select_related
+        self.log_action = log_action
+        # Массовые рассылки кешируют общую часть письма между чанками и разбираются
+        # отдельным дренером в очереди fanout, не задерживая транзакционные письма
+        self.bulk = bulk
+        # Ссылка на объект в сводном письме; по умолчанию get_absolute_url() объекта
+        self.url = url
+        # События копятся в окне NOTIFICATION_COALESCE_WINDOW и уходят одним письмом;
+        # с overflow_to_digest сверх дневного лимита остаются до еженедельного дайджеста
+        self.coalesce = coalesce
+        self.overflow_to_digest = overflow_to_digest
+        # Письма, у которых тело свое у каждого получателя (дайджесты), целиком строит
+        # render(obj, rows) вместо общего шаблона; build и log_action тогда не используются
+        self.render = render
+
+    def get_model(self):
+        from django.apps import apps
+        return apps.get_model(self.model)
+
+
+def _response_created(response):
+    return _('New response to your post'), {'post': response.post, 'response': response}
+
+
+def _response_accepted(response):
+    return _('Your response was accepted'), {'post': response.post, 'response': response}
+
+
+def _news_created(news):
+    return _('New news on MMORPG Portal: {}').format(news.title), {'news': news}
+
+
+def _post_created(post):
+    subject = _('New post in category {}: {}').format(post.get_category_display(), post.title)
+    return subject, {'post': post, 'category': post.get_category_display()}
+
+
+def _response_url(response):
+    return response.post.get_absolute_url()
+
+
+TEMPLATES = {
+    'response_created': OutboxTemplate(
+        'appNotification/emails/response_created.txt', 'appNotification.Response', _response_created,
+        select_related=('post', 'author'), url=_response_url, coalesce=True,
+    ),
+    'response_accepted': OutboxTemplate(
+        'appNotification/emails/response_accepted.txt', 'appNotification.Response', _response_accepted,
+        select_related=('post', 'author'),
+    ),
+    'news_created': OutboxTemplate(
+        'appNotification/emails/new_news_notification.txt', 'appNotification.News', _news_created,
+        log_action='Received notification about news {obj.id}', bulk=True,
+    ),
+    'post_created': OutboxTemplate(
+        'appNotification/emails/new_post_notification.txt', 'appNotification.Post', _post_created,
+        select_related=('author',),
+        log_action='Received notification about post {obj.id} in category {obj.category}', bulk=True,
+        coalesce=True, overflow_to_digest=True,
+    ),
+    # Еженедельные дайджесты: context_id — запуск рассылки, шард пишет строки и сам отправляет первую попытку
+    'digest_newsletter': OutboxTemplate(
+        'appNotification/emails/weekly_news.txt', 'appNotification.DigestRun', None, bulk=True,
+        render=outbox_messages,
+    ),
+    'digest_posts': OutboxTemplate(
+        'appNotification/emails/weekly_posts.txt', 'appNotification.DigestRun', None, bulk=True,
+        render=outbox_messages,
+    ),
+}
+
+
+def render_template(spec, obj):
+    """Тема и общая часть письма по шаблону outbox; у массовых рассылок тело кешируется между чанками"""
+    subject, context = spec.build(obj)
+    body = render_shared_body(spec.template_name, {**context, 'SITE_URL': settings.SITE_URL},
+                              cache_key=content_cache_key(obj) if spec.bulk else None)
+    return subject, body
+
+
+def enqueue(template_key, obj, recipient='', user=None):
+    """
+    Записывает уведомление в outbox в текущей транзакции и будит дренер после коммита.
+    Без recipient запись означает рассылку всей аудитории объекта.
+    Повторная запись того же события для того же получателя ничего не делает.
+    """
+    from .models import OutboxMessage
+    from .tasks import drain_bulk_outbox, drain_outbox
+
+    if user is not None and not acquire([delivery_key(f'{template_key}:{obj.pk}', user.pk)]):
+        return None
+
+    spec = TEMPLATES[template_key]
+    drain = drain_bulk_outbox if spec.bulk else drain_outbox
+    flush_at = None
+    if spec.coalesce and user is not None and coalescing.enabled():
+        flush_at = coalescing.flush_times([user.pk])[user.pk]
+
+    message = OutboxMessage.objects.create(
+        template_key=template_key,
+        context_id=obj.pk,
+        recipient=recipient,
+        user=user,
+        next_attempt_at=flush_at,
+    )
+    if flush_at:
+        transaction.on_commit(lambda: coalescing.schedule_flush(drain, flush_at))
+    else:
+        transaction.on_commit(lambda: drain.delay())
+    return message
+
+
+def enqueue_recipients(template_key, context_id, recipients):
+    """
+    Записывает письма чанка рассылки одним INSERT и сразу закрепляет их за вызывающим,
+    чтобы параллельные дренеры их не перехватили. Возвращает токен захвата.
+    """
+    from .models import OutboxMessage
+
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(
+            template_key=template_key,
+            context_id=context_id,
+            recipient=email,
+            user_id=user_id,
+            status=OutboxMessage.STATUS_SENDING,
+            attempts=1,
+            claim_token=token,
+            claimed_at=now,
+        )
+        for user_id, email, first_name in recipients
+    ])
+    return token
+
+
+def enqueue_buffered(template_key, context_id, recipients):
+    """
+    Записывает письма чанка в буфер получателей: каждое ждет конца окна своего
+    пользователя и уйдет вместе с другими его событиями. Возвращает число писем.
+    """
+    from .models import OutboxMessage
+    from .tasks import drain_bulk_outbox, drain_outbox
+
+    recipients = list(recipients)
+    flush_at = coalescing.flush_times(user_id for user_id, email, first_name in recipients)
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(
+            template_key=template_key,
+            context_id=context_id,
+            recipient=email,
+            user_id=user_id,
+            next_attempt_at=flush_at[user_id],
+        )
+        for user_id, email, first_name in recipients
+    ])
+
+    # Дренер ставится после коммита, чтобы не разбудить его раньше, чем строки станут видны
+    drain = drain_bulk_outbox if TEMPLATES[template_key].bulk else drain_outbox
+    for moment in set(flush_at.values()):
+        transaction.on_commit(lambda moment=moment: coalescing.schedule_flush(drain, moment))
+    return len(recipients)
+
+
+def template_keys(bulk):
+    return [key for key, spec in TEMPLATES.items() if spec.bulk == bulk]
+
+
+def _buffered_siblings(claimable, ids):
+    """
+    Остальные готовые события тех же получателей из склеиваемых шаблонов, в том числе
+    из очереди другого дренера: все события пользователя уходят одним захватом и одним письмом
+    """
+    from .models import OutboxMessage
+
+    keys = [key for key, spec in TEMPLATES.items() if spec.coalesce]
+    user_ids = set(OutboxMessage.objects.filter(
+        id__in=ids, template_key__in=keys, user__isnull=False
+    ).exclude(recipient='').values_list('user_id', flat=True))
+    if not user_ids:
+        return []
+
+    siblings = OutboxMessage.objects.filter(
+        claimable, template_key__in=keys, user_id__in=user_ids
+    ).exclude(recipient='').exclude(id__in=ids)
+    if connection.features.has_select_for_update_skip_locked:
+        siblings = siblings.select_for_update(skip_locked=True)
+    return list(siblings.values_list('id', flat=True))
+
+
+def claim_batch(batch_size, keys=None):
+    """
+    Забирает пачку ожидающих писем и возвращает (токен, число строк).
+    На Postgres строки выбираются через SELECT ... FOR UPDATE SKIP LOCKED; на SQLite запись
+    и так сериализована, а условный UPDATE по статусу не дает двум дренерам захватить одну строку.
+    При склейке уведомлений пачка дополняется остальными событиями её получателей,
+    поэтому может оказаться больше batch_size.
+    """
+    from .models import OutboxMessage
+
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    stale_before = now - settings.NOTIFICATION_OUTBOX_CLAIM_TIMEOUT
+    # Строки, застрявшие в sending после падения воркера, снова доступны для захвата
+    # Отложенные повторы ждут своего next_attempt_at
+    claimable = ((Q(status=OutboxMessage.STATUS_PENDING)
+                  & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)))
+                 | Q(status=OutboxMessage.STATUS_SENDING, claimed_at__lt=stale_before))
+
+    with transaction.atomic():
+        candidates = OutboxMessage.objects.filter(claimable).order_by('id')
+        if keys is not None:
+            candidates = candidates.filter(template_key__in=keys)
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:batch_size])
+        if coalescing.enabled():
+            ids.extend(_buffered_siblings(claimable, ids))
+
+        claimed = OutboxMessage.objects.filter(claimable, id__in=ids).update(
+            status=OutboxMessage.STATUS_SENDING,
+            claim_token=token,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+
+    return token, claimed
+
+
+def retry_delay(attempt):
+    """Экспоненциальная задержка перед повтором со случайным разбросом, чтобы повторы не шли волной"""
+    base = settings.NOTIFICATION_RETRY_BASE_DELAY.total_seconds()
+    delay = min(settings.NOTIFICATION_RETRY_MAX_DELAY.total_seconds(), base * 2 ** (attempt - 1))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def _handle_failures(failed, attempts):
+    """
+    Временные ошибки возвращают письмо в очередь с задержкой, постоянные
+    и исчерпавшие попытки уходят в dead-letter
+    """
+    from .models import DeadLetter, OutboxMessage
+
+    now = timezone.now()
+    max_attempts = settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS
+    dead_letters = []
+
+    for message, error in failed:
+        kind, code = classify_error(error)
+
+        # Сводное письмо несет несколько строк outbox, каждая учитывает свои попытки
+        for outbox_id in message.outbox_ids:
+            attempt = attempts[outbox_id]
+            if kind == PERMANENT or attempt >= max_attempts:
+                OutboxMessage.objects.filter(id=outbox_id).update(
+                    status=OutboxMessage.STATUS_FAILED, last_error=str(error)
+                )
+                dead_letters.append(DeadLetter(
+                    message_id=outbox_id,
+                    reason=DeadLetter.REASON_PERMANENT if kind == PERMANENT else DeadLetter.REASON_EXHAUSTED,
+                    error_code=code,
+                    error=str(error),
+                ))
+            else:
+                OutboxMessage.objects.filter(id=outbox_id).update(
+                    status=OutboxMessage.STATUS_PENDING,
+                    last_error=str(error),
+                    next_attempt_at=now + retry_delay(attempt),
+                )
+
+    DeadLetter.objects.bulk_create(dead_letters)
+    failed_rows = sum(len(message.outbox_ids) for message, error in failed)
+    if dead_letters:
+        increment('outbox_dead_lettered', len(dead_letters))
+    if failed_rows > len(dead_letters):
+        increment('outbox_retried', failed_rows - len(dead_letters))
+
+
+def replay_dead_letters(dead_letters):
+    """Возвращает письма из dead-letter в outbox как новые и будит дренеры; возвращает их число"""
+    from .models import DeadLetter, OutboxMessage
+    from .tasks import drain_bulk_outbox, drain_outbox
+
+    with transaction.atomic():
+        letters = list(dead_letters.filter(replayed_at__isnull=True).select_related('message'))
+        OutboxMessage.objects.filter(id__in=[letter.message_id for letter in letters]).update(
+            status=OutboxMessage.STATUS_PENDING, attempts=0, next_attempt_at=None, claim_token='', last_error=''
+        )
+        DeadLetter.objects.filter(id__in=[letter.id for letter in letters]).update(replayed_at=timezone.now())
+
+        bulk = {TEMPLATES[letter.message.template_key].bulk for letter in letters
+                if letter.message.template_key in TEMPLATES}
+        if True in bulk:
+            transaction.on_commit(lambda: drain_bulk_outbox.delay())
+        if False in bulk:
+            transaction.on_commit(lambda: drain_outbox.delay())
+
+    return len(letters)
+
+
+def deliver(token):
+    """
+    Отправляет закрепленные за токеном письма и отмечает результат.
+    Ошибка одного получателя не мешает остальным; отложенные rate limiter
+    письма возвращаются в pending без учета попытки.
+    """
+    from .models import OutboxMessage
+    from .tasks import send_news_notification, send_post_notification
+    from appUser.models import UserActionLog
+
+    fanout_tasks = {
+        'news_created': send_news_notification,
+        'post_created': send_post_notification,
+    }
+
+    rows = OutboxMessage.objects.filter(claim_token=token, status=OutboxMessage.STATUS_SENDING).values_list(
+        'id', 'template_key', 'context_id', 'recipient', 'user_id', 'user__first_name', 'attempts', 'user__language'
+    )
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[1], row[2]].append(row)
+
+    messages = []
+    attempts = {}
+    log_actions = {}
+    missing = []
+    empty = []
+
+    for (template_key, context_id), group in groups.items():
+        spec = TEMPLATES.get(template_key)
+        obj = None
+        if spec is not None:
+            obj = spec.get_model().objects.select_related(*spec.select_related).filter(pk=context_id).first()
+
+        if obj is None:
+            missing.extend(row[0] for row in group)
+            continue
+
+        # Запись без получателя разворачивается координатором в письма по чанкам
+        audience_rows = [row for row in group if not row[3]]
+        for row in audience_rows:
+            fanout_tasks[template_key].delay(context_id)
+        OutboxMessage.objects.filter(id__in=[row[0] for row in audience_rows]).update(
+            status=OutboxMessage.STATUS_DELIVERED, sent_at=timezone.now()
+        )
+
+        recipient_rows = [row for row in group if row[3]]
+        if not recipient_rows:
+            continue
+
+        if spec.render is not None:
+            rendered = spec.render(obj, recipient_rows)
+            covered = {outbox_id for message in rendered for outbox_id in message.outbox_ids}
+            empty.extend(row[0] for row in recipient_rows if row[0] not in covered)
+            row_attempts = {row[0]: row[6] for row in recipient_rows}
+            for message in rendered:
+                messages.append(message)
+                for outbox_id in message.outbox_ids:
+                    attempts[outbox_id] = row_attempts[outbox_id]
+                    if message.action and message.user_id:
+                        log_actions[outbox_id] = UserActionLog(user_id=message.user_id, action=message.action)
+            continue
+
+        action = spec.log_action.format(obj=obj) if spec.log_action else None
+
+        # Тема и общее тело рендерятся один раз на объект и язык; получатели без профиля — на языке сайта
+        for language, language_rows in group_by_language(recipient_rows, lambda row: row[7]).items():
+            with translation.override(language):
+                subject, body = render_template(spec, obj)
+                subject = str(subject)
+
+            coalesce_item = None
+            if spec.coalesce:
+                coalesce_item = {'subject': subject, 'url': spec.url(obj) if spec.url else obj.get_absolute_url()}
+
+            for outbox_id, _key, _context_id, email, user_id, first_name, attempt, _language in language_rows:
+                message = build_message(subject, body.personalize(email, first_name or ''), email,
+                                        html=body.personalize_html(email, first_name or ''))
+                message.outbox_ids = [outbox_id]
+                message.user_id = user_id
+                message.recipient_name = first_name or email
+                message.language = language
+                message.coalesce_item = coalesce_item
+                message.overflow_to_digest = spec.overflow_to_digest
+                messages.append(message)
+                attempts[outbox_id] = attempt
+                if action and user_id:
+                    log_actions[outbox_id] = UserActionLog(user_id=user_id, action=action)
+
+    if missing:
+        OutboxMessage.objects.filter(id__in=missing).update(
+            status=OutboxMessage.STATUS_FAILED, last_error='Context object no longer exists'
+        )
+    if empty:
+        # Получателю больше нечего отправлять (отписался или уже получил всё новое): долга перед ним нет
+        OutboxMessage.objects.filter(id__in=empty).update(
+            status=OutboxMessage.STATUS_DELIVERED, sent_at=timezone.now(), last_error=''
+        )
+
+    return dispatch(messages, attempts, log_actions)
+
+
+def dispatch(messages, attempts, log_actions):
+    """
+    Отправляет готовые письма строк outbox и отмечает результат: доставленные, повтор
+    или dead-letter для ошибок, возврат в очередь для отложенных. attempts и log_actions —
+    номер попытки и запись журнала по id строки outbox. После доставки дайджеста
+    сдвигается отметка получателя.
+    """
+    from .models import OutboxMessage
+    from appUser.models import UserActionLog
+
+    messages, overflow = coalescing.combine(messages)
+    if overflow:
+        OutboxMessage.objects.filter(id__in=overflow).update(
+            status=OutboxMessage.STATUS_DIGEST, sent_at=timezone.now()
+        )
+        increment('notifications_capped', len(overflow))
+
+    result = send_messages(messages)
+
+    delivered_ids = [outbox_id for message in result.sent for outbox_id in message.outbox_ids]
+    OutboxMessage.objects.filter(id__in=delivered_ids).update(
+        status=OutboxMessage.STATUS_DELIVERED, sent_at=timezone.now(), last_error=''
+    )
+
+    _handle_failures(result.failed, attempts)
+
+    # Отложенные письма остаются в outbox и не забираются дренером раньше, чем освободится релей
+    deferred_ids = [outbox_id for message in result.deferred for outbox_id in message.outbox_ids]
+    OutboxMessage.objects.filter(id__in=deferred_ids).update(
+        status=OutboxMessage.STATUS_PENDING, attempts=F('attempts') - 1,
+        next_attempt_at=timezone.now() + timedelta(seconds=result.retry_after),
+    )
+
+    UserActionLog.objects.bulk_create(
+        log_actions[outbox_id] for outbox_id in delivered_ids if outbox_id in log_actions
+    )
+
+    advanced = defaultdict(list)
+    for message in result.sent:
+        if getattr(message, 'watermark', None):
+            advanced[message.watermark].append(message.user_id)
+    for (channel, mark), user_ids in advanced.items():
+        watermarks.advance(channel, user_ids, mark)
+
+    return result
@@ -0,0 +1,187 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from .audience import NEWS, category_audience
+from .digests import DIGESTS, DigestBundle
+from .idempotency import iso_week
+from .mail import build_message
+from .outbox import TEMPLATES, render_template
+from .segments import segment_index
+
+# Адрес в примерах писем: реальным подписчикам при планировании ничего не уходит
+SAMPLE_RECIPIENT = 'subscriber@example.com'
+
+
+class FanoutPlan:
+    """Оценка рассылки без отправки: число писем, объем, ожидаемая длительность и примеры писем"""
+
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.messages = 0
+        self.bytes = 0
+        self.samples = {}
+        self.rate = None
+        self.rate_source = None
+        self.seconds = 0
+        self.notes = []
+
+    def add_sample(self, variant, message):
+        self.samples[variant] = {'subject': message.subject, 'to': message.to[0], 'body': message.body}
+        for content, mimetype in getattr(message, 'alternatives', []):
+            if mimetype == 'text/html':
+                self.samples[variant]['html'] = content
+
+    def as_dict(self, samples=True):
+        result = {
+            'kind': self.kind,
+            'target': self.target,
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'messages_per_second': self.rate,
+            'rate_source': self.rate_source,
+            'estimated_seconds': self.seconds,
+            'notes': self.notes,
+        }
+        if samples:
+            result['samples'] = self.samples
+        return result
+
+    def __str__(self):
+        return (f'{self.target}: {self.messages} messages, {self.bytes / 1024:.1f} KiB, '
+                f'~{timedelta(seconds=round(self.seconds))} at {self.rate} msg/s ({self.rate_source})')
+
+
+def message_size(message):
+    """Размер письма в байтах так, как оно уйдет в SMTP"""
+    return len(message.message().as_bytes())
+
+
+def _fanout_rate(template_key):
+    """Скорость прошлых массовых рассылок шаблона: писем на секунду от захвата до доставки"""
+    from .models import OutboxMessage
+
+    history = OutboxMessage.objects.filter(
+        template_key=template_key, status=OutboxMessage.STATUS_DELIVERED,
+        sent_at__gte=timezone.now() - settings.NOTIFICATION_PLANNING_HISTORY,
+    ).exclude(recipient='').values('context_id').annotate(
+        count=Count('id'), first=Min('claimed_at'), last=Max('sent_at'),
+    ).filter(count__gte=settings.NOTIFICATION_PLANNING_MIN_SAMPLE).order_by('-last')[:20]
+
+    sent = seconds = 0
+    for row in history:
+        if row['first'] and row['last'] > row['first']:
+            sent += row['count']
+            seconds += (row['last'] - row['first']).total_seconds()
+    return sent / seconds if seconds else None
+
+
+def _digest_rate(kind):
+    """Скорость завершенных еженедельных рассылок того же вида"""
+    from .models import DigestRun
+
+    runs = DigestRun.objects.filter(
+        kind=kind, status=DigestRun.STATUS_COMPLETED, finished_at__isnull=False,
+        finished_at__gte=timezone.now() - settings.NOTIFICATION_PLANNING_HISTORY,
+    ).order_by('-finished_at')[:10]
+
+    sent = seconds = 0
+    for run in runs:
+        sent += run.progress()['sent']
+        seconds += (run.finished_at - run.started_at).total_seconds()
+    return sent / seconds if sent and seconds else None
+
+
+def _estimate_time(plan, measured_rate):
+    """
+    Длительность по измеренной скорости; без истории — по бюджету релея.
+    Скорость не может превысить бюджет rate limiter, а часовой бюджет растягивает большие рассылки.
+    """
+    relay = settings.NOTIFICATION_RATE_LIMITS['relay']
+    if measured_rate:
+        plan.rate, plan.rate_source = min(measured_rate, relay['per_second']), 'history'
+    else:
+        plan.rate, plan.rate_source = relay['per_second'], 'relay budget'
+
+    seconds = plan.messages / plan.rate
+    if plan.messages > relay['per_hour']:
+        seconds = max(seconds, plan.messages / relay['per_hour'] * 3600)
+        plan.notes.append('Limited by the hourly relay budget')
+    plan.rate = round(plan.rate, 2)
+    plan.seconds = math.ceil(seconds)
+
+
+def _plan_outbox(kind, template_key, obj, audience):
+    plan = FanoutPlan(kind, f'{obj._meta.verbose_name} {obj.pk}: {obj}')
+    plan.messages = segment_index.get().count(any_of=[audience])
+
+    subject, body = render_template(TEMPLATES[template_key], obj)
+    sample = build_message(subject, body.personalize(SAMPLE_RECIPIENT), SAMPLE_RECIPIENT,
+                           html=body.personalize_html(SAMPLE_RECIPIENT))
+    plan.add_sample(template_key, sample)
+    plan.bytes = plan.messages * message_size(sample)
+
+    if TEMPLATES[template_key].coalesce:
+        plan.notes.append('Recipients with other pending events within the coalescing window get one combined email')
+    _estimate_time(plan, _fanout_rate(template_key))
+    return plan
+
+
+def plan_news(news):
+    """Рассылка о новости всем подписчикам новостей"""
+    return _plan_outbox('news', 'news_created', news, NEWS)
+
+
+def plan_post(post):
+    """Рассылка об объявлении подписчикам его категории"""
+    return _plan_outbox('post', 'post_created', post, category_audience(post.category))
+
+
+def plan_digest(kind):
+    """
+    Еженедельная рассылка за текущую неделю. Отметки доставки не учитываются:
+    пользователи, уже получившие материалы, тоже посчитаны, поэтому оценка сверху.
+    """
+    from .models import DigestRun
+
+    now = timezone.now()
+    digest = DIGESTS[kind](now - timedelta(days=7), now)
+    plan = FanoutPlan(kind, f'{kind} {iso_week(now)}')
+
+    completed = DigestRun.objects.filter(kind=kind, period=iso_week(now), status=DigestRun.STATUS_COMPLETED)
+    if completed.filter(bucket='').exists():
+        plan.notes.append('This week\'s run is already completed')
+        return plan
+    buckets_done = completed.exclude(bucket='').count()
+    if buckets_done:
+        plan.notes.append(f'{buckets_done} timezone buckets are already completed this week')
+    if not digest:
+        plan.notes.append('No new content this week')
+        return plan
+
+    matrix = segment_index.get()
+    if kind == 'newsletter':
+        plan.messages = matrix.count(any_of=[NEWS])
+        text, html = digest.render(DigestBundle(None, SAMPLE_RECIPIENT, '', []))
+        sample = build_message(digest.subject, text, SAMPLE_RECIPIENT, html=html)
+        plan.bytes = plan.messages * message_size(sample)
+    else:
+        categories = list(digest.posts_by_category)
+        plan.messages = matrix.reach([category_audience(value) for value in categories])
+        text, html = digest.render(DigestBundle(None, SAMPLE_RECIPIENT, '', categories))
+        sample = build_message(digest.subject, text, SAMPLE_RECIPIENT, html=html)
+        # Письмо состоит из общей рамки и секций категорий пользователя: объем считается по секциям
+        frame, sections = digest.size_estimate()
+        envelope = message_size(sample) - len(text.encode()) - len(html.encode())
+        plan.bytes = plan.messages * (envelope + frame) + sum(
+            size * matrix.count(any_of=[category_audience(value)]) for value, size in sections.items()
+        )
+    plan.add_sample(kind, sample)
+    plan.notes.append('Upper bound: users who already received this content are not excluded')
+
+    _estimate_time(plan, _digest_rate(kind))
+    return plan
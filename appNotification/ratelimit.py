@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Все корзины запроса проверяются и списываются атомарно: либо токен берется из каждой, либо ни из одной
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local value = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    value = math.min(capacity, value + math.max(0, now - ts) * rate)
+    tokens[i] = value
+    if value < 1 then
+        wait = math.max(wait, (1 - value) / rate)
+    end
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local value = tokens[i]
+    if wait == 0 then
+        value = value - 1
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(value), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+class Bucket:
+    def __init__(self, key, capacity, period):
+        self.key = key
+        self.capacity = capacity
+        self.rate = capacity / period
+
+    def refill(self, tokens, elapsed):
+        return min(self.capacity, tokens + max(0, elapsed) * self.rate)
+
+
+class InProcessBackend:
+    """Корзины в памяти процесса: используются без Redis или при его недоступности"""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _current(self, bucket, now):
+        tokens, ts = self._state.get(bucket.key, (bucket.capacity, now))
+        return bucket.refill(tokens, now - ts)
+
+    def take(self, buckets):
+        with self._lock:
+            now = time.monotonic()
+            tokens = [self._current(bucket, now) for bucket in buckets]
+            wait = max([(1 - value) / bucket.rate for bucket, value in zip(buckets, tokens) if value < 1],
+                       default=0)
+            for bucket, value in zip(buckets, tokens):
+                self._state[bucket.key] = (value if wait else value - 1, now)
+            return wait
+
+    def peek(self, bucket):
+        with self._lock:
+            return self._current(bucket, time.monotonic())
+
+
+class RedisBackend:
+    """Общие для всех воркеров корзины в Redis"""
+
+    def __init__(self, client):
+        self._client = client
+        self._script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, buckets):
+        args = [time.time()]
+        for bucket in buckets:
+            args.extend([bucket.capacity, bucket.rate])
+        return float(self._script(keys=[bucket.key for bucket in buckets], args=args))
+
+    def peek(self, bucket):
+        tokens, ts = self._client.hmget(bucket.key, 'tokens', 'ts')
+        if tokens is None:
+            return bucket.capacity
+        return bucket.refill(float(tokens), time.time() - float(ts))
+
+
+class RateLimiter:
+    """
+    Token bucket для исходящей почты: общий бюджет SMTP-релея плюс бюджеты
+    отдельных почтовых провайдеров (по домену получателя), в секунду и в час.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._fallback = InProcessBackend()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self._fallback
+            if 'django_redis' in settings.CACHES['default']['BACKEND']:
+                try:
+                    from django_redis import get_redis_connection
+                    self._backend = RedisBackend(get_redis_connection('default'))
+                except Exception as e:
+                    logger.warning(f"Redis rate limiter unavailable, using in-process buckets: {e}")
+        return self._backend
+
+    def _relay(self):
+        return f'relay:{settings.EMAIL_HOST or "local"}', settings.NOTIFICATION_RATE_LIMITS['relay']
+
+    def _limits(self):
+        yield self._relay()
+        for domain, config in settings.NOTIFICATION_RATE_LIMITS.get('domains', {}).items():
+            yield f'domain:{domain}', config
+
+    def buckets_for(self, domain):
+        limits = [self._relay()]
+        domains = settings.NOTIFICATION_RATE_LIMITS.get('domains', {})
+        if domain in domains:
+            limits.append((f'domain:{domain}', domains[domain]))
+        return [bucket for name, config in limits for bucket in self._buckets(name, config)]
+
+    def _buckets(self, name, config):
+        return [
+            Bucket(f'smtp_rate:{name}:second', config['per_second'], 1),
+            Bucket(f'smtp_rate:{name}:hour', config['per_hour'], 3600),
+        ]
+
+    def acquire(self, domain):
+        """Берет токен на одно письмо; возвращает 0 или сколько секунд ждать до следующего"""
+        buckets = self.buckets_for(domain)
+        try:
+            return self.backend.take(buckets)
+        except Exception as e:
+            logger.warning(f"Rate limiter backend failed, using in-process buckets: {e}")
+            return self._fallback.take(buckets)
+
+    def budget(self):
+        """Текущий остаток токенов по всем настроенным корзинам"""
+        budget = {}
+        for name, config in self._limits():
+            for bucket in self._buckets(name, config):
+                try:
+                    budget[bucket.key] = round(self.backend.peek(bucket), 2)
+                except Exception:
+                    budget[bucket.key] = round(self._fallback.peek(bucket), 2)
+        return budget
+
+
+rate_limiter = RateLimiter()
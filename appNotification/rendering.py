@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.html import escape
+
+# Подставляется вместо user.first_name/user.email при рендеринге общей части письма
+RECIPIENT_PLACEHOLDER = '%%recipient_name%%'
+SHARED_BODY_TIMEOUT = 60 * 60
+
+PLACEHOLDER_USER = {'first_name': RECIPIENT_PLACEHOLDER, 'email': RECIPIENT_PLACEHOLDER}
+
+
+class SharedBody:
+    """
+    Отрендеренное письмо (текст и HTML), в которое на каждого получателя подставляется только обращение
+    """
+
+    def __init__(self, text, html=None):
+        self.text = text
+        self.html = html
+        self._parts = text.split(RECIPIENT_PLACEHOLDER)
+        self._html_parts = html.split(RECIPIENT_PLACEHOLDER) if html is not None else None
+
+    def personalize(self, email, first_name=''):
+        # То же, что {{ user.first_name|default:user.email }} в шаблоне
+        return (first_name or email).join(self._parts)
+
+    def personalize_html(self, email, first_name=''):
+        if self._html_parts is None:
+            return None
+        return escape(first_name or email).join(self._html_parts)
+
+
+def html_template_name(template_name):
+    """HTML-шаблон письма лежит рядом с текстовым: name.txt -> name.html"""
+    return template_name.rpartition('.')[0] + '.html'
+
+
+def render_email(template_name, context):
+    """Текстовая и HTML-версии письма по парным шаблонам"""
+    return render_to_string(template_name, context), render_to_string(html_template_name(template_name), context)
+
+
+def render_shared_body(template_name, context, cache_key=None):
+    """
+    Рендерит тяжелую общую часть письма (список, выдержки, ссылки) один раз
+    на объект и язык, в текстовом и HTML-виде. С cache_key результат переиспользуется
+    между чанками рассылки.
+    """
+    full_key = None
+    rendered = None
+
+    if cache_key:
+        full_key = f'notification_email:{template_name}:{cache_key}:{translation.get_language()}'
+        rendered = cache.get(full_key)
+
+    if rendered is None:
+        rendered = render_email(template_name, {**context, 'user': PLACEHOLDER_USER})
+        if full_key:
+            cache.set(full_key, rendered, SHARED_BODY_TIMEOUT)
+
+    return SharedBody(*rendered)
+
+
+def content_cache_key(obj):
+    """Ключ общей части письма, меняющийся при редактировании объекта"""
+    return f'{obj._meta.label_lower}:{obj.pk}:{obj.updated_at.timestamp()}'
+
+
+def recipient_language(language):
+    """Язык письма: выбранный пользователем, если сайт его поддерживает, иначе язык сайта"""
+    if language in {code for code, _name in settings.LANGUAGES}:
+        return language
+    return settings.LANGUAGE_CODE
+
+
+def group_by_language(items, language_of):
+    """Получатели по языкам: перевод включается один раз на группу, а не на каждого"""
+    groups = defaultdict(list)
+    for item in items:
+        groups[recipient_language(language_of(item))].append(item)
+    return groups
@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .idempotency import iso_week
+
+# Часовые пояса, выбранные пользователями; по ним строятся корзины рассылки
+TIMEZONES_KEY = 'digest_timezones'
+
+
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        # Неизвестный пояс в профиле — письма уходят по UTC
+        return dt_timezone.utc
+
+
+def utc_offset(name, at):
+    """Смещение пояса от UTC в минутах на момент at (с учетом летнего времени)"""
+    return int(at.astimezone(_zone(name)).utcoffset().total_seconds() // 60)
+
+
+def bucket_name(offset):
+    sign = '+' if offset >= 0 else '-'
+    hours, minutes = divmod(abs(offset), 60)
+    return f'UTC{sign}{hours:02d}:{minutes:02d}'
+
+
+def timezones_in_use():
+    """Различные часовые пояса пользователей; список кешируется, смена пояса пользователем его поправляет"""
+    names = cache.get(TIMEZONES_KEY)
+    if names is None:
+        from django.contrib.auth import get_user_model
+
+        names = sorted(get_user_model().objects.order_by().values_list('timezone', flat=True).distinct())
+        cache.set(TIMEZONES_KEY, names, int(settings.NOTIFICATION_DIGEST_TIMEZONES_TTL.total_seconds()))
+    return names
+
+
+def timezone_changed(name):
+    """
+    Пользователь выбрал пояс name. Уже известный пояс ничего не стоит; новый сбрасывает
+    список, и следующий запуск планировщика перечитает его одним запросом
+    """
+    names = cache.get(TIMEZONES_KEY)
+    if names is not None and name not in names:
+        cache.delete(TIMEZONES_KEY)
+
+
+class Bucket:
+    """Пользователи, у которых сейчас одинаковое смещение от UTC и, значит, одинаковое местное время"""
+
+    def __init__(self, offset, timezones, now):
+        self.offset = offset
+        self.timezones = timezones
+        self.name = bucket_name(offset)
+        self.local_now = now.astimezone(dt_timezone(timedelta(minutes=offset)))
+        # Период — местная неделя: у всех корзин он один и тот же, как и ключи доставки
+        self.period = iso_week(self.local_now)
+
+    def due(self, weekday, hour):
+        """
+        Настроенный местный день недели и час этой недели наступили не раньше чем
+        NOTIFICATION_DIGEST_CATCH_UP назад: после простоя планировщика корзины догоняют,
+        но первый запуск не рассылает разом всем пояса, чей час давно прошел
+        """
+        local = self.local_now
+        target = local.replace(hour=hour, minute=0, second=0, microsecond=0) - timedelta(
+            days=local.weekday() - weekday
+        )
+        return target <= local < target + settings.NOTIFICATION_DIGEST_CATCH_UP
+
+    def __str__(self):
+        return f'{self.name} ({len(self.timezones)} timezones)'
+
+
+def buckets(now=None):
+    """Корзины по текущему смещению от UTC, от самого восточного пояса к западному"""
+    now = now or timezone.now()
+    zones_by_offset = defaultdict(list)
+    for name in timezones_in_use():
+        zones_by_offset[utc_offset(name, now)].append(name)
+    return [Bucket(offset, zones, now) for offset, zones in sorted(zones_by_offset.items(), reverse=True)]
+
+
+def due_buckets(kind, now=None):
+    """Корзины, где в эту местную неделю уже наступило время рассылки kind"""
+    schedule = settings.NOTIFICATION_DIGEST_SCHEDULE[kind]
+    return [bucket for bucket in buckets(now) if bucket.due(schedule['weekday'], schedule['hour'])]
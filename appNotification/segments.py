@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .audience import NEWS, category_audience
+
+logger = logging.getLogger(__name__)
+
+# Счетчик правок и удалений подписок в общем кеше: по нему матрицы всех процессов узнают,
+# что дочитать новые строки недостаточно
+CHANGES_KEY = 'segments:changes'
+
+
+def column(token):
+    """Колонка матрицы по значению категории или 'news'"""
+    return NEWS if token == NEWS else category_audience(token)
+
+
+def _pack(ids_by_column):
+    """Упаковывает id в битовые множества: бит с номером user_id — пользователь в колонке"""
+    size = (max((max(ids) for ids in ids_by_column.values() if ids), default=0) >> 3) + 1
+    buffers = defaultdict(lambda: bytearray(size))
+    for name, user_ids in ids_by_column.items():
+        buffer = buffers[name]
+        for user_id in user_ids:
+            buffer[user_id >> 3] |= 1 << (user_id & 7)
+    return {name: int.from_bytes(buffer, 'little') for name, buffer in buffers.items()}
+
+
+def mark_changed():
+    """Подписка изменена или удалена: матрицы перестроятся при следующей проверке"""
+    try:
+        cache.incr(CHANGES_KEY)
+    except ValueError:
+        cache.set(CHANGES_KEY, 1, None)
+
+
+def members(bits):
+    """id пользователей, чьи биты установлены, по возрастанию"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class SubscriptionMatrix:
+    """
+    Матрица пользователи × аудитории (новости и каждая категория) в памяти процесса.
+    Каждая колонка — целое число как упакованный набор бит, поэтому объединения,
+    пересечения и подсчеты выполняются побитовыми операциями над всей колонкой сразу.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.users = 0
+        self._subscriptions = (0, 0)  # (максимальный id, количество) на момент последнего чтения
+        self._users = (0, 0)
+        self._changes = None
+        self.built_at = None
+
+    def _stats(self):
+        from django.contrib.auth import get_user_model
+        from .models import Subscription
+
+        subscriptions = Subscription.objects.aggregate(max_id=Max('id'), count=Count('id'))
+        users = get_user_model().objects.aggregate(max_id=Max('id'), count=Count('id'))
+        return ((subscriptions['max_id'] or 0, subscriptions['count']),
+                (users['max_id'] or 0, users['count']))
+
+    def _rows(self, after_subscription_id, after_user_id):
+        from django.contrib.auth import get_user_model
+        from .models import Subscription
+
+        ids_by_column = defaultdict(list)
+        subscriptions = Subscription.objects.filter(id__gt=after_subscription_id).values_list(
+            'user_id', 'category__value', 'news'
+        )
+        added = 0
+        for user_id, value, news in subscriptions.iterator(chunk_size=10000):
+            added += 1
+            if value:
+                ids_by_column[category_audience(value)].append(user_id)
+            if news:
+                ids_by_column[NEWS].append(user_id)
+
+        user_ids = get_user_model().objects.filter(id__gt=after_user_id).values_list('id', flat=True)
+        ids_by_column[None] = list(user_ids.iterator(chunk_size=10000))
+        return ids_by_column, added
+
+    def build(self):
+        started = time.perf_counter()
+        # Счетчик и статистика снимаются до чтения строк: изменения между запросами применятся повторно
+        self._changes = cache.get(CHANGES_KEY)
+        self._subscriptions, self._users = self._stats()
+        ids_by_column, _added = self._rows(0, 0)
+        packed = _pack(ids_by_column)
+        self.users = packed.pop(None, 0)
+        self.columns = packed
+        self.built_at = time.time()
+        logger.info(f"Built subscription matrix: {len(self.columns)} columns, {self._users[1]} users "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    def refresh(self):
+        """
+        Дочитывает новые подписки и пользователей по возрастанию id. Если подписки правились
+        или удалялись (см. mark_changed), записей стало меньше, чем ожидалось, или матрица
+        старше NOTIFICATION_SEGMENT_MAX_AGE (правки в обход сигналов), она строится заново.
+        """
+        max_age = settings.NOTIFICATION_SEGMENT_MAX_AGE.total_seconds()
+        if (self.built_at is None or time.time() - self.built_at > max_age
+                or cache.get(CHANGES_KEY) != self._changes):
+            return self.build()
+
+        subscriptions, users = self._stats()
+        if subscriptions == self._subscriptions and users == self._users:
+            return
+
+        ids_by_column, added = self._rows(self._subscriptions[0], self._users[0])
+        if (subscriptions[1] - self._subscriptions[1] != added
+                or users[1] - self._users[1] != len(ids_by_column[None])):
+            return self.build()
+
+        for name, bits in _pack(ids_by_column).items():
+            if name is None:
+                self.users |= bits
+            else:
+                self.columns[name] = self.columns.get(name, 0) | bits
+        self._subscriptions, self._users = subscriptions, users
+
+    def select(self, any_of=(), all_of=(), none_of=()):
+        """Битовое множество пользователей: хотя бы одна из any_of, все all_of и ни одной из none_of"""
+        result = self.users
+        if any_of:
+            union = 0
+            for name in any_of:
+                union |= self.columns.get(name, 0)
+            result &= union
+        for name in all_of:
+            result &= self.columns.get(name, 0)
+        for name in none_of:
+            result &= ~self.columns.get(name, 0)
+        return result
+
+    def count(self, any_of=(), all_of=(), none_of=()):
+        return self.select(any_of, all_of, none_of).bit_count()
+
+    def user_ids(self, any_of=(), all_of=(), none_of=()):
+        return list(members(self.select(any_of, all_of, none_of)))
+
+    def reach(self, names):
+        """Сколько разных пользователей получат материал, адресованный аудиториям names"""
+        return self.count(any_of=names)
+
+    def overlap(self):
+        """Попарные пересечения аудиторий; на диагонали — размер аудитории"""
+        names = sorted(self.columns)
+        return {
+            first: {second: (self.columns[first] & self.columns[second]).bit_count() for second in names}
+            for first in names
+        }
+
+
+class SegmentIndex:
+    """Общая для процесса матрица: проверка изменений не чаще NOTIFICATION_SEGMENT_REFRESH секунд"""
+
+    def __init__(self):
+        self._matrix = SubscriptionMatrix()
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._matrix.built_at is None or now - self._checked_at >= settings.NOTIFICATION_SEGMENT_REFRESH:
+                self._matrix.refresh()
+                self._checked_at = now
+            return self._matrix
+
+
+segment_index = SegmentIndex()
@@ -1,180 +1,120 @@
-from django.db.models.signals import post_save, m2m_changed
+from django.db import transaction
+from django.db.models.signals import pre_delete, post_save, m2m_changed
 from django.dispatch import receiver
-from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
 from django.apps import apps
-from .models import News, Subscription
+from .audience import audience_index, audiences_of, held_audiences, previous_audiences_of
+from .events import response_accepted, response_created
+from .outbox import enqueue
+from .segments import mark_changed
+from .models import News
 
 def get_user_action_log_model():
     return apps.get_model('appUser', 'UserActionLog')
 
 
-@receiver(post_save, sender='appNotification.Response')
-def notify_post_author_on_response(sender, instance, created, **kwargs):
-    if created:
-        UserActionLog = get_user_action_log_model()
-
-        subject = _('New response to your post')
-        message = render_to_string('appNotification/emails/response_created.txt', {
-            'post': instance.post,
-            'response': instance,
-            'SITE_URL': settings.SITE_URL  # Добавляем SITE_URL в контекст
-        })
-
-        # Для разработки
-        print(f"\n=== NEW RESPONSE NOTIFICATION ===")
-        print(f"To: {instance.post.author.email}")
-        print(f"Subject: {subject}")
-        print(f"Post: {instance.post.title}")
-        print(f"From: {instance.author.email}")
-        print(f"Link: {settings.SITE_URL}{instance.post.get_absolute_url()}")
-        print("===============================\n")
-
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [instance.post.author.email],
-            fail_silently=False,
-        )
-
-        UserActionLog.objects.create(
-            user=instance.author,
-            action=f"Created response to post {instance.post.id}",
-        )
-
-
-@receiver(post_save, sender='appNotification.Response')
-def notify_response_author_on_accept(sender, instance, **kwargs):
-    if instance.is_accepted:
-        UserActionLog = get_user_action_log_model()
-
-        subject = _('Your response was accepted')
-        message = render_to_string('appNotification/emails/response_accepted.txt', {
-            'post': instance.post,
-            'response': instance,
-            'SITE_URL': settings.SITE_URL  # Добавляем SITE_URL в контекст
-        })
-
-        # Для разработки
-        print(f"\n=== RESPONSE ACCEPTED NOTIFICATION ===")
-        print(f"To: {instance.author.email}")
-        print(f"Subject: {subject}")
-        print(f"Post: {instance.post.title}")
-        print(f"Link: {settings.SITE_URL}{instance.post.get_absolute_url()}")
-        print("====================================\n")
-
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [instance.author.email],
-            fail_silently=False,
-        )
-
-        UserActionLog.objects.create(
-            user=instance.post.author,
-            action=f"Accepted response {instance.id} to post {instance.post.id}",
-        )
+@receiver(response_created)
+def notify_post_author_on_response(sender, response, **kwargs):
+    UserActionLog = get_user_action_log_model()
+
+    subject = _('New response to your post')
+
+    # Для разработки
+    print(f"\n=== NEW RESPONSE NOTIFICATION ===")
+    print(f"To: {response.post.author.email}")
+    print(f"Subject: {subject}")
+    print(f"Post: {response.post.title}")
+    print(f"From: {response.author.email}")
+    print(f"Link: {settings.SITE_URL}{response.post.get_absolute_url()}")
+    print("===============================\n")
+
+    enqueue('response_created', response, recipient=response.post.author.email, user=response.post.author)
+
+    UserActionLog.objects.create(
+        user=response.author,
+        action=f"Created response to post {response.post.id}",
+    )
+
+
+@receiver(response_accepted)
+def notify_response_author_on_accept(sender, response, **kwargs):
+    UserActionLog = get_user_action_log_model()
+
+    # Ключ идемпотентности отсекает гонку двух одновременных принятий одного отклика
+    if enqueue('response_accepted', response, recipient=response.author.email, user=response.author) is None:
+        return
+
+    subject = _('Your response was accepted')
+
+    # Для разработки
+    print(f"\n=== RESPONSE ACCEPTED NOTIFICATION ===")
+    print(f"To: {response.author.email}")
+    print(f"Subject: {subject}")
+    print(f"Post: {response.post.title}")
+    print(f"Link: {settings.SITE_URL}{response.post.get_absolute_url()}")
+    print("====================================\n")
+
+    UserActionLog.objects.create(
+        user=response.post.author,
+        action=f"Accepted response {response.id} to post {response.post.id}",
+    )
 
 
 @receiver(post_save, sender=News)
 def notify_subscribers_on_new_news(sender, instance, created, **kwargs):
     """
-    Отправляет уведомления подписчикам при создании новой новости
+    Записывает рассылку подписчикам новостей в outbox в транзакции сохранения
     """
     if created and instance.notify_subscribers:
-        from appUser.models import UserActionLog
-
-        # Получаем всех подписчиков на новости
-        news_subscribers = Subscription.objects.filter(news=True).select_related('user')
-
-        if news_subscribers.exists():
-            subject = _('New news on MMORPG Portal: {}').format(instance.title)
-
-            for subscription in news_subscribers:
-                message = render_to_string('appNotification/emails/new_news_notification.txt', {
-                    'news': instance,
-                    'user': subscription.user,
-                    'SITE_URL': settings.SITE_URL
-                })
-
-                # Для разработки
-                print(f"\n=== NEW NEWS NOTIFICATION ===")
-                print(f"To: {subscription.user.email}")
-                print(f"Subject: {subject}")
-                print(f"News: {instance.title}")
-                print(f"Link: {settings.SITE_URL}{instance.get_absolute_url()}")
-                print("=============================\n")
-
-                try:
-                    send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [subscription.user.email],
-                        fail_silently=False,
-                    )
-
-                    UserActionLog.objects.create(
-                        user=subscription.user,
-                        action=f"Received notification about news {instance.id}",
-                    )
-                except Exception as e:
-                    print(f"Error sending news notification to {subscription.user.email}: {e}")
+        enqueue('news_created', instance)
 
 
 @receiver(post_save, sender='appNotification.Post')
 def notify_category_subscribers_on_new_post(sender, instance, created, **kwargs):
     """
-    Отправляет уведомления подписчикам категории при создании нового объявления
+    Записывает рассылку подписчикам категории в outbox в транзакции сохранения
     """
     if created and instance.notify_subscribers:
-        from appUser.models import UserActionLog
-        from .models import Subscription
-
-        # Получаем всех подписчиков этой категории
-        category_subscribers = Subscription.objects.filter(
-            category__value=instance.category
-        ).select_related('user')
-
-        if category_subscribers.exists():
-            subject = _('New post in category {}: {}').format(
-                instance.get_category_display(),
-                instance.title
-            )
-
-            for subscription in category_subscribers:
-                message = render_to_string('appNotification/emails/new_post_notification.txt', {
-                    'post': instance,
-                    'user': subscription.user,
-                    'category': instance.get_category_display(),
-                    'SITE_URL': settings.SITE_URL
-                })
-
-                # Для разработки
-                print(f"\n=== NEW POST NOTIFICATION ===")
-                print(f"To: {subscription.user.email}")
-                print(f"Subject: {subject}")
-                print(f"Category: {instance.get_category_display()}")
-                print(f"Post: {instance.title}")
-                print(f"Link: {settings.SITE_URL}{instance.get_absolute_url()}")
-                print("=============================\n")
-
-                try:
-                    send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [subscription.user.email],
-                        fail_silently=False,
-                    )
-
-                    UserActionLog.objects.create(
-                        user=subscription.user,
-                        action=f"Received notification about post {instance.id} in category {instance.category}",
-                    )
-                except Exception as e:
-                    print(f"Error sending post notification to {subscription.user.email}: {e}")
+        enqueue('post_created', instance)
+
+
+def _withdraw(user_id, names):
+    # Ту же аудиторию может давать другая подписка пользователя (например, новости отмечены в нескольких)
+    held = held_audiences(user_id)
+    audience_index.remove(user_id, [name for name in names if name not in held])
+
+
+@receiver(post_save, sender='appNotification.Subscription')
+def index_subscription(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Подписка попадает в индекс аудиторий после коммита"""
+    if raw:
+        return
+    user_id, names = instance.user_id, audiences_of(instance)
+    if created:
+        transaction.on_commit(lambda: audience_index.add(user_id, names))
+    elif not hasattr(instance, '_loaded_values'):
+        # Объект собран без загрузки из БД: прежние категория и флаг новостей неизвестны
+        transaction.on_commit(audience_index.invalidate)
+        transaction.on_commit(mark_changed)
+    elif update_fields is None or {'category', 'category_id', 'news'} & set(update_fields):
+        previous = previous_audiences_of(instance)
+        added = [name for name in names if name not in previous]
+        dropped = [name for name in previous if name not in names]
+        if added:
+            transaction.on_commit(lambda: audience_index.add(user_id, added))
+        if dropped:
+            transaction.on_commit(lambda: _withdraw(user_id, dropped))
+        if added or dropped:
+            transaction.on_commit(mark_changed)
+
+    # Следующее сохранение того же объекта сравнивается уже с этим состоянием
+    instance.snapshot(update_fields)
+
+
+@receiver(pre_delete, sender='appNotification.Subscription')
+def unindex_subscription(sender, instance, **kwargs):
+    # Аудитории вычисляются до удаления: при каскадном удалении категории позже её уже не будет
+    user_id, names = instance.user_id, audiences_of(instance)
+    transaction.on_commit(lambda: _withdraw(user_id, names))
+    transaction.on_commit(mark_changed)
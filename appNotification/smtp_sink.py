@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+
+class SinkServer:
+    """
+    Минимальный локальный SMTP-сервер, принимающий и отбрасывающий письма.
+    Заменяет реальный релей при замерах пропускной способности диспетчера;
+    latency имитирует задержку ответа сервера на каждое письмо.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages = 0
+        self.sessions = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    async def _reply(self, writer, line):
+        writer.write(f'{line}\r\n'.encode())
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.sessions += 1
+        await self._reply(writer, '220 sink ESMTP')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+
+                if command == 'EHLO':
+                    await self._reply(writer, '250-sink\r\n250 8BITMIME')
+                elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                    await self._reply(writer, '250 OK')
+                elif command == 'DATA':
+                    await self._reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                    while (await reader.readline()) not in (b'.\r\n', b'.\n', b''):
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages += 1
+                    await self._reply(writer, '250 OK queued')
+                elif command == 'QUIT':
+                    await self._reply(writer, '221 Bye')
+                    break
+                else:
+                    await self._reply(writer, '502 Command not implemented')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке и возвращает (host, port)"""
+        self._thread = threading.Thread(target=self._serve, name='smtp-sink', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.host, self.port
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
@@ -1,60 +1,98 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from django.utils.translation import gettext_lazy as _
 from datetime import timedelta
+from itertools import islice
 import logging
+import math
+
+from .audience import NEWS, audience_index, category_audience
+from .digests import DIGESTS, build_messages
+from .idempotency import acquire, delivery_key, iso_week, release
+from .locks import singleton
+from .mail import PERMANENT, classify_error, send_message
+from .outbox import claim_batch, deliver, dispatch, enqueue_buffered, enqueue_recipients, retry_delay, template_keys
+from . import coalescing, schedule, watermarks
 
 logger = logging.getLogger(__name__)
 
 
+def _deduplicate(event, recipients):
+    """Отбрасывает получателей, которым это событие уже отправлялось"""
+    recipients = list(recipients)
+    acquired = acquire(delivery_key(event, recipient[0]) for recipient in recipients)
+    return [recipient for recipient in recipients if delivery_key(event, recipient[0]) in acquired]
+
+
+def _reschedule_deferred(task, result, *args):
+    """Бюджет отправки исчерпан: повторяем задачу позже вместо ошибки"""
+    if result.deferred:
+        countdown = math.ceil(result.retry_after)
+        logger.info(f"Rescheduling {task.name} in {countdown}s for {len(result.deferred)} deferred messages")
+        task.apply_async(args, countdown=countdown)
+
+
+def _start_digest_run(kind, bucket=None):
+    """
+    Создает запуск рассылки за текущую неделю с шардами по диапазонам id пользователей
+    или возобновляет незавершенный, и раздает шарды группой задач.
+    С bucket рассылка идет только пользователям этой корзины часовых поясов
+    """
+    from celery import group
+    from django.db.models import Q
+    from .models import DigestRun, DigestShard
+
+    now = timezone.now()
+    # Запуск и его шарды создаются одной транзакцией: сбой при разбиении аудитории не оставит
+    # запуск без шардов, который следующий тик принял бы за пустую аудиторию и завершил
+    with transaction.atomic():
+        run, created = DigestRun.objects.get_or_create(
+            kind=kind, period=bucket.period if bucket else iso_week(now), bucket=bucket.name if bucket else '',
+            defaults={'start_date': now - timedelta(days=7), 'end_date': now,
+                      'timezones': bucket.timezones if bucket else []},
+        )
+        if run.status == DigestRun.STATUS_COMPLETED:
+            return None, run
+
+        if created:
+            digest = DIGESTS[kind](run.start_date, run.end_date, timezones=run.timezones)
+            if not digest:
+                DigestRun.objects.filter(id=run.id).update(status=DigestRun.STATUS_COMPLETED, finished_at=now)
+                return None, run
+
+            shards = DigestShard.objects.bulk_create(
+                DigestShard(run=run, first_user_id=first_user_id, last_user_id=last_user_id, total=size)
+                for first_user_id, last_user_id, size in _iter_user_id_ranges(
+                    digest.audience_user_ids(), settings.NOTIFICATION_DIGEST_SHARD_SIZE
+                )
+            )
+            DigestRun.objects.filter(id=run.id).update(total=sum(shard.total for shard in shards))
+            shard_ids = [shard.id for shard in shards]
+        else:
+            # Шарды, не подававшие признаков жизни дольше таймаута, раздаются заново и продолжат с контрольной точки
+            stale_before = now - settings.NOTIFICATION_DIGEST_SHARD_TIMEOUT
+            shard_ids = list(run.shards.filter(
+                ~Q(status=DigestShard.STATUS_COMPLETED), updated_at__lt=stale_before
+            ).values_list('id', flat=True))
+
+    if shard_ids:
+        group(send_digest_shard.s(shard_id) for shard_id in shard_ids).apply_async()
+    elif not run.shards.exists():
+        # Аудитория пуста: завершать нечего, кроме самого запуска
+        DigestRun.objects.filter(id=run.id).update(status=DigestRun.STATUS_COMPLETED, finished_at=now)
+    return shard_ids, run
+
+
 @shared_task
+@singleton()
 def send_weekly_newsletter():
     """Еженедельная рассылка новостей"""
-    from .models import News, Subscription
-    from appUser.models import UserActionLog
-
     try:
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=7)
-        weekly_news = News.objects.filter(created_at__range=(start_date, end_date))
-
-        if weekly_news.exists():
-            subscriptions = Subscription.objects.filter(news=True).select_related('user')
-
-            for subscription in subscriptions:
-                subject = _('Weekly news digest from our portal')
-                message = render_to_string('appNotification/emails/weekly_news.txt', {
-                    'news': weekly_news,
-                    'user': subscription.user,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'SITE_URL': settings.SITE_URL  # Добавляем SITE_URL
-                })
-
-                # Для разработки
-                print(f"\n=== WEEKLY NEWSLETTER ===")
-                print(f"To: {subscription.user.email}")
-                print(f"Subject: {subject}")
-                print(f"News count: {weekly_news.count()}")
-                print("=========================\n")
-
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [subscription.user.email],
-                    fail_silently=False,
-                )
-
-                UserActionLog.objects.create(
-                    user=subscription.user,
-                    action="Received weekly news digest",
-                )
-
-        return f'Sent weekly newsletter to {subscriptions.count()} subscribers'
+        shard_ids, run = _start_digest_run('newsletter')
+        if shard_ids is None:
+            return f'Weekly newsletter {run.period} is already completed'
+        return f'Dispatched {len(shard_ids)} shards of weekly newsletter {run.period}'
 
     except Exception as e:
         logger.error(f"Error sending weekly newsletter: {e}")
@@ -62,57 +100,14 @@ def send_weekly_newsletter():
 
 
 @shared_task
+@singleton()
 def send_weekly_posts_digest():
-    """Еженедельная рассылка постов по категориям"""
-    from .models import Post, Subscription, Category
-    from appUser.models import UserActionLog
-
+    """Еженедельная рассылка постов: одно письмо на пользователя по всем его категориям"""
     try:
-        categories = Subscription.objects.exclude(category=None).values_list('category', flat=True).distinct()
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=7)
-
-        for category_id in categories:
-            weekly_posts = Post.objects.filter(
-                category_id=category_id,
-                created_at__range=(start_date, end_date)
-            )
-
-            if weekly_posts.exists():
-                subscriptions = Subscription.objects.filter(category_id=category_id).select_related('user')
-
-                for subscription in subscriptions:
-                    subject = _('Weekly posts digest in your subscribed category')
-                    message = render_to_string('appNotification/emails/weekly_posts.txt', {
-                        'posts': weekly_posts,
-                        'user': subscription.user,
-                        'category': subscription.category,
-                        'start_date': start_date,
-                        'end_date': end_date,
-                        'SITE_URL': settings.SITE_URL  # Добавляем SITE_URL
-                    })
-
-                    # Для разработки
-                    print(f"\n=== CATEGORY DIGEST ===")
-                    print(f"To: {subscription.user.email}")
-                    print(f"Category: {subscription.category.name}")
-                    print(f"Posts count: {weekly_posts.count()}")
-                    print("=======================\n")
-
-                    send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [subscription.user.email],
-                        fail_silently=False,
-                    )
-
-                    UserActionLog.objects.create(
-                        user=subscription.user,
-                        action=f"Received weekly posts digest for category {subscription.category.name}",
-                    )
-
-        return 'Weekly posts digest sent successfully'
+        shard_ids, run = _start_digest_run('posts')
+        if shard_ids is None:
+            return f'Weekly posts digest {run.period} is already completed'
+        return f'Dispatched {len(shard_ids)} shards of weekly posts digest {run.period}'
 
     except Exception as e:
         logger.error(f"Error sending weekly posts digest: {e}")
@@ -120,82 +115,348 @@ def send_weekly_posts_digest():
 
 
 @shared_task
-def send_news_notification(news_id):
-    """Асинхронная отправка уведомлений о новой новости"""
-    from .models import News, Subscription
-    from appUser.models import UserActionLog
+@singleton()
+def dispatch_digest_buckets():
+    """
+    Еженедельные рассылки по корзинам часовых поясов: каждая корзина получает письма
+    в настроенный местный час, и нагрузка на SMTP распределяется по суткам
+    """
+    from .models import DigestRun
 
     try:
-        news = News.objects.get(id=news_id)
-        subscribers = Subscription.objects.filter(news=True).select_related('user')
-
-        for subscription in subscribers:
-            subject = _('New news on MMORPG Portal: {}').format(news.title)
-            message = render_to_string('appNotification/emails/new_news_notification.txt', {
-                'news': news,
-                'user': subscription.user,
-                'SITE_URL': settings.SITE_URL
-            })
-
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [subscription.user.email],
-                fail_silently=False,
-            )
+        started = []
+        for kind in DIGESTS:
+            due = schedule.due_buckets(kind)
+            completed = set(DigestRun.objects.filter(
+                kind=kind, period__in={bucket.period for bucket in due}, status=DigestRun.STATUS_COMPLETED,
+            ).values_list('period', 'bucket'))
+
+            for bucket in due:
+                if (bucket.period, bucket.name) in completed:
+                    continue
+                shard_ids, run = _start_digest_run(kind, bucket)
+                if shard_ids:
+                    started.append(f'{run} ({len(shard_ids)} shards)')
+
+        if not started:
+            return 'No digest buckets due'
+        return f'Dispatched {", ".join(started)}'
+
+    except Exception as e:
+        logger.error(f"Error dispatching digest buckets: {e}")
+        return f'Error: {e}'
+
+
+def _claim_shard(shard_id):
+    """Закрепляет шард за задачей; повторная доставка той же задачи не начнет его второй раз"""
+    from django.db.models import Q
+    from .models import DigestShard
+
+    stale_before = timezone.now() - settings.NOTIFICATION_DIGEST_SHARD_TIMEOUT
+    claimed = DigestShard.objects.filter(
+        Q(status=DigestShard.STATUS_PENDING) | Q(status=DigestShard.STATUS_RUNNING, updated_at__lt=stale_before),
+        id=shard_id,
+    ).update(status=DigestShard.STATUS_RUNNING, updated_at=timezone.now())
+    if not claimed:
+        return None
+    return DigestShard.objects.select_related('run').get(id=shard_id)
+
 
-            UserActionLog.objects.create(
-                user=subscription.user,
-                action=f"Received notification about news {news.id}",
+def _finish_shard(shard):
+    from .models import DigestRun, DigestShard
+
+    DigestShard.objects.filter(id=shard.id).update(status=DigestShard.STATUS_COMPLETED, updated_at=timezone.now())
+    if not shard.run.shards.exclude(status=DigestShard.STATUS_COMPLETED).exists():
+        DigestRun.objects.filter(id=shard.run_id, status=DigestRun.STATUS_RUNNING).update(
+            status=DigestRun.STATUS_COMPLETED, finished_at=timezone.now()
+        )
+
+
+@shared_task
+def send_digest_shard(shard_id):
+    """
+    Отправка шарда еженедельной рассылки с контрольной точкой после каждой пачки.
+    Письма пачки записываются в outbox той же транзакцией, что ключи доставки и контрольная точка:
+    ошибки отправки уходят на повтор и в dead-letter, а письма, не отправленные из-за падения
+    воркера, после таймаута захвата подберет дренер
+    """
+    from django.db.models import F
+    from appUser.models import UserActionLog
+    from .models import DigestShard, OutboxMessage
+
+    shard = _claim_shard(shard_id)
+    if shard is None:
+        return f'Shard {shard_id} is completed or taken by another worker'
+
+    run = shard.run
+    # Материалы грузятся от самой старой отметки шарда, каждому пользователю достается срез новее его отметки
+    since = watermarks.floor(run.kind, shard.first_user_id, shard.last_user_id, run.start_date, run.end_date)
+    digest = DIGESTS[run.kind](run.start_date, run.end_date, since=since, timezones=run.timezones)
+    event = f'{digest.event}:{run.period}'
+    first_user_id = shard.first_user_id if shard.checkpoint_user_id is None else shard.checkpoint_user_id + 1
+    bundles = digest.bundles(first_user_id, shard.last_user_id)
+
+    while True:
+        chunk = list(islice(bundles, settings.NOTIFICATION_CHUNK_SIZE))
+        if not chunk:
+            break
+
+        marks = watermarks.load(run.kind, [bundle.user_id for bundle in chunk])
+        for bundle in chunk:
+            bundle.watermark = marks.get(bundle.user_id)
+        # Пользователи, уже получившие всё новое, пропускаются без письма
+        fresh = [bundle for bundle in chunk if digest.has_content(bundle)]
+
+        # Контрольная точка: все пользователи до неё либо пропущены, либо уже в outbox;
+        # отложенные получатели будут после неё
+        checkpoint = chunk[-1].user_id
+        with transaction.atomic():
+            acquired = acquire(delivery_key(event, bundle.user_id) for bundle in fresh)
+            pending = [bundle for bundle in fresh if delivery_key(event, bundle.user_id) in acquired]
+            token = enqueue_recipients(f'digest_{run.kind}', run.id,
+                                       [(bundle.user_id, bundle.email, bundle.first_name) for bundle in pending])
+            DigestShard.objects.filter(id=shard.id).update(
+                checkpoint_user_id=checkpoint,
+                skipped=F('skipped') + len(chunk) - len(pending),
+                updated_at=timezone.now(),
             )
 
-        return f'Sent news notification to {subscribers.count()} subscribers'
+        outbox_ids = dict(OutboxMessage.objects.filter(claim_token=token).values_list('user_id', 'id'))
+        messages = build_messages(digest, pending)
+        log_actions = {}
+        for message in messages:
+            message.outbox_ids = [outbox_ids[message.user_id]]
+            log_actions[outbox_ids[message.user_id]] = UserActionLog(user_id=message.user_id, action=message.action)
+        result = dispatch(messages, {outbox_id: 1 for outbox_id in outbox_ids.values()}, log_actions)
+
+        DigestShard.objects.filter(id=shard.id).update(
+            sent=F('sent') + len(result.sent),
+            failed=F('failed') + len(result.failed),
+            updated_at=timezone.now(),
+        )
+
+        if result.deferred:
+            # Отложенные rate limiter письма не отправлялись: строки убираются из outbox вместе с ключами,
+            # и шард продолжит с первого такого получателя в темпе релея
+            deferred_ids = [outbox_id for message in result.deferred for outbox_id in message.outbox_ids]
+            with transaction.atomic():
+                returned = OutboxMessage.objects.filter(
+                    id__in=deferred_ids, claim_token=token, status=OutboxMessage.STATUS_PENDING
+                )
+                user_ids = list(returned.values_list('user_id', flat=True))
+                returned.delete()
+                release(delivery_key(event, user_id) for user_id in user_ids)
+                if user_ids:
+                    checkpoint = min(user_ids) - 1
+                DigestShard.objects.filter(id=shard.id).update(
+                    checkpoint_user_id=checkpoint, status=DigestShard.STATUS_PENDING
+                )
+            _reschedule_deferred(send_digest_shard, result, shard.id)
+            return f'Shard {shard.id} paused at user {checkpoint}, rescheduled'
 
-    except Exception as e:
-        logger.error(f"Error sending news notifications: {e}")
-        return f'Error: {e}'
+    _finish_shard(shard)
+    return f'Shard {shard.id} of {run} completed'
+
+
+def _iter_user_id_ranges(user_ids, chunk_size):
+    """Разбивает упорядоченный поток id пользователей на диапазоны (первый, последний, число пользователей)"""
+    chunk_start = chunk_end = None
+    size = 0
+
+    if hasattr(user_ids, 'iterator'):
+        user_ids = user_ids.iterator(chunk_size=chunk_size)
+
+    for user_id in user_ids:
+        if chunk_start is None:
+            chunk_start = user_id
+        chunk_end = user_id
+        size += 1
+
+        if size == chunk_size:
+            yield chunk_start, chunk_end, size
+            chunk_start = chunk_end = None
+            size = 0
+
+    if chunk_start is not None:
+        yield chunk_start, chunk_end, size
+
+
+def _recipients(audience, first_user_id, last_user_id):
+    """Получатели чанка по индексу аудитории: только id, email и имя, без обращения к подпискам"""
+    from django.contrib.auth import get_user_model
+
+    user_ids = audience_index.user_ids(audience, first_user_id, last_user_id)
+    return get_user_model().objects.filter(id__in=user_ids).order_by('id').values_list('id', 'email', 'first_name')
+
+
+@shared_task
+def send_news_notification(news_id):
+    """Координатор рассылки о новой новости: делит аудиторию на чанки по id пользователей"""
+    chunk_size = settings.NOTIFICATION_CHUNK_SIZE
+    user_ids = audience_index.user_ids(NEWS)
+
+    chunks = 0
+    for first_user_id, last_user_id, _size in _iter_user_id_ranges(user_ids, chunk_size):
+        send_news_notification_chunk.delay(news_id, first_user_id, last_user_id)
+        chunks += 1
+
+    return f'Dispatched news {news_id} notification in {chunks} chunks'
+
+
+@shared_task
+def send_news_notification_chunk(news_id, first_user_id, last_user_id):
+    """Отправка уведомлений о новости одному чанку подписчиков через outbox"""
+    # Ключи доставки и строки outbox коммитятся вместе: без строк ключи не останутся занятыми
+    with transaction.atomic():
+        recipients = _deduplicate(f'news_created:{news_id}', _recipients(NEWS, first_user_id, last_user_id))
+        token = enqueue_recipients('news_created', news_id, recipients)
+    result = deliver(token)
+    _reschedule_deferred(drain_bulk_outbox, result)
+
+    return f'Sent news notification to {len(result.sent)} subscribers'
 
 
 @shared_task
 def send_post_notification(post_id):
-    """Асинхронная отправка уведомлений о новом объявлении"""
-    from .models import Post, Subscription
-    from appUser.models import UserActionLog
+    """Координатор рассылки о новом объявлении: делит подписчиков категории на чанки по id"""
+    from .models import Post
 
     try:
         post = Post.objects.get(id=post_id)
-        subscribers = Subscription.objects.filter(
-            category__value=post.category
-        ).select_related('user')
-
-        for subscription in subscribers:
-            subject = _('New post in category {}: {}').format(
-                post.get_category_display(),
-                post.title
-            )
-            message = render_to_string('appNotification/emails/new_post_notification.txt', {
-                'post': post,
-                'user': subscription.user,
-                'category': post.get_category_display(),
-                'SITE_URL': settings.SITE_URL
-            })
-
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [subscription.user.email],
-                fail_silently=False,
-            )
+    except Post.DoesNotExist:
+        logger.warning(f"Post {post_id} was deleted before notification was dispatched")
+        return 'Post not found'
 
-            UserActionLog.objects.create(
-                user=subscription.user,
-                action=f"Received notification about post {post.id} in category {post.category}",
-            )
+    chunk_size = settings.NOTIFICATION_CHUNK_SIZE
+    user_ids = audience_index.user_ids(category_audience(post.category))
 
-        return f'Sent post notification to {subscribers.count()} subscribers'
+    chunks = 0
+    for first_user_id, last_user_id, _size in _iter_user_id_ranges(user_ids, chunk_size):
+        send_post_notification_chunk.delay(post_id, first_user_id, last_user_id)
+        chunks += 1
 
-    except Exception as e:
-        logger.error(f"Error sending post notifications: {e}")
-        return f'Error: {e}'
+    return f'Dispatched post {post_id} notification in {chunks} chunks'
+
+
+@shared_task
+def send_post_notification_chunk(post_id, first_user_id, last_user_id):
+    """Отправка уведомлений о новом объявлении одному чанку подписчиков через outbox"""
+    from .models import Post
+
+    try:
+        post = Post.objects.get(id=post_id)
+    except Post.DoesNotExist:
+        logger.warning(f"Post {post_id} was deleted before notification chunk was sent")
+        return 'Post not found'
+
+    # Как и у новостей: ключ без строки outbox навсегда отрезал бы получателя от письма
+    with transaction.atomic():
+        recipients = _deduplicate(f'post_created:{post_id}', _recipients(category_audience(post.category), first_user_id, last_user_id))
+        if coalescing.enabled():
+            # Письма ждут окна своих получателей и уйдут вместе с другими их событиями
+            return f'Buffered post notification for {enqueue_buffered("post_created", post_id, recipients)} subscribers'
+        token = enqueue_recipients('post_created', post_id, recipients)
+
+    result = deliver(token)
+    _reschedule_deferred(drain_bulk_outbox, result)
+
+    return f'Sent post notification to {len(result.sent)} subscribers'
+
+
+def _drain(task, keys):
+    batch_size = settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+    sent = 0
+
+    for _batch in range(settings.NOTIFICATION_OUTBOX_MAX_BATCHES):
+        token, claimed = claim_batch(batch_size, keys)
+        if not claimed:
+            break
+        result = deliver(token)
+        sent += len(result.sent)
+        if result.deferred:
+            _reschedule_deferred(task, result)
+            break
+
+    return sent
+
+
+@shared_task(bind=True, max_retries=None)
+def send_transactional_email(self, subject, body, recipient, deadline):
+    """Отправка одного транзакционного письма вне запроса: повтор временных ошибок до дедлайна"""
+    result = send_message(subject, body, recipient)
+    if result.sent:
+        return f'Sent transactional email to {recipient}'
+
+    if result.deferred:
+        countdown = math.ceil(result.retry_after)
+    else:
+        error = result.failed[0][1]
+        kind, code = classify_error(error)
+        if kind == PERMANENT:
+            logger.error(f"Transactional email to {recipient} rejected permanently: {error}")
+            return f'Rejected: {error}'
+        countdown = math.ceil(retry_delay(self.request.retries + 1).total_seconds())
+
+    if timezone.now().timestamp() + countdown > deadline:
+        logger.error(f"Transactional email to {recipient} dropped: deadline passed")
+        return 'Dropped: deadline passed'
+    raise self.retry(countdown=countdown)
+
+
+@shared_task
+def drain_outbox():
+    """Разбор транзакционных писем outbox (отклики): пачками, с отметкой о доставке"""
+    return f'Drained {_drain(drain_outbox, template_keys(bulk=False))} outbox messages'
+
+
+@shared_task
+@singleton(coalesce=True)
+def drain_bulk_outbox():
+    """Разбор массовых рассылок outbox: запуск координаторов и повтор неотправленных писем"""
+    return f'Drained {_drain(drain_bulk_outbox, template_keys(bulk=True))} bulk outbox messages'
+
+
+@shared_task
+@singleton()
+def clean_old_delivery_keys():
+    """Очистка старых ключей идемпотентности"""
+    from .models import DeliveryKey
+
+    cutoff_date = timezone.now() - settings.NOTIFICATION_IDEMPOTENCY_RETENTION
+    count, _details = DeliveryKey.objects.filter(created_at__lt=cutoff_date).delete()
+
+    logger.info(f'Cleaned {count} old delivery keys')
+    return f'Cleaned {count} old delivery keys'
+
+
+@shared_task
+@singleton()
+def clean_old_outbox_messages():
+    """
+    Очистка доставленных писем outbox вместе с их повторенными dead-letter.
+    Хранятся не меньше NOTIFICATION_PLANNING_HISTORY: по ним планирование мерит скорость рассылок.
+    Неразобранные dead-letter остаются для сотрудников.
+    """
+    from django.db.models import Q
+    from .models import DeadLetter, OutboxMessage
+
+    retention = max(settings.NOTIFICATION_OUTBOX_RETENTION, settings.NOTIFICATION_PLANNING_HISTORY)
+    cutoff_date = timezone.now() - retention
+    old_messages = OutboxMessage.objects.filter(
+        Q(status__in=[OutboxMessage.STATUS_DELIVERED, OutboxMessage.STATUS_DIGEST], sent_at__lt=cutoff_date)
+        # Без dead-letter падают только письма, чей объект уже удален: повторять их нечего
+        | (Q(status=OutboxMessage.STATUS_FAILED, created_at__lt=cutoff_date)
+           & ~Q(id__in=DeadLetter.objects.filter(replayed_at__isnull=True).values('message_id')))
+    )
+
+    # Удаляем пачками, чтобы не держать длинную блокировку и не собирать в памяти все каскадные строки
+    count = 0
+    while True:
+        ids = list(old_messages.values_list('id', flat=True)[:settings.NOTIFICATION_OUTBOX_BATCH_SIZE])
+        if not ids:
+            break
+        _total, details = OutboxMessage.objects.filter(id__in=ids).delete()
+        count += details.get(OutboxMessage._meta.label, 0)
+
+    logger.info(f'Cleaned {count} old outbox messages')
+    return f'Cleaned {count} old outbox messages'
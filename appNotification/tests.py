@@ -1,3 +1,717 @@
-from django.test import TestCase
+import re
+import smtplib
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from .idempotency import iso_week
+from .models import (Category, DeadLetter, DeliveryWatermark, DigestRun, DigestShard, News, OutboxMessage, Post,
+                     Response, Subscription)
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'appNotification-tests'}}
+UNLIMITED_RELAY = {'relay': {'per_second': 10 ** 6, 'per_hour': 10 ** 9}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, NOTIFICATION_RATE_LIMITS=UNLIMITED_RELAY,
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        from .ratelimit import rate_limiter
+
+        cache.clear()
+        rate_limiter._backend = None
+        mail.outbox = []
+
+
+class FanoutChunkTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create_user(f'subscriber{number}@example.com', 'password') for number in range(3)]
+        Subscription.objects.bulk_create(Subscription(user=user, news=True) for user in self.users)
+        self.news = News.objects.create(title='Fresh news', content='<p>text</p>', notify_subscribers=False)
+
+    def test_failed_enqueue_does_not_hold_delivery_keys(self):
+        """Сбой записи в outbox откатывает и ключи доставки: повтор чанка отправляет письма"""
+        from .tasks import send_news_notification_chunk
+
+        with mock.patch('appNotification.tasks.enqueue_recipients', side_effect=DatabaseError('Insert failed')):
+            with self.assertRaises(DatabaseError):
+                send_news_notification_chunk(self.news.id, self.users[0].id, self.users[-1].id)
+
+        send_news_notification_chunk(self.news.id, self.users[0].id, self.users[-1].id)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(user.email for user in self.users))
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW=timedelta(minutes=10), NOTIFICATION_OUTBOX_BATCH_SIZE=5)
+class CoalescingTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        category = Category.objects.create(name='Tanks', value='tanks')
+        self.users = [User.objects.create_user(f'user{number}@example.com', 'password') for number in range(12)]
+        Subscription.objects.bulk_create(Subscription(user=user, category=category) for user in self.users)
+        self.posts = [
+            Post.objects.create(author=self.users[0], category='tanks', title=f'Post {number}', content='text',
+                                notify_subscribers=False)
+            for number in range(2)
+        ]
+
+    def _buffer(self, post):
+        OutboxMessage.objects.bulk_create(
+            OutboxMessage(template_key='post_created', context_id=post.id, recipient=user.email, user=user)
+            for user in self.users
+        )
+
+    def test_events_of_one_recipient_are_combined_across_batches_and_queues(self):
+        """Аудитория больше пачки: события одного пользователя все равно уходят одним письмом"""
+        from .tasks import drain_bulk_outbox, drain_outbox
+
+        for post in self.posts:
+            self._buffer(post)
+        # Отклик автору объявления разбирается транзакционным дренером, но склеивается с объявлениями
+        Response.objects.create(post=self.posts[0], author=self.users[1], text='Response text')
+        OutboxMessage.objects.update(next_attempt_at=None)
+
+        drain_bulk_outbox()
+        drain_outbox()
+
+        self.assertEqual(len(mail.outbox), len(self.users))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(user.email for user in self.users))
+        author_message = next(message for message in mail.outbox if message.to == [self.users[0].email])
+        self.assertEqual(len(author_message.outbox_ids), 3)
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.STATUS_DELIVERED).exists())
+
+
+class DigestRunTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create_user(f'reader{number}@example.com', 'password') for number in range(3)]
+        Subscription.objects.bulk_create(Subscription(user=user, news=True) for user in self.users)
+        News.objects.create(title='Weekly news', content='<p>text</p>', notify_subscribers=False)
+
+    def test_failed_sharding_does_not_complete_the_run(self):
+        """Сбой при разбиении аудитории откатывает запуск: следующий тик создает шарды, а не закрывает неделю"""
+        from .tasks import send_weekly_newsletter
+
+        with mock.patch('appNotification.tasks._iter_user_id_ranges', side_effect=DatabaseError('db down')):
+            self.assertEqual(send_weekly_newsletter(), 'Error: db down')
+        self.assertFalse(DigestRun.objects.exists())
+
+        with mock.patch('celery.group') as group:
+            send_weekly_newsletter()
+
+        run = DigestRun.objects.get()
+        self.assertEqual((run.status, run.total), (DigestRun.STATUS_RUNNING, len(self.users)))
+        self.assertTrue(run.shards.exists())
+        group.return_value.apply_async.assert_called_once_with()
+
+
+class DigestShardTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create_user(f'reader{number}@example.com', 'password') for number in range(4)]
+        Subscription.objects.bulk_create(Subscription(user=user, news=True) for user in self.users)
+        News.objects.create(title='Weekly news', content='<p>text</p>', notify_subscribers=False)
+
+        now = timezone.now()
+        self.run = DigestRun.objects.create(kind='newsletter', period=iso_week(now),
+                                            start_date=now - timedelta(days=7), end_date=now)
+        self.shard = DigestShard.objects.create(run=self.run, first_user_id=self.users[0].id,
+                                                last_user_id=self.users[-1].id, total=len(self.users))
+
+    def test_failed_recipients_are_retried_or_dead_lettered(self):
+        """Отказ SMTP не теряет получателя: 550 уходит в dead-letter, 451 — на повтор через дренер"""
+        from . import mail as notification_mail
+        from .tasks import drain_bulk_outbox, send_digest_shard
+
+        refusals = {self.users[1].email: 550, self.users[2].email: 451}
+        send_one = notification_mail.send_one
+
+        def refusing_send_one(message, pool=notification_mail.connection_pool):
+            if message.to[0] in refusals:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (refusals[message.to[0]], b'Refused')})
+            return send_one(message, pool)
+
+        with mock.patch.object(notification_mail, 'send_one', refusing_send_one):
+            send_digest_shard(self.shard.id)
+
+        self.assertEqual(len(mail.outbox), 2)
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual((dead_letter.message.user, dead_letter.reason), (self.users[1], DeadLetter.REASON_PERMANENT))
+        retry = OutboxMessage.objects.get(user=self.users[2])
+        self.assertEqual(retry.status, OutboxMessage.STATUS_PENDING)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, DigestRun.STATUS_COMPLETED)
+
+        OutboxMessage.objects.filter(id=retry.id).update(next_attempt_at=None)
+        drain_bulk_outbox()
+
+        self.assertEqual(mail.outbox[-1].to, [self.users[2].email])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            set(DeliveryWatermark.objects.filter(channel='newsletter').values_list('user_id', flat=True)),
+            {self.users[0].id, self.users[2].id, self.users[3].id},
+        )
+
+    def test_chunk_of_crashed_worker_is_sent_by_drainer(self):
+        """Пачка, записанная в outbox до падения воркера, уходит с дренером, а повторный запуск шарда её не дублирует"""
+        from .tasks import drain_bulk_outbox, send_digest_shard
+
+        with mock.patch('appNotification.tasks.dispatch', side_effect=RuntimeError('Worker lost')):
+            with self.assertRaises(RuntimeError):
+                send_digest_shard(self.shard.id)
+        self.assertEqual(len(mail.outbox), 0)
+
+        stale = timezone.now() - settings.NOTIFICATION_OUTBOX_CLAIM_TIMEOUT - timedelta(minutes=1)
+        OutboxMessage.objects.update(claimed_at=stale)
+        drain_bulk_outbox()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(user.email for user in self.users))
+
+        DigestShard.objects.filter(id=self.shard.id).update(updated_at=timezone.now() - timedelta(days=1))
+        send_digest_shard(self.shard.id)
+        self.assertEqual(len(mail.outbox), len(self.users))
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, DigestRun.STATUS_COMPLETED)
+
+
+class AudienceIndexTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('reader@example.com', 'password')
+        self.tanks = Category.objects.create(name='Tanks', value='tanks')
+        self.healers = Category.objects.create(name='Healers', value='healers')
+
+    def test_edited_subscription_updates_only_changed_audiences(self):
+        """Смена категории переносит пользователя между аудиториями без пересборки индекса"""
+        from .audience import NEWS, audience_index
+
+        subscription = Subscription.objects.create(user=self.user, category=self.tanks, news=True)
+        subscription = Subscription.objects.get(id=subscription.id)
+        with mock.patch.object(audience_index, 'add') as add, mock.patch.object(audience_index, 'remove') as remove, \
+                mock.patch.object(audience_index, 'invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                subscription.category = self.healers
+                subscription.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                subscription.news = False
+                subscription.save(update_fields=['news'])
+
+        add.assert_called_once_with(self.user.id, ['category:healers'])
+        self.assertEqual(remove.call_args_list, [mock.call(self.user.id, ['category:tanks']),
+                                                 mock.call(self.user.id, [NEWS])])
+        invalidate.assert_not_called()
+
+    def test_deleted_subscription_keeps_audiences_granted_by_other_rows(self):
+        """Удаление одной из подписок не исключает из новостей, пока их дает другая подписка"""
+        from .audience import NEWS, audience_index
+
+        tanks = Subscription.objects.create(user=self.user, category=self.tanks, news=True)
+        Subscription.objects.create(user=self.user, category=self.healers, news=True)
+        with mock.patch.object(audience_index, 'remove') as remove:
+            with self.captureOnCommitCallbacks(execute=True):
+                tanks.delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.healers.delete()
+
+        self.assertEqual(remove.call_args_list, [mock.call(self.user.id, ['category:tanks']),
+                                                 mock.call(self.user.id, ['category:healers', NEWS])])
+
+    def test_rebuild_is_not_published_over_a_concurrent_subscription(self):
+        """Подписка, закоммиченная во время пересборки, не теряется: устаревший снимок не публикуется"""
+        from redis.exceptions import WatchError
+
+        from . import audience
+        from .audience import NEWS, RedisBackend
+
+        client = mock.MagicMock()
+        client.get.return_value = None
+        client.exists.return_value = False
+        pipe = client.pipeline.return_value.__enter__.return_value
+        backend = RedisBackend(client)
+        other = get_user_model().objects.create_user('other@example.com', 'password')
+        Subscription.objects.create(user=self.user, news=True)
+
+        def execute():
+            # Как в Redis: EXEC отменяется, если после WATCH версию аудитории изменили
+            if client.incr.called:
+                raise WatchError('audience_version:news')
+            return []
+
+        pipe.watch.side_effect = lambda *keys: client.incr.reset_mock()
+        pipe.execute.side_effect = execute
+        query_user_ids = audience._query_user_ids
+
+        def query_during_subscription(name):
+            user_ids = list(query_user_ids(name))
+            if not Subscription.objects.filter(user=other).exists():
+                Subscription.objects.create(user=other, news=True)
+                backend.add(name, other.id)
+            return user_ids
+
+        with mock.patch.object(audience, '_query_user_ids', query_during_subscription):
+            backend._ensure(NEWS)
+
+        self.assertEqual(pipe.execute.call_count, 2)
+        self.assertEqual(pipe.zadd.call_args, mock.call('audience:news:rebuild', {self.user.id: self.user.id,
+                                                                                  other.id: other.id}))
+
+
+class SegmentMatrixTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.users = [User.objects.create_user(f'reader{number}@example.com', 'password') for number in range(3)]
+        self.tanks = Category.objects.create(name='Tanks', value='tanks')
+        self.healers = Category.objects.create(name='Healers', value='healers')
+        self.subscriptions = [Subscription.objects.create(user=user, category=self.tanks) for user in self.users]
+
+    def _refreshed(self, matrix):
+        matrix.refresh()
+        return (matrix.user_ids(any_of=['category:tanks']), matrix.user_ids(any_of=['category:healers']),
+                matrix.user_ids(any_of=['news']))
+
+    def test_edited_subscription_is_visible_after_refresh(self):
+        """Правка подписки видна при следующей проверке, а не через NOTIFICATION_SEGMENT_MAX_AGE"""
+        from .segments import SubscriptionMatrix
+
+        matrix = SubscriptionMatrix()
+        matrix.build()
+        subscription = Subscription.objects.get(id=self.subscriptions[0].id)
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.category = self.healers
+            subscription.news = True
+            subscription.save()
+
+        self.assertEqual(self._refreshed(matrix), ([self.users[1].id, self.users[2].id], [self.users[0].id],
+                                                   [self.users[0].id]))
+
+    def test_deleted_subscription_is_visible_after_refresh(self):
+        """Удаление подписки, даже замененной новой строкой, видно при следующей проверке"""
+        from .segments import SubscriptionMatrix
+
+        matrix = SubscriptionMatrix()
+        matrix.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscriptions[1].delete()
+            Subscription.objects.create(user=self.users[1], category=self.healers)
+
+        self.assertEqual(self._refreshed(matrix), ([self.users[0].id, self.users[2].id], [self.users[1].id], []))
+
+    def test_category_changelist_reads_the_matrix_once(self):
+        """Список категорий берет матрицу один раз на запрос, а не дважды на каждую строку"""
+        from .segments import segment_index
+
+        admin = get_user_model().objects.create_superuser('admin@example.com', 'password')
+        # create_user всегда создает неактивного пользователя до подтверждения почты
+        admin.is_active = True
+        admin.save(update_fields=['is_active'])
+        self.client.force_login(admin)
+        with mock.patch.object(segment_index, 'get', wraps=segment_index.get) as get:
+            response = self.client.get(reverse('admin:appNotification_category_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+        get.assert_called_once_with()
+
+
+class ResponseEventTests(NotificationTestCase):
+    def setUp(self):
+        from .events import response_accepted, response_created
+
+        super().setUp()
+        User = get_user_model()
+        self.author = User.objects.create_user('author@example.com', 'password')
+        self.responder = User.objects.create_user('responder@example.com', 'password')
+        self.post = Post.objects.create(author=self.author, category='tanks', title='Selling a sword',
+                                        content='text', notify_subscribers=False)
+        self.events = []
+        for signal in (response_created, response_accepted):
+            signal.connect(self._record, dispatch_uid=f'test-{id(signal)}')
+            self.addCleanup(signal.disconnect, dispatch_uid=f'test-{id(signal)}')
+
+    def _record(self, signal, response, **kwargs):
+        from .events import response_accepted
+
+        self.events.append(('accepted' if signal is response_accepted else 'created', response.id))
+
+    def _accepted_rows(self, response):
+        return OutboxMessage.objects.filter(template_key='response_accepted', context_id=response.id).count()
+
+    def test_accept_is_emitted_once_per_transition(self):
+        """Повторные сохранения принятого отклика не порождают новых событий"""
+        response = Response.objects.create(post=self.post, author=self.responder, text='Response text')
+        response.save()
+        self.assertEqual(self.events, [('created', response.id)])
+
+        response.is_accepted = True
+        response.save()
+        response.save()
+        Response.objects.get(id=response.id).save()
+
+        self.assertEqual(self.events, [('created', response.id), ('accepted', response.id)])
+        self.assertEqual(self._accepted_rows(response), 1)
+
+    def test_accept_reject_accept_sends_one_notification(self):
+        """Повторное принятие после отклонения — новый переход, но письмо автору отклика уходит один раз"""
+        response = Response.objects.create(post=self.post, author=self.responder, text='Response text')
+        response.is_accepted = True
+        response.save()
+
+        response = Response.objects.get(id=response.id)
+        response.is_accepted = False
+        response.delete_response()
+        response.is_accepted = True
+        response.is_rejected = False
+        response.save()
+
+        self.assertEqual(self.events.count(('accepted', response.id)), 2)
+        self.assertEqual(self._accepted_rows(response), 1)
+
+    def test_duplicate_accept_from_stale_instances_sends_one_notification(self):
+        """Два одновременных принятия по устаревшим копиям: письмо одно"""
+        response = Response.objects.create(post=self.post, author=self.responder, text='Response text')
+        first, second = Response.objects.get(id=response.id), Response.objects.get(id=response.id)
+        for copy in (first, second):
+            copy.is_accepted = True
+            copy.save()
+
+        self.assertEqual(self._accepted_rows(response), 1)
+
+    def test_save_without_tracked_field_is_not_a_transition(self):
+        """update_fields без is_accepted не считается принятием, а следующее полное сохранение — считается"""
+        response = Response.objects.create(post=self.post, author=self.responder, text='Response text')
+        response.is_accepted = True
+        response.save(update_fields=['text'])
+        self.assertEqual(self.events, [('created', response.id)])
+        self.assertEqual(self._accepted_rows(response), 0)
+
+        response.save()
+        self.assertEqual(self.events, [('created', response.id), ('accepted', response.id)])
+
+
+@override_settings(EMAIL_HOST='smtp.example.com', NOTIFICATION_RATE_LIMITS={
+    'relay': {'per_second': 4, 'per_hour': 100}, 'domains': {'gmail.com': {'per_second': 2, 'per_hour': 100}},
+})
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        from .ratelimit import RateLimiter
+
+        self.limiter = RateLimiter()
+        patcher = mock.patch('appNotification.ratelimit.time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.monotonic.return_value = 1000.0
+
+    def test_burst_is_limited_by_capacity(self):
+        """Корзина отдает capacity токенов сразу, затем называет время до следующего"""
+        self.assertEqual([self.limiter.acquire('example.com') for _ in range(4)], [0, 0, 0, 0])
+        self.assertAlmostEqual(self.limiter.acquire('example.com'), 0.25)
+
+    def test_tokens_refill_with_time_up_to_capacity(self):
+        """Токены возвращаются со скоростью capacity / period, но не больше capacity"""
+        for _ in range(4):
+            self.limiter.acquire('example.com')
+
+        self.clock.monotonic.return_value += 0.5
+        self.assertEqual(self.limiter.acquire('example.com'), 0)
+        self.assertEqual(self.limiter.acquire('example.com'), 0)
+        self.assertGreater(self.limiter.acquire('example.com'), 0)
+
+        self.clock.monotonic.return_value += 60
+        self.assertEqual(self.limiter.budget()['smtp_rate:relay:smtp.example.com:second'], 4)
+
+    def test_domain_budget_applies_on_top_of_relay(self):
+        """Отказ по домену не списывает токены релея: корзины берутся атомарно"""
+        self.assertEqual([self.limiter.acquire('gmail.com') for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(self.limiter.acquire('gmail.com'), 0.5)
+
+        budget = self.limiter.budget()
+        self.assertEqual(budget['smtp_rate:relay:smtp.example.com:second'], 2)
+        self.assertEqual(budget['smtp_rate:domain:gmail.com:second'], 0)
+        self.assertEqual([self.limiter.acquire('example.com') for _ in range(2)], [0, 0])
+
+    def test_backend_failure_falls_back_to_in_process_buckets(self):
+        """Сбой Redis не снимает ограничение: те же лимиты считаются в памяти процесса"""
+        backend = mock.Mock()
+        backend.take.side_effect = ConnectionError('Redis is down')
+        self.limiter._backend = backend
+
+        self.assertEqual([self.limiter.acquire('example.com') for _ in range(4)], [0, 0, 0, 0])
+        self.assertGreater(self.limiter.acquire('example.com'), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LeaseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _crash(self, lease):
+        # Воркер упал: heartbeat остановился, а release так и не вызван
+        lease._stop.set()
+        lease._heartbeat.join()
+
+    def test_lease_is_exclusive_until_released(self):
+        """Пока аренду держит один запуск, второй её не получает"""
+        from .locks import Lease
+
+        first, second = Lease('digest', 60), Lease('digest', 60)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_heartbeat_keeps_a_long_run_past_its_ttl(self):
+        """Пока задача жива, аренда продлевается и не истекает по ttl"""
+        from .locks import Lease
+
+        lease = Lease('digest', 0.3)
+        self.assertTrue(lease.acquire())
+        time.sleep(0.6)
+
+        self.assertEqual(cache.get(lease.key), lease.token)
+        self.assertFalse(Lease('digest', 0.3).acquire())
+        lease.release()
+
+    def test_lease_of_crashed_worker_expires(self):
+        """Без heartbeat аренда истекает сама, и её берет следующий запуск"""
+        from .locks import Lease
+
+        lease = Lease('digest', 0.3)
+        self.assertTrue(lease.acquire())
+        self._crash(lease)
+        time.sleep(0.4)
+
+        successor = Lease('digest', 60)
+        self.assertTrue(successor.acquire())
+        lease.release()
+        self.assertEqual(cache.get(successor.key), successor.token)
+        successor.release()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django_redis.cache.RedisCache',
+                                           'LOCATION': 'redis://127.0.0.1:6379/15'}})
+    def test_release_compares_and_deletes_in_one_redis_command(self):
+        """Освобождение на Redis — один скрипт: чужую аренду, взятую после истечения нашей, он не удаляет"""
+        from redis import Redis
+
+        from .locks import RELEASE_SCRIPT, Lease
+
+        lease = Lease('digest', 60)
+        with mock.patch.object(Redis, 'eval', return_value=0) as evaluate, \
+                mock.patch.object(Redis, 'get') as get, mock.patch.object(Redis, 'delete') as delete:
+            lease.release()
+
+        evaluate.assert_called_once_with(RELEASE_SCRIPT, 1, cache.client.make_key(lease.key),
+                                         cache.client.encode(lease.token))
+        get.assert_not_called()
+        delete.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE, NOTIFICATION_CIRCUIT_BREAKER={
+    'window': 60, 'min_calls': 4, 'failure_rate': 0.5, 'slow_call': 5, 'open_seconds': 30, 'probe_timeout': 60,
+})
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        from .breaker import CircuitBreaker
+
+        cache.clear()
+        self.breaker = CircuitBreaker('test')
+        patcher = mock.patch('appNotification.breaker.time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1200.0
+
+    def _open(self):
+        for ok in (True, True, False, False):
+            self.breaker.record(ok, 0.1)
+
+    def test_failure_rate_opens_the_circuit(self):
+        """Размыкается только после min_calls отправок, когда доля ошибок достигла порога"""
+        from .breaker import OPEN
+
+        self.breaker.record(False, 0.1)
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.allow(), 0)
+
+        self.breaker.record(True, 0.1)
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.snapshot()['state'], OPEN)
+        self.assertEqual(self.breaker.allow(), 30)
+
+    def test_slow_calls_count_as_failures(self):
+        """Отправка дольше slow_call считается ошибкой, даже если сервер её принял"""
+        from .breaker import OPEN
+
+        for _ in range(4):
+            self.breaker.record(True, 6)
+
+        self.assertEqual(self.breaker.snapshot()['state'], OPEN)
+
+    def test_successful_probe_closes_the_circuit(self):
+        """После паузы проходит одна проба; её успех замыкает предохранитель и обнуляет окно"""
+        from .breaker import CLOSED, HALF_OPEN
+
+        self._open()
+        self.clock.time.return_value += 30
+        self.assertEqual(self.breaker.allow(), 0)
+        self.assertEqual(self.breaker.snapshot()['state'], HALF_OPEN)
+        self.assertEqual(self.breaker.allow(), 60)
+
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.snapshot()['state'], CLOSED)
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.allow(), 0)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        """Ошибка пробы снова размыкает предохранитель на open_seconds"""
+        from .breaker import OPEN
+
+        self._open()
+        self.clock.time.return_value += 30
+        self.breaker.allow()
+        self.breaker.record(False, 0.1)
+
+        self.assertEqual(self.breaker.snapshot()['state'], OPEN)
+        self.assertEqual(self.breaker.allow(), 30)
+
+    def test_lost_probe_is_replaced_after_probe_timeout(self):
+        """Проба ушла вместе с воркером: через probe_timeout пробует следующий процесс"""
+        from .breaker import HALF_OPEN
+
+        self._open()
+        self.clock.time.return_value += 30
+        self.assertEqual(self.breaker.allow(), 0)
+
+        self.clock.time.return_value += 60
+        self.assertEqual(self.breaker.allow(), 0)
+        self.assertEqual(self.breaker.snapshot()['state'], HALF_OPEN)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, NOTIFICATION_DIGEST_CATCH_UP=timedelta(hours=12))
+class DigestScheduleTests(TestCase):
+    # Понедельник, 19 октября 2026, 06:00 UTC: в Москве 09:00, в Нью-Йорке (EDT) 02:00
+    NOW = datetime(2026, 10, 19, 6, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        cache.clear()
+
+    def _bucket(self, offset_hours, now):
+        from .schedule import Bucket
+
+        return Bucket(offset_hours * 60, ['Test/Zone'], now)
+
+    def test_bucket_is_due_from_local_hour_until_catch_up_ends(self):
+        """Корзина становится должной в местный час и остается ей NOTIFICATION_DIGEST_CATCH_UP"""
+        moscow = 3
+        self.assertFalse(self._bucket(moscow, self.NOW - timedelta(minutes=1)).due(0, 9))
+        self.assertTrue(self._bucket(moscow, self.NOW).due(0, 9))
+        self.assertTrue(self._bucket(moscow, self.NOW + timedelta(hours=11, minutes=59)).due(0, 9))
+        self.assertFalse(self._bucket(moscow, self.NOW + timedelta(hours=12)).due(0, 9))
+
+    def test_target_is_in_the_local_week(self):
+        """Час воскресенья этой местной недели еще впереди: понедельник его не догоняет"""
+        self.assertFalse(self._bucket(3, self.NOW).due(6, 23))
+        self.assertTrue(self._bucket(3, self.NOW + timedelta(days=6, hours=14)).due(6, 23))
+
+    def test_due_buckets_follow_each_users_local_time(self):
+        """Корзины строятся по смещению на текущий момент, с учетом летнего времени и неизвестных поясов"""
+        from .schedule import due_buckets
+
+        User = get_user_model()
+        for number, name in enumerate(['Europe/Moscow', 'Europe/Istanbul', 'America/New_York', 'Mars/Olympus']):
+            User.objects.create_user(f'reader{number}@example.com', 'password', timezone=name)
+
+        schedule = {'newsletter': {'weekday': 0, 'hour': 9}}
+        with override_settings(NOTIFICATION_DIGEST_SCHEDULE=schedule):
+            due = due_buckets('newsletter', self.NOW)
+            self.assertEqual([(bucket.name, sorted(bucket.timezones)) for bucket in due],
+                             [('UTC+03:00', ['Europe/Istanbul', 'Europe/Moscow'])])
+            # Неизвестный пояс рассылается по UTC
+            self.assertEqual([bucket.name for bucket in due_buckets('newsletter', self.NOW + timedelta(hours=3))],
+                             ['UTC+03:00', 'UTC+00:00'])
+            self.assertEqual([bucket.name for bucket in due_buckets('newsletter', self.NOW + timedelta(hours=13))],
+                             ['UTC+00:00', 'UTC-04:00'])
+
+        self.assertEqual(due[0].period, '2026-W43')
+
+
+class OutboxCleanupTests(NotificationTestCase):
+    def test_only_settled_rows_older_than_retention_are_deleted(self):
+        """Доставленные и повторенные письма удаляются, неразобранные dead-letter и свежая история остаются"""
+        from .tasks import clean_old_outbox_messages
+
+        def message(status, age, **kwargs):
+            row = OutboxMessage.objects.create(template_key='news_created', context_id=1,
+                                               recipient='reader@example.com', status=status, **kwargs)
+            moment = timezone.now() - age
+            OutboxMessage.objects.filter(id=row.id).update(created_at=moment, sent_at=moment)
+            return row
+
+        old = settings.NOTIFICATION_OUTBOX_RETENTION + timedelta(days=1)
+        replayed = message(OutboxMessage.STATUS_DELIVERED, old)
+        DeadLetter.objects.create(message=replayed, reason=DeadLetter.REASON_PERMANENT, replayed_at=timezone.now())
+        message(OutboxMessage.STATUS_FAILED, old, last_error='Context object no longer exists')
+        dead = message(OutboxMessage.STATUS_FAILED, old)
+        DeadLetter.objects.create(message=dead, reason=DeadLetter.REASON_PERMANENT)
+        pending = message(OutboxMessage.STATUS_PENDING, old)
+        history = message(OutboxMessage.STATUS_DELIVERED, settings.NOTIFICATION_PLANNING_HISTORY - timedelta(days=1))
+
+        self.assertEqual(clean_old_outbox_messages(), 'Cleaned 2 old outbox messages')
+
+        self.assertEqual(set(OutboxMessage.objects.values_list('id', flat=True)), {dead.id, pending.id, history.id})
+        self.assertEqual(list(DeadLetter.objects.values_list('message_id', flat=True)), [dead.id])
+
+
+class EmailTemplateTests(NotificationTestCase):
+    def _render_all(self, language):
+        """(имя шаблона, отрисованная часть письма) для всех текстовых и HTML-шаблонов на языке language"""
+        from .rendering import PLACEHOLDER_USER, render_email
+
+        User = get_user_model()
+        author = User.objects.create_user('author@example.com', 'password', first_name='Ann')
+        post = Post.objects.create(author=author, category='tanks', title='Selling a sword', content='text',
+                                   notify_subscribers=False)
+        news = News.objects.create(title='Weekly news', content='<p>text</p>', notify_subscribers=False)
+        response = Response(post=post, author=author, text='Response text')
+        context = {
+            'SITE_URL': 'https://example.com', 'user': PLACEHOLDER_USER, 'name': 'Ann',
+            'items': [{'subject': 'Subject', 'url': '/'}], 'post': post, 'posts': [post], 'response': response,
+            'category': 'Tanks', 'category_name': 'Tanks', 'sections': '', 'start_date': timezone.now(),
+            'end_date': timezone.now(),
+        }
+
+        templates = Path(__file__).parent / 'templates' / 'appNotification' / 'emails'
+        with translation.override(language):
+            for template in sorted(templates.glob('*.txt')):
+                name = f'appNotification/emails/{template.name}'
+                news_context = {'news': news if template.stem == 'new_news_notification' else [news]}
+                for rendered in render_email(name, {**context, **news_context}):
+                    yield name, rendered
+
+    def test_template_text_is_marked_for_translation(self):
+        """Текст писем идет через каталог переводов: на английском в них не остается кириллицы"""
+        for name, rendered in self._render_all('en'):
+            self.assertIsNone(re.search('[А-Яа-яЁё]', rendered), name)
+
+    def test_compiled_catalog_translates_templates(self):
+        """Скомпилированный каталог ru лежит в репозитории: письма на русском не откатываются к английскому"""
+        for name, rendered in self._render_all('ru'):
+            self.assertIsNotNone(re.search('[А-Яа-яЁё]', rendered), name)
+        with translation.override('ru'):
+            self.assertEqual(translation.pgettext('go to', 'personal account'), 'личный кабинет')
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+def send_transactional(subject, body, recipient):
+    """
+    Ставит письмо одному получателю (верификация, сброс пароля, приветствие) в очередь
+    transactional после коммита текущей транзакции. Запрос не ждет SMTP; письмо,
+    не отправленное до NOTIFICATION_TRANSACTIONAL_DEADLINE, считается устаревшим.
+    """
+    from .tasks import send_transactional_email
+
+    deadline = timezone.now() + settings.NOTIFICATION_TRANSACTIONAL_DEADLINE
+    # Тема и текст переводятся сейчас, на языке текущего запроса
+    args = (str(subject), str(body), recipient, deadline.timestamp())
+    transaction.on_commit(lambda: send_transactional_email.apply_async(args, expires=deadline))
@@ -9,9 +9,11 @@ from django.core.paginator import Paginator
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
 from datetime import timedelta
 
+from .audience import NEWS, audience_index, category_audience
 from .models import Post, Response, News, Category, Subscription
 from .forms import PostForm, ResponseForm, NewsForm
 from appUser.models import UserActionLog, CustomUser
@@ -89,7 +91,9 @@ class PostCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.author = self.request.user
-        response = super().form_valid(form)
+        # Объявление и запись рассылки в outbox сохраняются атомарно
+        with transaction.atomic():
+            response = super().form_valid(form)
 
         UserActionLog.objects.create(
             user=self.request.user,
@@ -99,14 +103,11 @@ class PostCreateView(LoginRequiredMixin, CreateView):
 
         messages.success(self.request, _('Post created successfully!'))
 
-        # Логируем отправку уведомлений
+        # Рассылка уходит в Celery после коммита, здесь только сообщаем о ней; размер аудитории берется из индекса
         if form.cleaned_data.get('notify_subscribers', True):
-            from .models import Subscription
-            subscribers_count = Subscription.objects.filter(
-                category__value=self.object.category
-            ).count()
+            count = audience_index.size(category_audience(self.object.category))
             messages.info(self.request,
-                          _(f'Notifications sent to {subscribers_count} subscribers of category "{self.object.get_category_display()}"'))
+                          _(f'Notifications to {count} subscribers of category "{self.object.get_category_display()}" have been queued'))
 
         return response
 
@@ -180,7 +181,8 @@ class ResponseCreateView(LoginRequiredMixin, CreateView):
         post = get_object_or_404(Post, pk=self.kwargs['post_id'])
         form.instance.post = post
         form.instance.author = self.request.user
-        response = super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
 
         UserActionLog.objects.create(
             user=self.request.user,
@@ -242,7 +244,8 @@ def accept_response(request, pk):
     if request.user == response.post.author:
         response.is_accepted = True
         response.is_rejected = False  # Сбрасываем флаг отклонения
-        response.save()
+        with transaction.atomic():
+            response.save()
 
         UserActionLog.objects.create(
             user=request.user,
@@ -359,20 +362,14 @@ def render_personal_cabinet(request):
         responses_to_posts = responses_to_posts.filter(is_accepted=False)
 
     subscriptions = Subscription.objects.filter(user=request.user).select_related('category')
-    news_subscribed = Subscription.objects.filter(user=request.user, news=True).exists()
+    news_subscribed = audience_index.contains(NEWS, request.user.id)
 
-    all_categories = Category.objects.all()
-    categories_with_status = []
-    for category in all_categories:
-        is_subscribed = Subscription.objects.filter(
-            user=request.user,
-            category=category
-        ).exists()
-
-        categories_with_status.append({
-            'category': category,
-            'is_subscribed': is_subscribed
-        })
+    # Подписки пользователя уже загружены: статус категорий без запроса на каждую
+    subscribed_category_ids = {subscription.category_id for subscription in subscriptions}
+    categories_with_status = [
+        {'category': item, 'is_subscribed': item.id in subscribed_category_ids}
+        for item in Category.objects.all()
+    ]
 
     context = {
         'user_posts': user_posts,
@@ -526,7 +523,8 @@ class NewsCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         return self.request.user.is_staff
 
     def form_valid(self, form):
-        response = super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
         UserActionLog.objects.create(
             user=self.request.user,
             action=f"Created news {self.object.id}",
@@ -535,12 +533,9 @@ class NewsCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
 
         messages.success(self.request, _('News created successfully!'))
 
-        # Логируем отправку уведомлений
+        # Рассылка уходит в Celery после коммита, здесь только сообщаем о ней
         if form.cleaned_data.get('notify_subscribers', True):
-            from appNotification.models import Subscription
-            subscribers_count = Subscription.objects.filter(news=True).count()
-            messages.info(self.request,
-                          _(f'Notifications sent to {subscribers_count} subscribers'))
+            messages.info(self.request, _('Notifications to news subscribers have been queued'))
 
         return response
 
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+
+def load(channel, user_ids):
+    """Отметки пользователей канала: {user_id: (created_at, id)}"""
+    from .models import DeliveryWatermark
+
+    rows = DeliveryWatermark.objects.filter(channel=channel, user_id__in=user_ids).values_list(
+        'user_id', 'last_created_at', 'last_id'
+    )
+    return {user_id: (created_at, last_id) for user_id, created_at, last_id in rows}
+
+
+def floor(channel, first_user_id, last_user_id, default, end_date):
+    """
+    Нижняя граница выборки материалов для диапазона пользователей: самая старая отметка,
+    но не раньше NOTIFICATION_WATERMARK_MAX_LOOKBACK, чтобы давно неактивным не уходил архив
+    """
+    from .models import DeliveryWatermark
+
+    oldest = DeliveryWatermark.objects.filter(
+        channel=channel, user_id__gte=first_user_id, user_id__lte=last_user_id
+    ).aggregate(oldest=Min('last_created_at'))['oldest']
+
+    since = min(default, oldest) if oldest else default
+    return max(since, end_date - settings.NOTIFICATION_WATERMARK_MAX_LOOKBACK)
+
+
+def advance(channel, user_ids, mark):
+    """
+    Сдвигает отметки доставленных пользователей до mark. Отметка только растет:
+    запоздавший или повторный запуск со старой отметкой её не откатит.
+    """
+    from .models import DeliveryWatermark
+
+    user_ids = list(user_ids)
+    if not user_ids or mark is None:
+        return
+
+    created_at, last_id = mark
+    with transaction.atomic():
+        DeliveryWatermark.objects.bulk_create(
+            [DeliveryWatermark(user_id=user_id, channel=channel, last_created_at=created_at, last_id=last_id)
+             for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        DeliveryWatermark.objects.filter(channel=channel, user_id__in=user_ids).filter(
+            Q(last_created_at__lt=created_at) | Q(last_created_at=created_at, last_id__lt=last_id)
+        ).update(last_created_at=created_at, last_id=last_id, updated_at=timezone.now())
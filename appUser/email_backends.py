@@ -1,10 +1,22 @@
+import glob
+import json
+import mmap
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
 from django.core.mail.backends.console import EmailBackend as ConsoleEmailBackend
 from django.utils.translation import gettext_lazy as _
 
 
 class DebugEmailBackend(ConsoleEmailBackend):
+    """Краткая сводка по каждому письму вместо полного MIME консольного бэкенда"""
+
     def send_messages(self, email_messages):
-        results = super().send_messages(email_messages)
+        if not email_messages:
+            return 0
 
         for message in email_messages:
             print("=" * 50)
@@ -15,4 +27,148 @@ class DebugEmailBackend(ConsoleEmailBackend):
             print(message.body)
             print("=" * 50)
 
-        return results
+        return len(email_messages)
+
+
+class CaptureFile:
+    """
+    Заранее выделенный файл, отображенный в память: письма дописываются строками JSON
+    без системного вызова на каждое. Конец данных — первый нулевой байт, поэтому
+    файл читается и после аварийного завершения процесса. У каждого процесса свой файл.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.offset = 0
+        self.messages = 0
+        self.recipients = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'w+b')
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def _grow(self, needed):
+        # Файл закончился: удваиваем его, данные остаются на месте
+        self._map.flush()
+        self._map.close()
+        while self.size < needed:
+            self.size *= 2
+        self._file.truncate(self.size)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def append(self, records):
+        data = b''.join(json.dumps(record, ensure_ascii=False).encode() + b'\n' for record in records)
+        with self._lock:
+            end = self.offset + len(data)
+            if end > self.size:
+                self._grow(end)
+            self._map[self.offset:end] = data
+            self.offset = end
+            self.messages += len(records)
+            self.recipients += sum(len(record['to']) for record in records)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'path': self.path,
+            'messages': self.messages,
+            'recipients': self.recipients,
+            'bytes': self.offset,
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(self.messages / elapsed, 1) if elapsed else None,
+            'recipients_per_second': round(self.recipients / elapsed, 1) if elapsed else None,
+            'bytes_per_second': round(self.offset / elapsed, 1) if elapsed else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+
+# Открытые файлы захвата процесса по базовому пути; после fork дочерний процесс открывает свои
+_capture_files = {}
+_capture_files_lock = threading.Lock()
+
+
+def _capture_path(base_path, pid):
+    return f'{base_path}.{pid}.jsonl'
+
+
+def capture_file(base_path=None):
+    base_path = str(base_path or settings.EMAIL_CAPTURE_PATH)
+    pid = os.getpid()
+    with _capture_files_lock:
+        capture = _capture_files.get(base_path)
+        if capture is None or capture.path != _capture_path(base_path, pid):
+            capture = CaptureFile(_capture_path(base_path, pid), settings.EMAIL_CAPTURE_SIZE)
+            _capture_files[base_path] = capture
+        return capture
+
+
+class CaptureEmailBackend(BaseEmailBackend):
+    """
+    Бэкенд для нагрузочных тестов: письма записываются в файл захвата вместо отправки
+    и вывода в консоль. Счетчики доступны через capture_file().stats(), письма — через read_captured().
+    """
+
+    def __init__(self, fail_silently=False, capture_path=None, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.capture_path = capture_path
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+
+        capture_bodies = settings.EMAIL_CAPTURE_BODIES
+        now = time.time()
+        records = []
+        for message in email_messages:
+            record = {
+                'time': now,
+                'from': message.from_email,
+                'to': message.recipients(),
+                'subject': str(message.subject),
+            }
+            if capture_bodies:
+                record['body'] = message.body
+                record['alternatives'] = [content for content, _mimetype in getattr(message, 'alternatives', [])]
+            records.append(record)
+
+        capture_file(self.capture_path).append(records)
+        return len(records)
+
+
+def read_captured(base_path=None):
+    """Письма из файлов захвата всех процессов в порядке записи внутри каждого файла"""
+    base_path = str(base_path or settings.EMAIL_CAPTURE_PATH)
+    capture = _capture_files.get(base_path)
+    if capture is not None and capture.path == _capture_path(base_path, os.getpid()):
+        capture._map.flush()
+
+    for path in sorted(glob.glob(_capture_path(glob.escape(base_path), '*'))):
+        with open(path, 'rb') as capture_data:
+            if not os.fstat(capture_data.fileno()).st_size:
+                continue
+            # Читаем только записанное: хвост из нулей в десятки мегабайт не разбирается как строка
+            with mmap.mmap(capture_data.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = data.find(b'\0')
+                written = data[:end if end != -1 else len(data)]
+        for line in written.splitlines():
+            yield json.loads(line)
+
+
+def clear_captured(base_path=None):
+    """Закрывает файл захвата процесса и удаляет файлы всех процессов"""
+    base_path = str(base_path or settings.EMAIL_CAPTURE_PATH)
+    with _capture_files_lock:
+        capture = _capture_files.pop(base_path, None)
+        if capture is not None:
+            capture.close()
+    for path in glob.glob(_capture_path(glob.escape(base_path), '*')):
+        os.remove(path)
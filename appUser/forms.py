@@ -1,5 +1,6 @@
 from django import forms
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
+from django.template import loader
 from django.utils.translation import gettext_lazy as _
 from .models import CustomUser
 from django.core.validators import validate_email
@@ -133,3 +134,15 @@ class ProfileForm(forms.ModelForm):
             if not avatar.name.lower().endswith(('.jpg', '.jpeg', '.png')):
                 raise ValidationError(_("Only JPG/JPEG/PNG files are allowed."))
         return avatar
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо сброса пароля рендерится в запросе, а отправляется из очереди transactional"""
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        from appNotification.transactional import send_transactional
+
+        subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        send_transactional(subject, body, to_email)
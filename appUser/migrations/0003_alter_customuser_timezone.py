@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appUser', '0002_customuser_email_verified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='timezone',
+            field=models.CharField(db_index=True, default='UTC', max_length=50),
+        ),
+    ]
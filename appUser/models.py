@@ -1,7 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
-from django.core.mail import send_mail
 from django.conf import settings
 import secrets
 from django.utils import timezone
@@ -34,7 +33,7 @@ class CustomUserManager(BaseUserManager):
 class CustomUser(AbstractUser):
     email = models.EmailField(_('email address'), unique=True)
     username = models.CharField(max_length=150, blank=True, null=True)
-    timezone = models.CharField(max_length=50, default='UTC')
+    timezone = models.CharField(max_length=50, default='UTC', db_index=True)
     language = models.CharField(max_length=10, choices=[('ru', 'Russian'), ('en', 'English')], default='ru')
     email_verified = models.BooleanField(default=False)  # Новое поле для подтверждения email
 
@@ -94,13 +93,9 @@ class EmailVerification(models.Model):
         print(f"Expires: {expiration_time_str}")
         print("=======================\n")
 
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [self.user.email],
-            fail_silently=False,
-        )
+        # Письмо уходит из очереди transactional после коммита, запрос не ждет SMTP
+        from appNotification.transactional import send_transactional
+        send_transactional(subject, message, self.user.email)
 
 class UserActionLog(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
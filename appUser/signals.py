@@ -1,8 +1,7 @@
 from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
-from django.conf import settings
-from django.core.mail import send_mail
+from appNotification.transactional import send_transactional
 from .models import CustomUser, UserActionLog, EmailVerification
 
 
@@ -18,9 +17,11 @@ def log_user_creation(sender, instance, created, **kwargs):
             ip_address=None
         )
 
-        # Создаем верификацию и отправляем email
-        verification = EmailVerification.create_verification(instance)
-        verification.send_verification_email()
+        # Единственное место, где создается верификация нового аккаунта; уже активным
+        # (суперпользователь, подтвержденный email) она не нужна
+        if not instance.is_active and not instance.email_verified:
+            verification = EmailVerification.create_verification(instance)
+            verification.send_verification_email()
 
         # Для разработки - вывод в консоль
         print(f"\n=== USER CREATED ===")
@@ -90,14 +91,8 @@ def send_welcome_email(sender, instance, created, **kwargs):
         print(message)
         print("=====================\n")
 
-        # Отправляем настоящее письмо
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [instance.email],
-            fail_silently=False,
-        )
+        # Отправляем настоящее письмо из очереди transactional после коммита
+        send_transactional(subject, message, instance.email)
 
 
 @receiver(post_save, sender=UserActionLog)
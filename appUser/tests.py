@@ -1,3 +1,28 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from .email_backends import clear_captured, read_captured
+
+
+class CaptureEmailBackendTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base_path = os.path.join(directory.name, 'capture')
+        self.addCleanup(clear_captured, self.base_path)
+
+    def test_read_captured_stops_at_written_data(self):
+        """Читается только записанная часть файла, а не весь выделенный заранее хвост из нулей"""
+        with override_settings(EMAIL_CAPTURE_PATH=self.base_path, EMAIL_CAPTURE_SIZE=1024 * 1024,
+                               EMAIL_BACKEND='appUser.email_backends.CaptureEmailBackend'):
+            mail.send_mail('Привет', 'Текст письма', 'from@example.com', ['first@example.com'])
+            mail.send_mail('Hello', 'Body', 'from@example.com', ['second@example.com'])
+
+            captured = list(read_captured())
+
+        self.assertEqual([(record['to'], record['subject']) for record in captured],
+                         [(['first@example.com'], 'Привет'), (['second@example.com'], 'Hello')])
+        self.assertEqual(os.path.getsize(f'{self.base_path}.{os.getpid()}.jsonl'), 1024 * 1024)
@@ -10,7 +10,8 @@ from django.core.mail import send_mail
 from django.utils import timezone
 import pytz
 
-from .forms import RegistrationForm, ProfileForm, VerificationForm
+from appNotification.schedule import timezone_changed
+from .forms import RegistrationForm, ProfileForm, VerificationForm, QueuedPasswordResetForm
 from .models import CustomUser, EmailVerification, UserActionLog
 
 
@@ -32,12 +33,9 @@ class RegisterView(View):
         if form.is_valid():
             user = form.save(commit=False)
             user.is_active = False  # Пользователь не активен до подтверждения
+            # Верификацию создает и ставит в очередь сигнал log_user_creation
             user.save()
 
-            # Создаем верификацию через модель, а не через сигнал
-            verification = EmailVerification.create_verification(user)
-            verification.send_verification_email()
-
             messages.success(request, _(
                 'Registration successful! '
                 'Please check your email for verification link. '
@@ -135,6 +133,8 @@ def profile(request):
         form = ProfileForm(request.POST, request.FILES, instance=user)
         if form.is_valid():
             form.save()
+            if 'timezone' in form.changed_data:
+                timezone_changed(user.timezone)
             messages.success(request, _('Profile updated successfully!'))
             UserActionLog.objects.create(
                 user=user,
@@ -159,6 +159,8 @@ def set_timezone(request):
             request.session['django_timezone'] = timezone
             request.user.timezone = timezone
             request.user.save()
+            # Пользователь перейдет в корзину еженедельной рассылки своего пояса
+            timezone_changed(timezone)
             messages.success(request, _('Timezone updated successfully!'))
             UserActionLog.objects.create(
                 user=request.user,
@@ -196,7 +198,8 @@ def custom_password_reset(request):
                 template_name='appUser/password_reset.html',
                 email_template_name='appUser/password_reset_email.html',
                 subject_template_name='appUser/password_reset_subject.txt',
-                success_url='/user/password_reset/done/'
+                success_url='/user/password_reset/done/',
+                form_class=QueuedPasswordResetForm,
             )(request)
             return response
         except Exception as e:
@@ -207,5 +210,6 @@ def custom_password_reset(request):
         template_name='appUser/password_reset.html',
         email_template_name='appUser/password_reset_email.html',
         subject_template_name='appUser/password_reset_subject.txt',
-        success_url='/user/password_reset/done/'
+        success_url='/user/password_reset/done/',
+        form_class=QueuedPasswordResetForm,
     )(request)
@@ -65,8 +65,15 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # HTML email templates get their CSS inlined once when compiled; the cached loader keeps the result
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'appNotification.email_templates.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -120,7 +127,8 @@ USE_I18N = True
 USE_L10N = True
 USE_TZ = True
 
-# Locale paths
+# Locale paths. Compiled catalogs (django.mo) are committed next to django.po:
+# after editing a .po file run `python manage.py compilemessages` and commit both.
 LOCALE_PATHS = [
     os.path.join(BASE_DIR, 'locale'),
 ]
@@ -147,6 +155,11 @@ EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True').lower() in ('true', '1', 't')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 10))  # Seconds; a hung relay must not block a worker forever
+# appUser.email_backends.CaptureEmailBackend (load tests): per-process memory-mapped JSONL files
+EMAIL_CAPTURE_PATH = os.getenv('EMAIL_CAPTURE_PATH', os.path.join(BASE_DIR, 'logs', 'mail_capture'))
+EMAIL_CAPTURE_SIZE = 64 * 1024 * 1024  # Bytes pre-allocated per file, doubled when full
+EMAIL_CAPTURE_BODIES = os.getenv('EMAIL_CAPTURE_BODIES', 'True').lower() in ('true', '1', 't')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@localhost')
 SERVER_EMAIL = os.getenv('SERVER_EMAIL', DEFAULT_FROM_EMAIL)
 
@@ -190,19 +203,141 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = True
 
+# Celery queues: latency-sensitive mail never waits behind bulk fan-out or housekeeping
+CELERY_TASK_DEFAULT_QUEUE = 'transactional'
+CELERY_TASK_ROUTES = {
+    'appNotification.tasks.drain_outbox': {'queue': 'transactional'},
+    'appNotification.tasks.send_transactional_email': {'queue': 'transactional'},
+    'appNotification.tasks.drain_bulk_outbox': {'queue': 'fanout'},
+    'appNotification.tasks.send_news_notification': {'queue': 'fanout'},
+    'appNotification.tasks.send_news_notification_chunk': {'queue': 'fanout'},
+    'appNotification.tasks.send_post_notification': {'queue': 'fanout'},
+    'appNotification.tasks.send_post_notification_chunk': {'queue': 'fanout'},
+    'appNotification.tasks.send_weekly_newsletter': {'queue': 'fanout'},
+    'appNotification.tasks.send_weekly_posts_digest': {'queue': 'fanout'},
+    'appNotification.tasks.dispatch_digest_buckets': {'queue': 'fanout'},
+    'appNotification.tasks.send_digest_shard': {'queue': 'fanout'},
+    'appNotification.tasks.clean_old_delivery_keys': {'queue': 'maintenance'},
+    'appNotification.tasks.clean_old_outbox_messages': {'queue': 'maintenance'},
+    'appUser.tasks.clean_expired_verifications': {'queue': 'maintenance'},
+    'appUser.tasks.clean_old_user_logs': {'queue': 'maintenance'},
+}
+
+# Worker launch profiles, one per queue (see `manage.py run_celery_worker <profile>`)
+CELERY_WORKER_PROFILES = {
+    'transactional': {
+        'queues': ['transactional'],
+        'concurrency': int(os.getenv('CELERY_TRANSACTIONAL_CONCURRENCY', 4)),
+        'prefetch_multiplier': 1,  # Never hoard short tasks behind a slow one
+        'acks_late': True,  # Outbox delivery is idempotent, redeliver on worker loss
+    },
+    'fanout': {
+        'queues': ['fanout'],
+        'concurrency': int(os.getenv('CELERY_FANOUT_CONCURRENCY', 8)),
+        'prefetch_multiplier': 4,
+        'acks_late': True,  # Chunks are deduplicated by idempotency keys
+    },
+    'maintenance': {
+        'queues': ['maintenance'],
+        'concurrency': 1,
+        'prefetch_multiplier': 1,
+        'acks_late': False,
+    },
+}
+
+# acks_late follows the profile of the queue each task is routed to
+CELERY_TASK_ANNOTATIONS = {
+    task: {'acks_late': CELERY_WORKER_PROFILES[route['queue']]['acks_late']}
+    for task, route in CELERY_TASK_ROUTES.items()
+}
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+
+# Notification fan-out
+NOTIFICATION_CHUNK_SIZE = int(os.getenv('NOTIFICATION_CHUNK_SIZE', 500))  # Subscribers per chunk task
+NOTIFICATION_MAIL_BATCH_SIZE = int(os.getenv('NOTIFICATION_MAIL_BATCH_SIZE', 100))  # Messages per SMTP session
+NOTIFICATION_MAIL_RECONNECT_ATTEMPTS = 3
+NOTIFICATION_OUTBOX_BATCH_SIZE = int(os.getenv('NOTIFICATION_OUTBOX_BATCH_SIZE', 200))  # Rows claimed per drain step
+NOTIFICATION_OUTBOX_MAX_BATCHES = 50  # Drain steps per task run
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+NOTIFICATION_OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)  # Reclaim rows stuck in "sending"
+NOTIFICATION_RETRY_BASE_DELAY = timedelta(minutes=1)  # First retry of a transient SMTP failure
+NOTIFICATION_RETRY_MAX_DELAY = timedelta(hours=6)  # Cap for the exponential backoff
+NOTIFICATION_DIGEST_SHARD_SIZE = int(os.getenv('NOTIFICATION_DIGEST_SHARD_SIZE', 5000))  # Users per digest shard task
+NOTIFICATION_DIGEST_SHARD_TIMEOUT = timedelta(minutes=10)  # Re-dispatch shards silent for this long
+NOTIFICATION_WATERMARK_MAX_LOOKBACK = timedelta(days=30)  # Oldest content a digest may catch a user up on
+# Weekly digests go out per UTC-offset bucket once the local weekday (0 = Monday) and hour are reached
+NOTIFICATION_DIGEST_SCHEDULE = {
+    'newsletter': {'weekday': 0, 'hour': 9},
+    'posts': {'weekday': 0, 'hour': 10},
+}
+NOTIFICATION_DIGEST_CATCH_UP = timedelta(hours=12)  # A bucket whose hour passed longer ago waits for next week
+NOTIFICATION_DIGEST_TIMEZONES_TTL = timedelta(days=1)  # Cached list of user timezones; set_timezone keeps it current
+NOTIFICATION_TASK_LOCK_TTL = 300  # Seconds a singleton task lease survives without a heartbeat
+NOTIFICATION_COALESCE_WINDOW = timedelta(minutes=int(os.getenv('NOTIFICATION_COALESCE_MINUTES', 10)))  # 0 disables
+NOTIFICATION_DAILY_CAP = 20  # Post notification emails per user per day; the rest waits for the weekly digest
+NOTIFICATION_AUDIENCE_TTL = timedelta(hours=1)  # Cached subscriber index is rebuilt from the DB this often
+NOTIFICATION_SEGMENT_REFRESH = 30  # Seconds between checks for new subscriptions in the in-memory segment matrix
+NOTIFICATION_SEGMENT_MAX_AGE = timedelta(hours=1)  # Full rebuild also picks up bulk edits that bypass signals
+NOTIFICATION_PLANNING_HISTORY = timedelta(days=30)  # Past sends used to measure the rate for dry-run estimates
+NOTIFICATION_PLANNING_MIN_SAMPLE = 20  # Ignore fan-outs smaller than this when measuring the send rate
+NOTIFICATION_TRANSACTIONAL_DEADLINE = timedelta(hours=1)  # Verification/reset mail older than this is dropped
+NOTIFICATION_IDEMPOTENCY_TTL = timedelta(days=8)  # Cache lifetime of sent (event, recipient) keys
+NOTIFICATION_IDEMPOTENCY_RETENTION = timedelta(days=30)  # DB lifetime of sent keys
+# DB lifetime of delivered outbox rows; never shorter than NOTIFICATION_PLANNING_HISTORY, which reads them
+NOTIFICATION_OUTBOX_RETENTION = timedelta(days=45)
+
+# Outbound SMTP budgets (token buckets, shared through Redis when the cache is django_redis).
+# 'relay' limits the whole EMAIL_HOST, 'domains' adds per-provider limits by recipient domain.
+NOTIFICATION_RATE_LIMITS = {
+    'relay': {'per_second': 10, 'per_hour': 20000},
+    'domains': {
+        'gmail.com': {'per_second': 5, 'per_hour': 8000},
+        'mail.ru': {'per_second': 5, 'per_hour': 8000},
+        'yandex.ru': {'per_second': 5, 'per_hour': 8000},
+    },
+}
+NOTIFICATION_RATE_LIMIT_MAX_WAIT = 2  # Seconds a task may sleep for a token before rescheduling
+NOTIFICATION_ASYNC_SESSIONS = int(os.getenv('NOTIFICATION_ASYNC_SESSIONS', 4))  # Concurrent SMTP sessions for big batches
+NOTIFICATION_ASYNC_MIN_MESSAGES = 200  # Smaller batches use the single pooled connection
+NOTIFICATION_ASYNC_QUEUE_SIZE = 100  # Bounded hand-off queue between producer and sessions
+
+# SMTP circuit breaker (state shared through the cache). When the share of failed or slow sends
+# in the current window reaches 'failure_rate', sending stops for 'open_seconds' and messages stay
+# in the outbox / task retry queue; then a single half-open probe decides whether to close again.
+NOTIFICATION_CIRCUIT_BREAKER = {
+    'window': 60,  # Seconds per statistics window
+    'min_calls': 10,  # Sends in the window before the rate is trusted
+    'failure_rate': 0.5,
+    'slow_call': 5,  # Seconds; slower sends count as failures
+    'open_seconds': 30,
+    'probe_timeout': 60,  # Another probe is allowed if the previous one never reported back
+}
+
 # Celery beat schedule
 CELERY_BEAT_SCHEDULE = {
     'clean-expired-verifications': {
         'task': 'appUser.tasks.clean_expired_verifications',
         'schedule': timedelta(hours=6),
     },
-    'send-weekly-newsletter': {
-        'task': 'appNotification.tasks.send_weekly_newsletter',
-        'schedule': timedelta(seconds=30),  # For testing - every 30 seconds
+    'dispatch-digest-buckets': {
+        'task': 'appNotification.tasks.dispatch_digest_buckets',
+        'schedule': timedelta(minutes=15),  # Some timezones are offset by 30 or 45 minutes
+    },
+    'drain-notification-outbox': {
+        'task': 'appNotification.tasks.drain_outbox',
+        'schedule': timedelta(minutes=1),  # Safety net for messages whose wake-up was lost
+    },
+    'drain-bulk-notification-outbox': {
+        'task': 'appNotification.tasks.drain_bulk_outbox',
+        'schedule': timedelta(minutes=5),  # Retries failed fan-out rows
+    },
+    'clean-old-delivery-keys': {
+        'task': 'appNotification.tasks.clean_old_delivery_keys',
+        'schedule': timedelta(days=1),
     },
-    'send-weekly-posts-digest': {
-        'task': 'appNotification.tasks.send_weekly_posts_digest',
-        'schedule': timedelta(seconds=45),  # For testing - every 45 seconds
+    'clean-old-outbox-messages': {
+        'task': 'appNotification.tasks.clean_old_outbox_messages',
+        'schedule': timedelta(days=1),
     },
     'clean-old-user-logs': {
         'task': 'appUser.tasks.clean_old_user_logs',
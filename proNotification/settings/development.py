@@ -29,6 +29,8 @@ DEBUG_TOOLBAR_CONFIG = {
 
 # Email settings for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# For load tests use the capture backend, console output would dominate the run:
+# EMAIL_BACKEND = 'appUser.email_backends.CaptureEmailBackend'
 
 # Database settings for development
 # You can override database settings here if needed
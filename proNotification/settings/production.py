@@ -55,18 +55,6 @@ DATABASES = {
 CELERY_TASK_ALWAYS_EAGER = False
 CELERY_TASK_EAGER_PROPAGATES = False
 
-# Update Celery beat schedule for production
-CELERY_BEAT_SCHEDULE.update({
-    'send-weekly-newsletter': {
-        'task': 'appNotification.tasks.send_weekly_newsletter',
-        'schedule': timedelta(weeks=1),  # Every week
-    },
-    'send-weekly-posts-digest': {
-        'task': 'appNotification.tasks.send_weekly_posts_digest',
-        'schedule': timedelta(weeks=1),  # Every week
-    },
-})
-
 # Cache for production (Redis example)
 CACHES = {
     'default': {